@@ -0,0 +1,39 @@
+# This script measures crawl throughput against the local stand-in server (no network access needed).
+# Usage: python bench_crawl.py [--latency 0.05] [--concurrency 1 8 32] [--limit 300]
+import argparse
+import asyncio
+import time
+
+from crawler import crawl_recycling_data
+from standin import StandinServer, load_item_fixture
+
+
+def run(items, base_url, concurrency, rate):
+    start = time.perf_counter()
+    recycling_data, failed = asyncio.run(
+        crawl_recycling_data(items, base_url=base_url, concurrency=concurrency, rate=rate, backoff=0.05, verbose=False)
+    )
+    elapsed = time.perf_counter() - start
+    return len(recycling_data), failed, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of responses that are 503s")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--rate", type=float, default=0, help="Per-host rate limit (0 = unlimited)")
+    parser.add_argument("--limit", type=int, default=300, help="Number of items to crawl")
+    args = parser.parse_args()
+
+    items = load_item_fixture()
+    items = dict(list(items.items())[: args.limit])
+
+    with StandinServer(items, latency=args.latency, error_rate=args.error_rate) as server:
+        print(f"Stand-in server at {server.base_url} ({len(server.pages)} pages, {args.latency * 1000:.0f} ms latency)")
+        for concurrency in args.concurrency:
+            parsed, failed, elapsed = run(items, server.base_url, concurrency, args.rate)
+            print(
+                f"concurrency={concurrency:<4} parsed={parsed:<5} failed={failed:<4} "
+                f"{elapsed:7.2f}s  {len(items) / elapsed:8.1f} items/s"
+            )
@@ -0,0 +1,115 @@
+# This script compares per-icon cv2.matchTemplate against the batched FFT matcher as the
+# number of icons grows, on a synthetic inventory screenshot, along with the perceptual
+# hash prefilter (how many of the placed icons it still finds), and measures how bulk
+# detection scales with worker processes.
+# Usage: python bench_detect.py [--icons 25 50 100 200] [--size 1920 1080] [--icon-size 64]
+#        python bench_detect.py --workers 1 2 4 [--screenshots 16]
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from detect_items import find_icons_in_image, find_icons_in_images
+from fft_matcher import FFTMatcher
+from icon_hash import HashIndex
+from standin_images import render_inventory, synthetic_icons, write_icons
+from template_bank import TemplateBank
+
+THRESHOLD = 0.7
+
+
+def above_threshold(scored):
+    """
+    Collect (icon, y, x) of every score over the threshold from (icon, scores) pairs.
+    """
+    return {(i, int(y), int(x)) for i, result in scored for y, x in zip(*np.nonzero(result >= THRESHOLD))}
+
+
+def opencv_matches(bank, image):
+    return above_threshold((i, cv2.matchTemplate(image, bank.template(i), cv2.TM_CCOEFF_NORMED)) for i in range(len(bank)))
+
+
+def timed(function, rounds=3):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_workers(args):
+    """
+    Screenshots per second through find_icons_in_images for each worker count.
+    """
+    icons = synthetic_icons(args.icons[-1], args.icon_size)
+    with tempfile.TemporaryDirectory() as folder:
+        icons_folder = os.path.join(folder, "icons")
+        write_icons(icons, icons_folder)
+        paths = []
+        for i in range(args.screenshots):
+            screenshot, _ = render_inventory(icons, columns=12, rows=8, size=tuple(args.size), seed=i)
+            paths.append(os.path.join(folder, f"screenshot{i}.png"))
+            cv2.imwrite(paths[-1], screenshot)
+
+        # Build the bank and compile the numba kernels before timing
+        find_icons_in_image(icons_folder, paths[0], THRESHOLD)
+        start = time.perf_counter()
+        for path in paths:
+            find_icons_in_image(icons_folder, path, THRESHOLD)
+        serial = args.screenshots / (time.perf_counter() - start)
+        print(f"{len(icons)} icons, {args.screenshots} screenshots, {os.cpu_count()} CPUs")
+        print(f"{'workers':>8} {'images/s':>9} {'scaling':>8}")
+        print(f"{'serial':>8} {serial:>9.2f} {1:>7.2f}x")
+        for workers in args.workers:
+            # One untimed screenshot per worker starts the pool and compiles the numba kernels
+            list(find_icons_in_images(icons_folder, paths[:workers], THRESHOLD, workers=workers))
+            start = time.perf_counter()
+            list(find_icons_in_images(icons_folder, paths, THRESHOLD, workers=workers))
+            rate = args.screenshots / (time.perf_counter() - start)
+            print(f"{workers:>8} {rate:>9.2f} {rate / serial:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--icons", type=int, nargs="+", default=[25, 50, 100, 200])
+    parser.add_argument("--size", type=int, nargs=2, default=[1920, 1080])
+    parser.add_argument("--icon-size", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--workers", type=int, nargs="+", help="Measure bulk detection with these worker counts instead")
+    parser.add_argument("--screenshots", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.workers:
+        bench_workers(args)
+        raise SystemExit
+
+    print(f"Screenshot {args.size[0]}x{args.size[1]}, icons {args.icon_size}px")
+    print(f"{'icons':>6} {'opencv ms':>10} {'fft ms':>10} {'fft cold':>10} {'speedup':>8} {'same matches':>13} "
+          f"{'hash ms':>8} {'hash found':>11}")
+    for count in args.icons:
+        icons = synthetic_icons(count, args.icon_size)
+        screenshot, truth = render_inventory(icons, columns=12, rows=8, size=tuple(args.size))
+        image = cv2.cvtColor(screenshot, cv2.COLOR_BGR2GRAY)
+        bank = TemplateBank.from_images([name for name, _ in icons], [cv2.cvtColor(icon, cv2.COLOR_BGR2GRAY) for _, icon in icons])
+
+        opencv_time, reference = timed(lambda: opencv_matches(bank, image), args.rounds)
+        # The first run also computes the template spectra, later runs reuse them
+        matcher = FFTMatcher(bank)
+        cold_time, _ = timed(lambda: above_threshold(matcher.match(image)), 1)
+        fft_time, batched = timed(lambda: above_threshold(matcher.match(image)), args.rounds)
+
+        # The first lookup also hashes the icons and compiles the kernel
+        index = HashIndex(bank)
+        index.candidates(image, THRESHOLD)
+        hash_time, (xs, ys, _, found) = timed(lambda: index.candidates(image, THRESHOLD), args.rounds)
+        placed = {(icon["item"], icon["x"], icon["y"]) for icon in truth}
+        hits = len(placed & {(bank.names[i], x, y) for x, y, i in zip(xs.tolist(), ys.tolist(), found.tolist())})
+
+        same = reference == batched
+        print(f"{count:>6} {opencv_time * 1000:>10.0f} {fft_time * 1000:>10.0f} {cold_time * 1000:>10.0f} "
+              f"{opencv_time / fft_time:>7.2f}x {str(same):>13} {hash_time * 1000:>8.0f} {f'{hits}/{len(placed)}':>11}")
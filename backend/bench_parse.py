@@ -0,0 +1,160 @@
+# This script checks the fast recycling-tab parser against the full html.parser tree and
+# measures parse throughput for both. The fixture pages are synthetic: rendered by
+# standin.render_item_page and edited into the markup edge cases the parser has to handle.
+# Pages recorded from the real site (python bench_suite.py --record-corpus) are checked too
+# when they are there.
+# Usage: python bench_parse.py [--rounds 5] [--write-corpus]
+import argparse
+import json
+import os
+import re
+import time
+
+from recycler import FAST_TREE_BUILDER, parse_recycler_data
+from standin import load_corpus as load_recorded_corpus, render_item_page
+
+# The synthetic pages build_corpus writes
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "synthetic_pages")
+
+
+def _outputs(guaranteed, extra=()):
+    return {
+        "guaranteed_output": [{"item": item, "quantity": quantity} for item, quantity in guaranteed],
+        "extra_chance_output": [{"item": item, "chance": chance} for item, chance in extra],
+    }
+
+
+def _pretty(page):
+    # Put every tag on its own line, the way a server-side template usually renders
+    return re.sub(r"><", ">\n  <", page)
+
+
+def build_corpus():
+    """
+    Build the synthetic fixture pages: rendered rusthelp-like pages plus the markup edge
+    cases the parser handles. Returns a dict of file name -> HTML.
+    """
+    gloves = _outputs([("Leather", "2"), ("Sewing Kit", "1")], [("Cloth", "25%")])
+    rifle = _outputs([("Metal Fragments", "12"), ("High Quality Metal", "2"), ("Rifle Body", "1")], [("Metal Spring", "50%"), ("Tech Trash", "10%")])
+    pipe = _outputs([("Scrap", "5"), ("Metal Fragments", "6")])
+
+    pages = {
+        "tactical-gloves.html": render_item_page("Tactical Gloves", gloves, filler=400),
+        "assault-rifle.html": render_item_page("Assault Rifle", rifle, filler=400),
+        "metal-pipe.html": render_item_page("Metal Pipe", pipe, filler=400),
+        "pretty-printed.html": _pretty(render_item_page("Assault Rifle", rifle, filler=400)),
+        "no-recycling-tab.html": render_item_page("Wood", None, filler=400),
+        "no-extra-outputs.html": render_item_page("Metal Pipe", _outputs([("Scrap", "5")]), filler=400),
+        "entities.html": render_item_page("Rock & Roll", _outputs([("Rock & Stone", "3"), ("\"Quoted\" <Item>", "1")], [("Café", "5%")])),
+    }
+
+    page = render_item_page("Tactical Gloves", gloves, filler=400)
+    # Tab with no table in it
+    pages["tab-without-table.html"] = re.sub(r"<table.*?</table>", "<p>Not recyclable</p>", page.split('<div id="recycling-tab"')[0]) + \
+        '<div id="recycling-tab" class="tab-panel"><p>Not recyclable</p></div></main></body></html>'
+    # A table in the tab that isn't a recycling table
+    pages["wrong-headers.html"] = page.replace("<th>Recycler</th>", "<th>Workbench</th>")
+    # Outputs without an img alt fall back to the tooltip, then to "Unknown Item"
+    pages["missing-alt.html"] = page.replace('alt="Leather"', "").replace('alt="Sewing Kit"', "").replace("<span>Sewing Kit</span>", "").replace(
+        '<div class="absolute w-full invisible"></div>', "")
+    # Quantities that are missing or have no × sign
+    pages["odd-quantities.html"] = page.replace("×2", "2").replace('<p class="w-full font-semibold text-nowrap text-center">×1</p>', "")
+    # Only the two leading columns
+    pages["two-columns.html"] = re.sub(r"<td><div class=\"flex flex-wrap gap-2\">(<div class=\"relative h-fit group/popover\">.{0,400}?Cloth.*?)</div></td></tr>", "</tr>", page)
+    # Upper case tags, single quoted id and a comment that contains div tags
+    pages["odd-markup.html"] = page.replace('<div id="recycling-tab" class="tab-panel">', "<DIV id='recycling-tab' class='tab-panel'><!-- <div> </div></div> -->").replace(
+        "</table></div></div>", "</table></div></DIV>")
+    # Only a Safezone recycler row
+    pages["safezone-only.html"] = re.sub(r"<tr><td><a href=\"/recyclers\">Radtown Recycler.*?</tr>", "", page)
+    # Unclosed tab (truncated download) must still parse the same way html.parser does
+    pages["truncated.html"] = page[: page.index("</tbody>") + 8]
+    # Other elements whose ids start with the tab's id, or with the id in another attribute,
+    # before the real tab
+    pages["decoy-ids.html"] = page.replace(
+        '<div id="recycling-tab" class="tab-panel">',
+        '<div id="recycling-tab-preview"><p>Preview</p></div><div data-id="recycling-tab"></div><div id="recycling-tab" class="tab-panel">',
+    )
+    # Unquoted attributes
+    pages["unquoted-id.html"] = page.replace('<div id="recycling-tab" class="tab-panel">', "<div id=recycling-tab class=tab-panel>")
+    # Invalid nesting that HTML5 parsers repair differently than html.parser: a paragraph
+    # inside the quantity paragraph, and an unclosed cell
+    before, tab = page.split('<div id="recycling-tab"', 1)
+    tab = tab.replace(">×2</p>", ">×2<p>junk</p></p>", 1).replace("</td></tr>", "</tr>", 1)
+    pages["nested-paragraphs.html"] = before + '<div id="recycling-tab"' + tab
+    # The tab's markup in a script and in an attribute value before the real tab, and
+    # div tags in a script and an attribute inside it, none of which are tags
+    decoys = ("<script>var tab = '<div id=\"recycling-tab\"></div>';</script>"
+              "<a title='<div id=\"recycling-tab\">' href=\"#\">Recycling</a>")
+    pages["script-decoy.html"] = before + decoys + '<div id="recycling-tab"' + tab.replace(
+        "<table", '<script>document.write("</div></div>")</script><span title="</div>"></span><div class="spacer"/><table', 1)
+    # A script that is never closed before the tab turns the rest of the page into text
+    pages["unclosed-script.html"] = before + "<script>var x = 1;" + '<div id="recycling-tab"' + tab
+    return pages
+
+
+def write_corpus():
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    for name, page in build_corpus().items():
+        with open(os.path.join(CORPUS_DIR, name), "w", encoding="utf-8") as f:
+            f.write(page)
+    print(f"Wrote corpus to {CORPUS_DIR}")
+
+
+def load_corpus():
+    pages = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".html"):
+            with open(os.path.join(CORPUS_DIR, name), "r", encoding="utf-8") as f:
+                pages[name] = f.read()
+    # Real pages, if a corpus was recorded
+    recorded = load_recorded_corpus()
+    if recorded is not None:
+        for item_name, page in recorded[1].items():
+            pages[f"recorded/{item_name}"] = page
+    return pages
+
+
+def check_identical(pages):
+    """
+    Compare the serialized output of both parser modes on every page. Returns the mismatches.
+    """
+    mismatches = []
+    for name, page in pages.items():
+        for no_safezone in (False, True):
+            full = json.dumps(parse_recycler_data(page, no_safezone, parser="full"))
+            fast = json.dumps(parse_recycler_data(page, no_safezone, parser="fast"))
+            if full != fast:
+                mismatches.append((name, no_safezone, full, fast))
+    return mismatches
+
+
+def throughput(pages, mode, rounds):
+    size = sum(len(page) for page in pages.values())
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for page in pages.values():
+            parse_recycler_data(page, no_safezone=True, parser=mode)
+    elapsed = time.perf_counter() - start
+    count = len(pages) * rounds
+    return count / elapsed, size * rounds / elapsed / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--write-corpus", action="store_true", help="Regenerate the fixture pages first")
+    args = parser.parse_args()
+
+    if args.write_corpus:
+        write_corpus()
+    pages = load_corpus()
+
+    mismatches = check_identical(pages)
+    for name, no_safezone, full, fast in mismatches:
+        print(f"MISMATCH {name} (no_safezone={no_safezone})\n  full: {full}\n  fast: {fast}")
+    print(f"{len(pages)} pages, {len(mismatches)} mismatches between parser modes")
+
+    for mode in ("full", "fast"):
+        pages_per_second, mb_per_second = throughput(pages, mode, args.rounds)
+        builder = FAST_TREE_BUILDER if mode == "fast" else "html.parser"
+        print(f"{mode:<5} ({builder:<11}) {pages_per_second:8.1f} pages/s {mb_per_second:7.2f} MB/s")
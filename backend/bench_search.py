@@ -0,0 +1,73 @@
+# This script compares the indexed search against the original linear scan as the catalogue grows.
+# Usage: python bench_search.py [--scales 1 4 16] [--rounds 20]
+import argparse
+import random
+import time
+
+from search import SearchIndex
+from standin import load_item_fixture
+
+QUERIES = [
+    "wood", "rifle", "ak", "metal frag", "asault rifle", "hat.wolf", "scrap", "semi",
+    "rocket launchr", "door", "gloves", "tech", "garage", "xyzq", "s", "helmet",
+]
+
+
+def scan_search(items, query):
+    """
+    The original search: a linear scan lower-casing every name and shortname per request.
+    """
+    results = []
+    for item in items.values():
+        if query.lower() in item["name"].lower() or query.lower() in item["shortname"].lower():
+            results.append(item)
+    return results
+
+
+def scaled_catalogue(items, scale):
+    """
+    Grow the catalogue by adding renamed copies of every item.
+    """
+    if scale == 1:
+        return dict(items)
+    rng = random.Random(scale)
+    scaled = {}
+    for copy in range(scale):
+        for shortname, item in items.items():
+            suffix = "" if copy == 0 else f" {rng.choice(['mk', 'alt', 'prime', 'old', 'new'])}{copy}"
+            scaled[f"{shortname}{suffix}"] = dict(item, name=item["name"] + suffix, shortname=shortname + suffix.replace(" ", "."))
+    return scaled
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def measure(search, rounds):
+    samples = []
+    for _ in range(rounds):
+        for query in QUERIES:
+            start = time.perf_counter()
+            search(query)
+            samples.append((time.perf_counter() - start) * 1000)
+    return percentiles(samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20, help="Page size for the indexed search")
+    args = parser.parse_args()
+
+    base = load_item_fixture()
+    print(f"{'items':>7} {'build ms':>9} {'scan p50':>9} {'scan p99':>9} {'index p50':>10} {'index p99':>10}  (ms)")
+    for scale in args.scales:
+        items = scaled_catalogue(base, scale)
+        start = time.perf_counter()
+        index = SearchIndex(items)
+        build = (time.perf_counter() - start) * 1000
+        scan_p50, scan_p99 = measure(lambda query: scan_search(items, query), args.rounds)
+        index_p50, index_p99 = measure(lambda query: index.search(query, limit=args.limit), args.rounds)
+        print(f"{len(items):>7} {build:>9.0f} {scan_p50:>9.3f} {scan_p99:>9.3f} {index_p50:>10.3f} {index_p99:>10.3f}")
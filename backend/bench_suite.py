@@ -0,0 +1,606 @@
+# This script runs the end-to-end benchmarks offline and compares them with a saved baseline:
+# parsing item pages, loading the item list, search, a crawl of the local stand-in server,
+# detection on synthetic inventory screenshots with known ground truth (precision and
+# recall), load on the API routes through an in-process ASGI driver, and the server's cold
+# start (import time, time to the first answer, memory per worker). Item pages come
+# from the recorded corpus when there is one (see --record-corpus), and are rendered from
+# synthetic recycling data otherwise. Every benchmark runs in a fresh process, so the peak
+# RSS it reports is its own. The api benchmark needs httpx (pip install -r requirements-dev.txt).
+# Usage: python bench_suite.py [--only parse items search crawl detect api startup] [--quick] [--save]
+#        python bench_suite.py --record-corpus [--base-url https://rusthelp.com] [--limit 200]
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# The benchmarks, in the order they run
+BENCHMARKS = ["parse", "items", "search", "crawl", "detect", "api", "startup"]
+# Where --save writes the results, and what later runs compare with
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+# Changes smaller than this fraction of the baseline aren't flagged
+TOLERANCE = 0.10
+# Metrics ending in these are better when higher; every other number is better when lower
+HIGHER_IS_BETTER = ("per_s", "precision", "recall", "parsed")
+# A detection within this many pixels of a placed icon of the same item counts as finding it
+POSITION_TOLERANCE = 3
+# Seconds a server started by the startup benchmark gets to answer before it counts as failed
+STARTUP_TIMEOUT = 120
+
+
+def latency_summary(samples):
+    """
+    Summarize latencies in seconds as p50 / p99 / mean milliseconds.
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+    }
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB, or None where it can't be read (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def load_pages(limit=None):
+    """
+    Return (items, {item name: page HTML}, source) from the recorded corpus, or pages
+    rendered from synthetic recycling data when nothing was recorded.
+    """
+    from standin import load_corpus, load_item_fixture, render_item_page, synthetic_recycling_data
+
+    corpus = load_corpus()
+    if corpus is not None and corpus[1]:
+        items, pages = corpus
+        source = "recorded"
+    else:
+        items = load_item_fixture()
+        data = synthetic_recycling_data(items)
+        pages = {item["name"]: render_item_page(item["name"], data.get(item["name"])) for item in items.values() if item.get("name")}
+        source = "synthetic"
+    if limit:
+        pages = dict(list(pages.items())[:limit])
+        items = {key: item for key, item in items.items() if item.get("name") in pages}
+    return items, pages, source
+
+
+def bench_parse(args):
+    from recycler import parse_recycler_data
+
+    _, pages, source = load_pages(args.limit)
+    samples = []
+    size = sum(len(page) for page in pages.values())
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for page in pages.values():
+            began = time.perf_counter()
+            parse_recycler_data(page, no_safezone=True)
+            samples.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    return {
+        "source": source,
+        "pages": len(pages),
+        "pages_per_s": round(len(samples) / elapsed, 1),
+        "mb_per_s": round(size * args.rounds / elapsed / 1e6, 2),
+        **latency_summary(samples),
+    }
+
+
+def bench_items(args):
+    from items import Catalogue, scrape_item_list
+    from standin import ITEMS_FIXTURE, StandinServer, load_item_fixture
+
+    # Loading items.json from scratch (what every process start pays)
+    loads = []
+    for _ in range(args.rounds):
+        catalogue = Catalogue(ITEMS_FIXTURE, max_age=float("inf"))
+        began = time.perf_counter()
+        catalogue.current()
+        loads.append(time.perf_counter() - began)
+
+    # get_items() once loaded (what every request pays)
+    lookups = []
+    for _ in range(args.rounds * 1000):
+        began = time.perf_counter()
+        catalogue.current()
+        lookups.append(time.perf_counter() - began)
+
+    # Fetching and converting the item list, from the stand-in server
+    items = load_item_fixture()
+    scrapes = []
+    with StandinServer(items, latency=0) as server:
+        for _ in range(args.rounds):
+            began = time.perf_counter()
+            scraped = scrape_item_list(f"{server.base_url}/downloads/admin-item-list-public.json")
+            scrapes.append(time.perf_counter() - began)
+    return {
+        "items": len(scraped) if isinstance(scraped, dict) else 0,
+        "load_ms": latency_summary(loads)["p50_ms"],
+        "lookup_per_s": round(len(lookups) / sum(lookups), 1),
+        "scrape_ms": latency_summary(scrapes)["p50_ms"],
+    }
+
+
+def bench_search(args):
+    from bench_search import QUERIES
+    from search import SearchIndex
+    from standin import load_item_fixture
+
+    items = load_item_fixture()
+    began = time.perf_counter()
+    index = SearchIndex(items)
+    build = time.perf_counter() - began
+    samples = []
+    for _ in range(args.rounds * 10):
+        for query in QUERIES:
+            began = time.perf_counter()
+            index.search(query, limit=20)
+            samples.append(time.perf_counter() - began)
+    return {
+        "items": len(items),
+        "build_ms": round(build * 1000, 1),
+        "queries_per_s": round(len(samples) / sum(samples), 1),
+        **latency_summary(samples),
+    }
+
+
+def bench_crawl(args):
+    from crawler import crawl_recycling_data
+    from standin import StandinServer
+
+    items, pages, source = load_pages(args.limit)
+    with StandinServer(items, pages=pages, latency=args.latency) as server:
+        began = time.perf_counter()
+        recycling_data, failed = asyncio.run(crawl_recycling_data(
+            items, base_url=server.base_url, concurrency=args.concurrency, rate=0, backoff=0.05, verbose=False,
+        ))
+        elapsed = time.perf_counter() - began
+    return {
+        "source": source,
+        "items": len(items),
+        "parsed": len(recycling_data),
+        "failed": failed,
+        "items_per_s": round(len(items) / elapsed, 1),
+        "elapsed_ms": round(elapsed * 1000, 1),
+    }
+
+
+def detection_icons(count):
+    """
+    Icons to draw screenshots with: the downloaded icons of the most common size when there
+    are enough of them, synthetic icons otherwise. Returns ((name, BGR image) list, source).
+    """
+    import cv2
+
+    from detect_service import ICONS_DIR
+    from standin_images import synthetic_icons
+    from template_bank import icon_files
+
+    by_size = {}
+    if os.path.isdir(ICONS_DIR):
+        for path in icon_files(ICONS_DIR):
+            icon = cv2.imread(str(path), cv2.IMREAD_COLOR)
+            if icon is not None:
+                by_size.setdefault(icon.shape[:2], []).append((path.stem, icon))
+    icons = max(by_size.values(), key=len) if by_size else []
+    if len(icons) >= 20:
+        return icons[:count], "downloaded"
+    return synthetic_icons(count), "synthetic"
+
+
+def score_detections(found, truth):
+    """
+    Match detections one-to-one with the placed icons. Returns (true positives, false
+    positives, false negatives).
+    """
+    unmatched = list(truth)
+    true_positives = 0
+    detections = 0
+    for name, icon in found.items():
+        for x, y in icon["positions"]:
+            detections += 1
+            for k, placed in enumerate(unmatched):
+                if placed["item"] == name and abs(placed["x"] - x) <= POSITION_TOLERANCE and abs(placed["y"] - y) <= POSITION_TOLERANCE:
+                    true_positives += 1
+                    del unmatched[k]
+                    break
+    return true_positives, detections - true_positives, len(unmatched)
+
+
+def bench_detect(args):
+    import cv2
+
+    from detect_items import find_icons_in_image
+    from standin_images import render_inventory
+    from template_bank import TemplateBank
+
+    icons, source = detection_icons(args.icons)
+    bank = TemplateBank.from_images([name for name, _ in icons], [cv2.cvtColor(icon, cv2.COLOR_BGR2GRAY) for _, icon in icons])
+    # Vary where the grid starts, so icons don't always sit on even pixels
+    screenshots = [
+        render_inventory(icons, columns=12, rows=8, origin=(40 + 7 * k % 13, 40 + 5 * k % 11), seed=k)
+        for k in range(args.screenshots)
+    ]
+    modes = {
+        "grid": {"mode": "grid"},
+        "prefilter": {"mode": "sliding", "prefilter": True},
+        "sliding": {"mode": "sliding"},
+    }
+    if args.quick:
+        del modes["sliding"]
+
+    results = {"source": source, "icons": len(icons), "screenshots": len(screenshots)}
+    for label, options in modes.items():
+        # Compile the kernels and build the per-bank caches before timing
+        find_icons_in_image(bank, screenshots[0][0], **options)
+        samples = []
+        totals = [0, 0, 0]
+        for screenshot, truth in screenshots:
+            began = time.perf_counter()
+            found = find_icons_in_image(bank, screenshot, **options)
+            samples.append(time.perf_counter() - began)
+            for k, count in enumerate(score_detections(found, truth)):
+                totals[k] += count
+        true_positives, false_positives, false_negatives = totals
+        results[label] = {
+            "images_per_s": round(len(samples) / sum(samples), 2),
+            **latency_summary(samples),
+            "precision": round(true_positives / max(1, true_positives + false_positives), 4),
+            "recall": round(true_positives / max(1, true_positives + false_negatives), 4),
+        }
+    return results
+
+
+async def drive(client, requests, concurrency):
+    """
+    Send (route, method, url, options) requests through an httpx client with `concurrency`
+    requests in flight. Returns ({route: latencies}, errors, elapsed seconds).
+    """
+    queue = list(reversed(requests))
+    latencies = {}
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            route, method, url, options = queue.pop()
+            began = time.perf_counter()
+            response = await client.request(method, url, **options)
+            latencies.setdefault(route, []).append(time.perf_counter() - began)
+            if response.status_code >= 400:
+                errors += 1
+
+    began = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - began
+
+
+async def _bench_api(args, workdir):
+    import cv2
+    import httpx
+
+    from bench_search import QUERIES
+    from detect_service import DetectService
+    from main import create_app
+    from manifest import atomic_write_json
+    from recycler_service import RecyclerService, RecyclingDataset
+    from standin import load_item_fixture, synthetic_recycling_data
+    from standin_images import render_inventory, synthetic_icons, write_icons
+
+    items = load_item_fixture()
+    data = synthetic_recycling_data(items)
+    data_file = os.path.join(workdir, "all_recycling_data.json")
+    atomic_write_json(data, data_file, indent=2)
+    # Icons named after real items, so detections resolve to names with recycling data
+    recyclable = [item for item in items.values() if item["name"] in data]
+    icons = [(item["shortname"], icon) for item, (_, icon) in zip(recyclable, synthetic_icons(min(args.icons, len(recyclable))))]
+    icons_folder = os.path.join(workdir, "images")
+    write_icons(icons, icons_folder)
+    uploads = []
+    for k in range(args.screenshots):
+        screenshot, _ = render_inventory(icons, columns=6, rows=4, seed=k)
+        uploads.append(cv2.imencode(".png", screenshot)[1].tobytes())
+
+    app = create_app(
+        recycler_service=RecyclerService(dataset=RecyclingDataset(data_file)),
+        detect_service=DetectService(icons_folder, cache_folder=None),
+    )
+    names = sorted(data)[:50]
+    requests = []
+    for k in range(args.requests):
+        name = names[k % len(names)]
+        requests.extend([
+            ("search", "GET", "/search", {"params": {"name": QUERIES[k % len(QUERIES)], "limit": 20}}),
+            ("recycler", "GET", "/recycler", {"params": {"name": name}}),
+            ("yield", "GET", "/yield", {"params": {"name": name, "quantity": 3}}),
+            ("yield_batch", "POST", "/yield/batch", {"json": {"inventories": [{n: 2 for n in names[k % 10:k % 10 + 10]}]}}),
+        ])
+        if k % 10 == 0:
+            requests.append(("items", "GET", "/items", {}))
+    # Detection is slower than the rest put together, so it is driven on its own
+    detections = [("detect", "POST", "/detect", {"content": upload}) for upload in uploads]
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # One request per route first, so first-call costs (indexes, graphs) aren't timed
+            await drive(client, requests[:5], 1)
+            latencies, errors, elapsed = await drive(client, requests, args.concurrency)
+            detect_latencies, detect_errors, detect_elapsed = await drive(client, detections, 2)
+
+    results = {
+        "requests_per_s": round(len(requests) / elapsed, 1),
+        "errors": errors + detect_errors,
+        **latency_summary([sample for samples in latencies.values() for sample in samples]),
+    }
+    for route, samples in sorted(latencies.items()):
+        results[route] = latency_summary(samples)
+    results["detect"] = {"images_per_s": round(len(detections) / detect_elapsed, 2), **latency_summary(detect_latencies["detect"])}
+    return results
+
+
+def bench_api(args):
+    # The item catalogue is read from items.json in the working directory; a fresh copy in
+    # a scratch folder keeps it from being refetched mid-run
+    from standin import ITEMS_FIXTURE
+
+    workdir = tempfile.mkdtemp(prefix="bench-api-")
+    try:
+        shutil.copy(ITEMS_FIXTURE, os.path.join(workdir, "items.json"))
+        os.chdir(workdir)
+        return asyncio.run(_bench_api(args, workdir))
+    finally:
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def process_memory_mb(pid):
+    """
+    Return (RSS, PSS) of a process in MB, or (None, None) where /proc can't be read.
+    PSS splits pages shared between processes evenly, so it is what a worker really costs.
+    """
+    values = {}
+    for path in (f"/proc/{pid}/status", f"/proc/{pid}/smaps_rollup"):
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    key, _, value = line.partition(":")
+                    if key in ("VmRSS", "Pss"):
+                        values[key] = round(int(value.split()[0]) / 1024, 1)
+        except OSError:
+            pass
+    return values.get("VmRSS"), values.get("Pss")
+
+
+def _get_json(url):
+    import urllib.error
+    import urllib.request
+
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.loads(response.read())
+    except (OSError, urllib.error.URLError, ValueError):
+        return None
+
+
+def _start_server(workdir, workers, lazy):
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+               "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    if lazy:
+        command.append("--lazy-detection")
+    began = time.perf_counter()
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process, f"http://127.0.0.1:{port}", began
+
+
+def _measure_server(workdir, workers, lazy):
+    process, base_url, began = _start_server(workdir, workers, lazy)
+    results = {}
+    try:
+        deadline = began + STARTUP_TIMEOUT
+        while _get_json(f"{base_url}/search?name=wood&limit=1") is None:
+            if process.poll() is not None or time.perf_counter() > deadline:
+                return {"error": "the server didn't start"}
+            time.sleep(0.01)
+        results["ready_ms"] = round((time.perf_counter() - began) * 1000, 1)
+        if not lazy:
+            while (_get_json(f"{base_url}/health") or {}).get("detection") == "loading" and time.perf_counter() < deadline:
+                time.sleep(0.01)
+            results["detection_ready_ms"] = round((time.perf_counter() - began) * 1000, 1)
+
+        # The pre-forked workers are the server process's children
+        pids = [process.pid]
+        if workers > 1:
+            try:
+                with open(f"/proc/{process.pid}/task/{process.pid}/children", "r") as f:
+                    pids = [int(pid) for pid in f.read().split()]
+            except OSError:
+                pass
+        memory = [process_memory_mb(pid) for pid in pids]
+        if all(rss is not None for rss, _ in memory):
+            results["worker_rss_mb"] = round(sum(rss for rss, _ in memory) / len(memory), 1)
+        if all(pss is not None for _, pss in memory):
+            results["worker_pss_mb"] = round(sum(pss for _, pss in memory) / len(memory), 1)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return results
+
+
+def bench_startup(args):
+    # Like bench_api, the server reads a fresh copy of items.json from a scratch folder
+    from standin import ITEMS_FIXTURE
+
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    try:
+        shutil.copy(ITEMS_FIXTURE, os.path.join(workdir, "items.json"))
+        backend = os.path.dirname(os.path.abspath(__file__))
+        timer = "import time; began = time.perf_counter(); import main; print(time.perf_counter() - began)"
+        imports = []
+        for _ in range(args.rounds):
+            process = subprocess.run([sys.executable, "-c", timer], capture_output=True, text=True, cwd=backend)
+            imports.append(float(process.stdout.strip().splitlines()[-1]))
+        results = {"import_ms": round(min(imports) * 1000, 1)}
+
+        # One worker and pre-forked workers, with detection warmed after startup or left
+        # to the first /detect
+        for workers in (1, 2):
+            for lazy in (False, True):
+                name = f"workers_{workers}" + ("_lazy" if lazy else "")
+                results[name] = _measure_server(workdir, workers, lazy)
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def flatten(results, prefix=""):
+    """
+    Flatten nested results into {"mode.metric": value} for comparison.
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(name, results, baseline, tolerance):
+    """
+    Print a benchmark's results next to its baseline. Returns the regressed metrics.
+    """
+    regressions = []
+    print(f"\n{name} (peak RSS {results.get('peak_rss_mb')} MB)")
+    old = flatten(baseline.get(name, {}))
+    for metric, value in flatten(results).items():
+        line = f"  {metric:<28} {value!s:>12}"
+        before = old.get(metric)
+        if isinstance(value, (int, float)) and isinstance(before, (int, float)) and not isinstance(value, bool) and before:
+            change = (value - before) / abs(before)
+            better = change > 0 if metric.endswith(HIGHER_IS_BETTER) else change < 0
+            line += f" {before!s:>12} {change * 100:+7.1f}%"
+            if abs(change) > tolerance and not better:
+                line += "  REGRESSED"
+                regressions.append(f"{name}.{metric}")
+        print(line)
+    return regressions
+
+
+def run_benchmark(name, args):
+    """
+    Run one benchmark in a fresh process and return its results.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--benchmark", name] + _passthrough(args)
+    process = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    lines = process.stdout.strip().splitlines()
+    if process.returncode != 0 or not lines:
+        print(process.stdout[-2000:] + process.stderr[-2000:])
+        return {"error": f"exit code {process.returncode}"}
+    # The results are the last line; anything printed before is the code's own logging
+    return json.loads(lines[-1])
+
+
+def _passthrough(args):
+    options = []
+    for option in ("rounds", "limit", "latency", "concurrency", "icons", "screenshots", "requests"):
+        value = getattr(args, option)
+        if value is not None:
+            options += [f"--{option}", str(value)]
+    if args.quick:
+        options.append("--quick")
+    return options
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Run only these benchmarks")
+    parser.add_argument("--quick", action="store_true", help="Smaller runs, and skip exhaustive sliding detection")
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline file to compare with (and --save to)")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Flag changes worse than this fraction")
+    parser.add_argument("--rounds", type=int, default=None, help="Repetitions of the parse, items and search loops")
+    parser.add_argument("--limit", type=int, default=None, help="Only use this many item pages")
+    parser.add_argument("--latency", type=float, default=None, help="Stand-in server latency per response, seconds")
+    parser.add_argument("--concurrency", type=int, default=None, help="Crawl and API requests in flight")
+    parser.add_argument("--icons", type=int, default=None, help="Icons in the detection bank")
+    parser.add_argument("--screenshots", type=int, default=None, help="Screenshots to detect")
+    parser.add_argument("--requests", type=int, default=None, help="Rounds of API requests")
+    parser.add_argument("--record-corpus", action="store_true", help="Record the item list and pages to replay, then exit")
+    parser.add_argument("--base-url", default="https://rusthelp.com", help="Site --record-corpus records from")
+    parser.add_argument("--benchmark", choices=BENCHMARKS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.record_corpus:
+        from standin import CORPUS_DIR, record_corpus
+
+        recorded, failed = record_corpus(base_url=args.base_url, limit=args.limit)
+        print(f"Recorded {recorded} pages to {CORPUS_DIR} ({failed} failed)")
+        raise SystemExit
+
+    defaults = {
+        "rounds": 3 if args.quick else 5,
+        "latency": 0.01,
+        "concurrency": 16,
+        "icons": 60 if args.quick else 150,
+        "screenshots": 2 if args.quick else 4,
+        "requests": 50 if args.quick else 200,
+    }
+    for option, value in defaults.items():
+        if getattr(args, option) is None:
+            setattr(args, option, value)
+
+    if args.benchmark:
+        # Child process: run one benchmark and print its results as the last line
+        results = globals()[f"bench_{args.benchmark}"](args)
+        results["peak_rss_mb"] = peak_rss_mb()
+        print(json.dumps(results))
+        raise SystemExit
+
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Comparing with {args.baseline}")
+    except FileNotFoundError:
+        baseline = {}
+        print(f"No baseline at {args.baseline}, run with --save to record one")
+
+    all_results = {}
+    regressions = []
+    for name in args.only or BENCHMARKS:
+        all_results[name] = run_benchmark(name, args)
+        regressions += compare(name, all_results[name], baseline, args.tolerance)
+
+    if args.save:
+        # Keep the baseline of benchmarks that weren't run this time
+        from manifest import atomic_write_json
+
+        atomic_write_json({**baseline, **all_results}, args.baseline, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+    if regressions:
+        print(f"\n{len(regressions)} metrics regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
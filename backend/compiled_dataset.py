@@ -0,0 +1,224 @@
+# This module writes and memory-maps a compact binary copy of the recycling dataset.
+# Item names are interned to integer indices and every recycling output becomes a row in
+# columnar arrays (source, output, quantity, probability), grouped by source. The loader
+# maps the file read-only, so every worker process shares the same pages of the OS cache
+# instead of parsing its own copy of the JSON. The original quantity and chance strings
+# are kept in a string table, so the API can answer /recycler from the file as well.
+# The file is a packed file (see packed.py).
+import json
+import os
+
+import numpy as np
+
+from manifest import content_hash
+from packed import PackedFile, read_header, write_packed
+from yield_graph import parse_chance, parse_quantity
+
+MAGIC = b"RRCD"
+FORMAT_VERSION = 1
+
+# Row kinds in the "kind" column
+GUARANTEED = 0
+EXTRA_CHANCE = 1
+
+# Keys of a dataset entry and of its rows, in the order the crawler writes them
+ENTRY_KEYS = ["guaranteed_output", "extra_chance_output"]
+ROW_KEYS = {GUARANTEED: ["item", "quantity"], EXTRA_CHANCE: ["item", "chance"]}
+
+
+def _columns(recycling_data, items=None):
+    """
+    Intern item names and flatten the recycling data into columns.
+    Returns (names, texts, arrays dict). texts is None if some entry has a shape the
+    columns can't reproduce exactly.
+    """
+    names = list(recycling_data)
+    index = {name: i for i, name in enumerate(names)}
+
+    def intern(name):
+        if name not in index:
+            index[name] = len(names)
+            names.append(name)
+        return index[name]
+
+    texts = []
+    text_index = {}
+
+    def intern_text(value):
+        if value not in text_index:
+            text_index[value] = len(texts)
+            texts.append(value)
+        return text_index[value]
+
+    source, output, quantity, probability, kind, text = [], [], [], [], [], []
+    offsets = [0]
+    exact = True
+    for name, entry in recycling_data.items():
+        source_index = index[name]
+        exact = exact and list(entry) == ENTRY_KEYS
+        for row in entry.get("guaranteed_output", []):
+            exact = exact and list(row) == ROW_KEYS[GUARANTEED] and isinstance(row["quantity"], str)
+            source.append(source_index)
+            output.append(intern(row["item"]))
+            quantity.append(parse_quantity(row["quantity"]))
+            probability.append(1.0)
+            kind.append(GUARANTEED)
+            text.append(intern_text(str(row["quantity"])))
+        for row in entry.get("extra_chance_output", []):
+            exact = exact and list(row) == ROW_KEYS[EXTRA_CHANCE] and isinstance(row["chance"], str)
+            source.append(source_index)
+            output.append(intern(row["item"]))
+            quantity.append(1.0)
+            probability.append(parse_chance(row["chance"]))
+            kind.append(EXTRA_CHANCE)
+            text.append(intern_text(str(row["chance"])))
+        offsets.append(len(source))
+
+    # Game item ids from the catalogue, where we know them (0 otherwise)
+    game_ids = np.zeros(len(names), dtype=np.int64)
+    if items:
+        by_name = {}
+        for item in items.values():
+            by_name.setdefault(item["name"], item["id"])
+        for i, name in enumerate(names):
+            game_ids[i] = by_name.get(name, 0)
+
+    arrays = {
+        # Rows of source i are source_offsets[i]:source_offsets[i + 1]
+        "source_offsets": np.array(offsets, dtype=np.int64),
+        "source": np.array(source, dtype=np.int32),
+        "output": np.array(output, dtype=np.int32),
+        "quantity": np.array(quantity, dtype=np.float32),
+        "probability": np.array(probability, dtype=np.float64),
+        "kind": np.array(kind, dtype=np.uint8),
+        # Index into texts of the row's original quantity or chance string
+        "text": np.array(text, dtype=np.int32),
+        "game_id": game_ids,
+    }
+    return names, texts if exact else None, arrays
+
+
+def write_compiled(recycling_data, path, dataset_hash=None, items=None):
+    """
+    Write the compiled dataset to `path` atomically.
+
+    Parameters:
+    recycling_data (dict): Recycling data keyed by item name
+    path (str): Output file
+    dataset_hash (str): Hash of the JSON dataset this was compiled from
+    items (dict): Optional item catalogue, used to record game item ids
+    """
+    names, texts, arrays = _columns(recycling_data, items)
+    header = {"names": names, "sources": len(recycling_data), "dataset_hash": dataset_hash, "texts": texts}
+    write_packed(path, MAGIC, FORMAT_VERSION, header, arrays)
+
+
+class CompiledDataset:
+    """
+    Read-only, memory-mapped view of a compiled dataset. The column arrays point straight
+    into the mapped file; nothing is copied until it is used.
+    """
+
+    def __init__(self, path):
+        self.packed = PackedFile(path, MAGIC, FORMAT_VERSION)
+        header = self.packed.header
+
+        self.path = path
+        self.names = header["names"]
+        self.sources = header["sources"]
+        self.dataset_hash = header.get("dataset_hash")
+        # None for files that can't rebuild the JSON entries (see entry)
+        self.texts = header.get("texts")
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.arrays = self.packed.arrays
+        for name, array in self.arrays.items():
+            setattr(self, name, array)
+
+    def close(self):
+        # The mapping can only be closed once no array points into it
+        for name in self.arrays:
+            delattr(self, name)
+        self.arrays = {}
+        self.packed.close()
+
+    def rows(self, name):
+        """
+        Return the row slice holding the outputs of `name` (empty if it can't be recycled).
+        """
+        i = self.index.get(name)
+        if i is None or i >= self.sources:
+            return slice(0, 0)
+        return slice(int(self.source_offsets[i]), int(self.source_offsets[i + 1]))
+
+    def entry(self, i):
+        """
+        Rebuild the JSON entry of source `i`, as stored in the dataset file.
+        Only possible when the file kept the original strings (`texts` is not None).
+        """
+        rows = slice(int(self.source_offsets[i]), int(self.source_offsets[i + 1]))
+        entry = {key: [] for key in ENTRY_KEYS}
+        for output, kind, text in zip(self.output[rows].tolist(), self.kind[rows].tolist(), self.text[rows].tolist()):
+            item_key, value_key = ROW_KEYS[kind]
+            entry[ENTRY_KEYS[kind]].append({item_key: self.names[output], value_key: self.texts[text]})
+        return entry
+
+    def expected(self):
+        """
+        Expected amount of every row: quantity x probability.
+        """
+        return self.quantity.astype(np.float64) * self.probability
+
+    def direct_yields(self):
+        """
+        Expected outputs per recycled item, as {source: {output: amount}} (the shape
+        YieldGraph works with).
+        """
+        expected = self.expected()
+        yields = {}
+        for i in range(self.sources):
+            outputs = {}
+            for row in range(self.source_offsets[i], self.source_offsets[i + 1]):
+                output = self.names[self.output[row]]
+                outputs[output] = outputs.get(output, 0.0) + float(expected[row])
+            yields[self.names[i]] = outputs
+        return yields
+
+
+def compile_for_dataset(data_file, path, items=None):
+    """
+    Make sure the compiled file at `path` matches the JSON dataset, recompiling it if not.
+    Called by generate_recycling_data after the dataset is written.
+    """
+    with open(data_file, "rb") as f:
+        raw = f.read()
+    dataset_hash = content_hash(raw)
+    try:
+        header = read_header(path, MAGIC, FORMAT_VERSION)
+        current = header.get("dataset_hash") == dataset_hash
+    except (FileNotFoundError, ValueError):
+        current = False
+    if not current:
+        write_compiled(json.loads(raw), path, dataset_hash, items)
+
+
+# Compare loading the JSON against mapping the compiled file
+if __name__ == "__main__":
+    import sys
+    import time
+
+    data_file = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "data", "all_recycling_data.json")
+    compiled_file = os.path.splitext(data_file)[0] + ".bin"
+    compile_for_dataset(data_file, compiled_file)
+
+    start = time.perf_counter()
+    with open(data_file, "r", encoding="utf-8") as f:
+        json.load(f)
+    json_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compiled = CompiledDataset(compiled_file)
+    mmap_time = time.perf_counter() - start
+
+    print(f"JSON   {os.path.getsize(data_file):>10} bytes, load {json_time * 1000:.2f} ms")
+    print(f"mmap   {os.path.getsize(compiled_file):>10} bytes, open {mmap_time * 1000:.2f} ms "
+          f"({len(compiled.names)} names, {compiled.source.size} rows)")
@@ -0,0 +1,423 @@
+# This module crawls rusthelp item pages concurrently and parses their recycling data.
+# Fetches run on a shared requests session inside a thread pool, while asyncio
+# coordinates the concurrency limit, the per-host rate limit and the retries.
+import asyncio
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from journal import index_journal, read_record
+from manifest import atomic_write_json_items, conditional_headers, content_hash, load_json, validators
+from metrics import UPSTREAM_REQUEST_SECONDS, UPSTREAM_RESPONSES
+from recycler import HEADERS, extract_recycling_tab, item_url, parse_recycler_data
+
+# Status codes that are worth retrying (rate limited or server side errors)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Seconds between checks of the cancel event while waiting for a result
+CANCEL_POLL_SECONDS = 0.25
+
+# One finished crawl target: the caller's key, the URL, the processed value and the error (if any)
+CrawlResult = namedtuple("CrawlResult", ["key", "url", "data", "error"])
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter for a single host.
+    Allows bursts of up to `burst` requests and refills at `rate` tokens per second.
+    A rate of 0 or less disables the limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                # Refill based on the time elapsed since the last acquire
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Crawler:
+    """
+    Concurrent page fetcher.
+
+    Parameters:
+    concurrency (int): Maximum number of requests in flight at once
+    rate (float): Requests per second allowed for each host (0 = unlimited)
+    burst (int): Size of the per-host burst allowance (defaults to the rate)
+    retries (int): How many times a failed request is retried
+    backoff (float): Base delay in seconds for the jittered exponential backoff
+    timeout (float): Timeout in seconds for a single request
+    """
+
+    def __init__(self, concurrency=16, rate=8.0, burst=None, retries=3, backoff=0.5, timeout=30):
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.buckets = {}
+
+        # One session shared by every worker so connections are pooled per host
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Blocking fetches and parsing run here so the event loop never stalls
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="crawler")
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host]
+
+    def _backoff_delay(self, attempt):
+        # Exponential backoff with full jitter so retries don't arrive in lockstep
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def fetch(self, url, headers=None):
+        """
+        Fetch a URL with rate limiting and retries.
+        Returns the requests.Response, or raises the last error once the retries are used up.
+        """
+        loop = asyncio.get_running_loop()
+        bucket = self._bucket(url)
+        last_error = None
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff_delay(attempt - 1))
+            await bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = await loop.run_in_executor(
+                    self.executor,
+                    lambda: self.session.get(url, headers=headers, timeout=self.timeout),
+                )
+            except requests.exceptions.RequestException as e:
+                UPSTREAM_RESPONSES.inc(source="crawler", status="error")
+                last_error = e
+                continue
+            finally:
+                UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - start, source="crawler")
+            UPSTREAM_RESPONSES.inc(source="crawler", status=response.status_code)
+
+            if response.status_code in RETRY_STATUSES:
+                last_error = requests.exceptions.HTTPError(f"{response.status_code} for url: {url}", response=response)
+                continue
+            response.raise_for_status()
+            return response
+
+        raise last_error
+
+    async def crawl(self, targets, process, cancel=None):
+        """
+        Crawl (key, url) or (key, url, headers) targets concurrently and yield a CrawlResult
+        for each as it finishes. `process(key, url, response)` is called in the thread pool
+        and its return value becomes the result data.
+        Once the `cancel` event is set no new target is started, and the crawl stops within
+        CANCEL_POLL_SECONDS, abandoning requests in flight and retries waiting to run.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        for target in targets:
+            queue.put_nowait(target)
+        total = queue.qsize()
+        results = asyncio.Queue()
+
+        def cancelled():
+            return cancel is not None and cancel.is_set()
+
+        async def worker():
+            while not cancelled():
+                try:
+                    key, url, *headers = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    response = await self.fetch(url, headers[0] if headers else None)
+                    data = await loop.run_in_executor(self.executor, process, key, url, response)
+                    await results.put(CrawlResult(key, url, data, None))
+                except Exception as e:
+                    await results.put(CrawlResult(key, url, None, e))
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, total))]
+        try:
+            for _ in range(total):
+                # Wait in short steps so a slow or retrying host doesn't hold up a cancel
+                result = None
+                while result is None and not cancelled():
+                    try:
+                        result = await asyncio.wait_for(results.get(), CANCEL_POLL_SECONDS if cancel else None)
+                    except asyncio.TimeoutError:
+                        pass
+                if result is None:
+                    return
+                yield result
+        finally:
+            # Stop any outstanding work if the consumer bails out early
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+def parse_response(key, url, response):
+    """
+    Parse a fetched item page the same way scrape_recycler_data_all does.
+    """
+    return parse_recycler_data(response.text, no_safezone=True)
+
+
+def _item_targets(items, base_url):
+    # Some catalogue entries share a display name (and so a page); each is crawled once,
+    # in the position of its first entry
+    targets = []
+    seen = set()
+    for item in items.values():
+        item_name = item.get("name", "")
+        if item_name and item_name not in seen:
+            seen.add(item_name)
+            url = item_url(item_name, base_url) if base_url else item_url(item_name)
+            targets.append((item_name, url))
+    return targets
+
+
+async def crawl_recycling_data(items, base_url=None, max_failures=400, verbose=True, **crawler_options):
+    """
+    Fetch and parse recycling data for every item in the catalogue concurrently.
+
+    Parameters:
+    items (dict): Items as returned by get_items()
+    base_url (str): Override for the rusthelp base URL (used by the local stand-in server)
+    max_failures (int): Stop the crawl once this many items have failed
+    verbose (bool): Print a line for every processed or failed item
+    crawler_options: Passed through to Crawler
+
+    Returns:
+    tuple: (recycling_data dict keyed by item name, number of failed items)
+    """
+    targets = _item_targets(items, base_url)
+
+    recycling_data = {}
+    failed = 0
+    with Crawler(**crawler_options) as crawler:
+        async with aclosing(crawler.crawl(targets, parse_response)) as results:
+            async for result in results:
+                if result.error is not None:
+                    failed += 1
+                    if verbose:
+                        print(f"Error processing {result.key}: {str(result.error)}")
+                elif result.data is None:
+                    failed += 1
+                else:
+                    recycling_data[result.key] = result.data
+                    if verbose:
+                        print(f"Processed: {result.key}")
+
+                if failed > max_failures:
+                    print("Too many failures, stopping the process.")
+                    break
+
+    return recycling_data, failed
+
+
+def _process_incremental(manifest, existing):
+    """
+    Build the thread pool callback for an incremental refresh.
+    It returns ("unchanged", entry) when the page matches the manifest, and
+    ("changed", entry, data) with freshly parsed data otherwise.
+    """
+
+    def process(key, url, response):
+        entry = dict(manifest.get(url) or {})
+        # Keep the old validators if the server leaves them out of this response
+        for name, value in validators(response).items():
+            if value:
+                entry[name] = value
+
+        if response.status_code == 304:
+            return ("unchanged", entry)
+
+        # Hash only the recycling tab so unrelated page churn doesn't force a reparse. A page
+        # mentioning the tab that can't be sliced is hashed (and parsed) whole
+        tab = extract_recycling_tab(response.text)
+        if tab is None and "recycling-tab" in response.text:
+            tab = response.text
+        digest = content_hash(tab)
+        if "hash" in entry and entry["hash"] == digest and entry.get("recyclable") == (key in existing):
+            return ("unchanged", entry)
+
+        data = parse_recycler_data(response.text, no_safezone=True) if tab else None
+        entry["hash"] = digest
+        entry["recyclable"] = data is not None
+        return ("changed", entry, data)
+
+    return process
+
+
+async def refresh_recycling_data(items, existing, manifest, journal, done=(), base_url=None, max_failures=400, verbose=True,
+                                 progress=None, cancel=None, **crawler_options):
+    """
+    Incrementally refresh recycling data using the per-URL manifest, journaling every result.
+
+    Pages are requested with If-None-Match / If-Modified-Since from the manifest. A 304,
+    or a 200 whose recycling tab hashes the same as last time, is journaled as unchanged
+    without parsing; changed items are journaled with their parsed data. Each result is
+    written as soon as its page finishes, so memory stays flat and a crash loses nothing
+    already fetched. compact_recycling_data merges the journal into the dataset afterwards.
+
+    Parameters:
+    items (dict): Items as returned by get_items()
+    existing (collection): Names of the items in the previous dataset
+    manifest (dict): Manifest from the previous run (updated in place)
+    journal (Journal): Where results are recorded
+    done (collection): Items an interrupted run already journaled, which aren't fetched again
+    base_url (str): Override for the rusthelp base URL (used by the local stand-in server)
+    max_failures (int): Stop the crawl once this many fetches have failed
+    verbose (bool): Print a line for every changed or failed item
+    progress (callable): Called with keyword arguments total, done (including items of the
+        interrupted run), fetched, changed, unchanged and failed after every page
+    cancel (threading.Event): Stop the crawl once this is set, even while waiting on slow hosts
+    crawler_options: Passed through to Crawler
+
+    Returns:
+    dict: Counts of "changed", "unchanged" and "failed" pages in this crawl, whether it was
+        "cancelled", and whether it "finished" (every target was fetched). A run that didn't
+        finish must not be compacted: its journal is resumed by the next run instead
+    """
+    targets = []
+    resumed = 0
+    for item_name, url in _item_targets(items, base_url):
+        if item_name in done:
+            resumed += 1
+            continue
+        entry = manifest.get(url)
+        # Only trust the validators if the dataset still agrees with the manifest
+        if entry and entry.get("recyclable") == (item_name in existing):
+            targets.append((item_name, url, conditional_headers(entry)))
+        else:
+            targets.append((item_name, url))
+
+    stats = {"changed": 0, "unchanged": 0, "failed": 0, "cancelled": False, "finished": False}
+    if cancel is not None and cancel.is_set():
+        stats["cancelled"] = True
+        return stats
+    fetched = 0
+    if progress:
+        progress(total=resumed + len(targets), done=resumed, fetched=0, changed=0, unchanged=0, failed=0)
+    with Crawler(**crawler_options) as crawler:
+        process = _process_incremental(manifest, existing)
+        async with aclosing(crawler.crawl(targets, process, cancel)) as results:
+            async for result in results:
+                if cancel is not None and cancel.is_set():
+                    break
+                fetched += 1
+
+                if result.error is not None:
+                    stats["failed"] += 1
+                    if verbose:
+                        print(f"Error processing {result.key}: {str(result.error)}")
+                else:
+                    status, entry, *data = result.data
+                    entry["item"] = result.key
+                    manifest[result.url] = entry
+                    stats[status] += 1
+                    record = {"item": result.key, "url": result.url, "entry": entry, "changed": status == "changed"}
+                    if status == "changed":
+                        record["data"] = data[0]
+                        if verbose:
+                            print(f"Changed: {result.key}")
+                    journal.append(record)
+
+                if progress:
+                    progress(done=resumed + fetched, fetched=fetched, changed=stats["changed"],
+                             unchanged=stats["unchanged"], failed=stats["failed"])
+                if stats["failed"] > max_failures:
+                    print("Too many failures, stopping the process.")
+                    break
+    if cancel is not None and cancel.is_set() and fetched < len(targets):
+        print("Cancelled, stopping the process.")
+        stats["cancelled"] = True
+    stats["finished"] = not stats["cancelled"] and fetched == len(targets)
+    return stats
+
+
+def compact_recycling_data(items, journal_path, output_path, full=False, base_url=None):
+    """
+    Merge a refresh journal into the dataset at output_path, in catalogue order, and
+    replace the file atomically if the result differs. The merge is streamed: journal
+    records are read back one at a time rather than loaded together.
+
+    Items without a journal record (their fetch failed) keep their previous data, unless
+    `full` is set; items that are no longer recyclable or no longer in the catalogue are
+    dropped. Only call this once the refresh finished: a stopped full run would drop every
+    item it didn't get to.
+
+    Parameters:
+    items (dict): Items as returned by get_items()
+    journal_path (str): Journal written by refresh_recycling_data
+    output_path (str): The dataset JSON file
+    full (bool): Drop items that weren't refreshed (the refresh was a finished full run)
+    base_url (str): The base URL the refresh used
+
+    Returns:
+    dict: Counts of "changed", "unchanged", "removed" and "items", and whether the file was "written"
+    """
+    previous = load_json(output_path)
+    names = [item_name for item_name, _ in _item_targets(items, base_url)]
+    index = index_journal(journal_path, "item")
+    stats = {"changed": 0, "unchanged": 0, "removed": len(set(previous) - set(names)), "items": 0}
+
+    def merged(journal_file):
+        for item_name in names:
+            offset = index.get(item_name)
+            record = read_record(journal_file, offset) if offset is not None else None
+            if record is None or not record["changed"]:
+                if record is not None:
+                    stats["unchanged"] += 1
+                if item_name in previous and (record is not None or not full):
+                    stats["items"] += 1
+                    yield item_name, previous[item_name]
+            elif record["data"] is not None:
+                stats["changed"] += 1
+                stats["items"] += 1
+                yield item_name, record["data"]
+            elif item_name in previous:
+                stats["removed"] += 1
+
+    with open(journal_path, "ab+") as journal_file:
+        stats["written"] = atomic_write_json_items(merged(journal_file), output_path, indent=2, only_if_changed=True)
+    return stats
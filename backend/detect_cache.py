@@ -0,0 +1,243 @@
+# This module caches detection results, since the same recycler screenshots are uploaded
+# again and again. Results are keyed by a hash of the decoded pixels (so a re-encoded copy
+# of a screenshot still hits), the detection parameters and the template bank version.
+# They are kept in a bounded in-memory LRU and optionally in a folder of JSON files that
+# survives restarts.
+#
+# Below that there is a tile cache for sliding matching: the screenshot is cut into tiles
+# and the matches starting in each tile are cached under a hash of the pixels they depend
+# on (the tile, plus an icon's width and height beyond it). A screenshot that differs
+# from an earlier one in a few slots only matches the tiles those slots touch again.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from manifest import atomic_write_json, load_json
+
+# Detection results kept in memory
+RESULT_ENTRIES = 128
+# Detection results kept on disk, when the cache has a folder
+DISK_ENTRIES = 4096
+# Side of the tiles sliding matches are cached by, in pixels
+TILE_SIZE = 256
+# Tiles kept in memory
+TILE_ENTRIES = 8192
+# Above this fraction of changed tiles the whole screenshot is matched at once, which is
+# cheaper than matching each tile with its overlap separately
+MATCH_WHOLE_FRACTION = 0.5
+# Results written between checks of the disk tier's size
+PRUNE_EVERY = 64
+
+
+def image_digest(gray):
+    """
+    Hash the pixels of a decoded image (and its shape).
+    """
+    digest = hashlib.sha256(f"{gray.shape};{gray.dtype};".encode("utf-8"))
+    digest.update(np.ascontiguousarray(gray).tobytes())
+    return digest.hexdigest()
+
+
+def _empty_matches():
+    return (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32))
+
+
+def _copy_found(found):
+    # Results handed out are the caller's to change; positions and dimensions are tuples,
+    # as find_icons_in_image returns them, even after a round trip through JSON
+    return {
+        name: {
+            "positions": [tuple(position) for position in icon["positions"]],
+            "confidence": list(icon["confidence"]),
+            "dimensions": tuple(icon["dimensions"]),
+        }
+        for name, icon in found.items()
+    }
+
+
+class DetectionCache:
+    """
+    LRU cache of detection results, with an optional disk tier, and of per-tile sliding matches.
+
+    Parameters:
+    max_entries (int): Results kept in memory
+    folder (str): Also keep results as JSON files in this folder (default: memory only)
+    max_files (int): Results kept in the folder
+    tile_size (int): Side of the tiles sliding matches are cached by
+    max_tiles (int): Tiles kept in memory
+    """
+
+    def __init__(self, max_entries=RESULT_ENTRIES, folder=None, max_files=DISK_ENTRIES, tile_size=TILE_SIZE, max_tiles=TILE_ENTRIES):
+        self.max_entries = max_entries
+        self.folder = folder
+        self.max_files = max_files
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.results = OrderedDict()
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "tile_hits": 0, "tile_misses": 0}
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def key(self, gray, bank, **params):
+        """
+        Return the cache key of a screenshot detected with a bank and the given parameters.
+        """
+        digest = hashlib.sha256(image_digest(gray).encode("utf-8"))
+        digest.update(bank.version.encode("utf-8"))
+        digest.update(repr(sorted(params.items())).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def get(self, key):
+        """
+        Return a copy of the cached result for a key, or None.
+        """
+        with self.lock:
+            found = self.results.get(key)
+            if found is not None:
+                self.results.move_to_end(key)
+                self.stats["hits"] += 1
+                return _copy_found(found)
+
+        found = None
+        if self.folder:
+            path = self._path(key)
+            # Stored wrapped, so an empty result isn't mistaken for a missing file
+            found = load_json(path).get("found") if os.path.exists(path) else None
+        with self.lock:
+            if found is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self._remember(key, found)
+        return _copy_found(found)
+
+    def put(self, key, found):
+        """
+        Cache a result from find_icons_in_image.
+        """
+        found = _copy_found(found)
+        with self.lock:
+            self._remember(key, found)
+            self.writes += 1
+            prune = self.writes % PRUNE_EVERY == 0
+        if self.folder:
+            try:
+                atomic_write_json({"found": found}, self._path(key))
+                if prune:
+                    self._prune()
+            except OSError as e:
+                print(f"Warning: Unable to save detection result to {self.folder}: {e}")
+
+    def _remember(self, key, found):
+        self.results[key] = found
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+    def _prune(self):
+        # Remove the least recently written results beyond max_files
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(".json"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_files)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def match_tiles(self, bank, gray, match, match_whole=None, **params):
+        """
+        Sliding-match a screenshot tile by tile, reusing the matches of tiles seen before.
+        The matches are those of matching the whole screenshot, in tile order instead of
+        by icon (sort them before filtering overlaps). Scores are computed on a crop, so
+        they agree with the whole-screenshot scores within float rounding (about 1e-6): a
+        peak that close to the threshold, or to a neighbour's score, can come out differently.
+
+        Parameters:
+        bank (TemplateBank): Icons being matched (at the scale they're matched at)
+        gray (np.ndarray): Grayscale screenshot
+        match (callable): match(image) -> (xs, ys, scores, bank indices) of every peak over
+            the threshold, like match_icons
+        match_whole (callable): Used instead of match when most tiles changed (e.g. to
+            match in worker processes)
+        params: Matching parameters that change the matches (threshold, engine...)
+
+        Returns:
+        tuple: (xs, ys, scores, bank indices) arrays
+        """
+        height, width = gray.shape
+        icon_h, icon_w = (int(v) for v in bank.shapes.max(axis=0)) if len(bank) else (1, 1)
+        size = self.tile_size
+        prefix = repr((bank.version, sorted(params.items()), size)).encode("utf-8")
+
+        # A match at (x, y) depends on the window below and right of it, and find_matches
+        # compares it with its neighbours, so a tile's matches depend on its pixels plus one
+        # pixel above and left and an icon's size below and right
+        tiles = []
+        for ty in range(0, height, size):
+            for tx in range(0, width, size):
+                x0, y0 = max(tx - 1, 0), max(ty - 1, 0)
+                x1, y1 = min(tx + size + icon_w, width), min(ty + size + icon_h, height)
+                digest = hashlib.sha256(prefix)
+                digest.update(f"{tx - x0},{ty - y0}".encode("utf-8"))
+                digest.update(image_digest(gray[y0:y1, x0:x1]).encode("utf-8"))
+                tiles.append((tx, ty, x0, y0, x1, y1, digest.hexdigest()))
+
+        cached = {}
+        with self.lock:
+            for tile in tiles:
+                matches = self.tiles.get(tile[-1])
+                if matches is not None:
+                    self.tiles.move_to_end(tile[-1])
+                    cached[tile[-1]] = matches
+            missing = [tile for tile in tiles if tile[-1] not in cached]
+            self.stats["tile_hits"] += len(tiles) - len(missing)
+            self.stats["tile_misses"] += len(missing)
+
+        computed = {}
+        if len(missing) > MATCH_WHOLE_FRACTION * len(tiles):
+            xs, ys, scores, icons = (match_whole or match)(gray)
+            tile_of = (ys // size) * (-(-width // size)) + xs // size
+            for k, (tx, ty, *_, key) in enumerate(tiles):
+                inside = tile_of == k
+                computed[key] = (xs[inside] - tx, ys[inside] - ty, scores[inside], icons[inside])
+        else:
+            for tx, ty, x0, y0, x1, y1, key in missing:
+                if key in computed:
+                    # Another tile with the same pixels (e.g. empty background)
+                    continue
+                xs, ys, scores, icons = match(gray[y0:y1, x0:x1])
+                xs, ys = xs + x0, ys + y0
+                inside = (xs >= tx) & (xs < tx + size) & (ys >= ty) & (ys < ty + size)
+                computed[key] = (xs[inside] - tx, ys[inside] - ty, scores[inside], icons[inside])
+
+        with self.lock:
+            for tx, ty, *_, key in missing:
+                self.tiles[key] = computed[key]
+                self.tiles.move_to_end(key)
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+
+        columns = [[array] for array in _empty_matches()]
+        for tx, ty, *_, key in tiles:
+            xs, ys, scores, icons = cached.get(key) or computed[key]
+            columns[0].append(xs + tx)
+            columns[1].append(ys + ty)
+            columns[2].append(scores)
+            columns[3].append(icons)
+        return tuple(np.concatenate(column).astype(column[0].dtype, copy=False) for column in columns)
@@ -1,178 +1,428 @@
-import cv2
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from multiprocessing import shared_memory
 from pathlib import Path
+
+import cv2
+import numba
 from numba import jit, prange
 import numpy as np
 
-@jit(nopython=True)
-def find_matches(result, threshold):
+from fft_matcher import get_fft_matcher
+from icon_hash import get_hash_index
+from metrics import DETECTION_STAGE_SECONDS
+from inventory_grid import classify_slots, locate_grid
+from scale_estimation import estimate_scale
+from template_bank import TemplateBank, get_scaled_bank, get_template_bank, icon_files
+
+@jit(nopython=True, cache=True)
+def _is_peak(result, y, x):
+    # A local maximum: no 8-connected neighbour scores higher
+    h, w = result.shape
+    value = result[y, x]
+    for ny in range(max(y - 1, 0), min(y + 2, h)):
+        for nx in range(max(x - 1, 0), min(x + 2, w)):
+            if result[ny, nx] > value:
+                return False
+    return True
+
+@jit(nopython=True, parallel=True, cache=True)
+def find_matches(result, threshold, peaks_only=True):
     """
-    JIT-accelerated function to find locations where result exceeds threshold
+    JIT-accelerated function to find locations where result exceeds threshold.
+    With peaks_only, only local maxima count: the pixels around a match score almost as
+    high and would be suppressed by it anyway, so they never reach the overlap filter.
+    Rows are scanned in parallel: one pass counts the matches in each row, the second
+    writes them out, so no thread appends to a shared list.
+    Returns (xs, ys, scores) arrays in row-major order, like np.where.
     """
-    matches = []
     h, w = result.shape
+    counts = np.zeros(h + 1, dtype=np.int64)
+    for y in prange(h):
+        count = 0
+        for x in range(w):
+            if result[y, x] >= threshold and (not peaks_only or _is_peak(result, y, x)):
+                count += 1
+        counts[y + 1] = count
+    starts = np.cumsum(counts)
+    
+    xs = np.empty(starts[h], dtype=np.int32)
+    ys = np.empty(starts[h], dtype=np.int32)
+    scores = np.empty(starts[h], dtype=np.float32)
     for y in prange(h):
-        for x in prange(w):
-            if result[y, x] >= threshold:
-                matches.append((x, y, result[y, x]))
-    return matches
+        k = starts[y]
+        for x in range(w):
+            if result[y, x] >= threshold and (not peaks_only or _is_peak(result, y, x)):
+                xs[k] = x
+                ys[k] = y
+                scores[k] = result[y, x]
+                k += 1
+    return xs, ys, scores
 
-@jit(nopython=True)
-def filter_overlapping_matches(matches, w, h, overlap_threshold=0.5):
+@jit(nopython=True, cache=True)
+def filter_overlapping_matches(boxes, scores, overlap_threshold=0.5):
     """
-    JIT-accelerated function to remove overlapping detections using NumPy arrays.
-    Ensures that only the highest score item is kept, even for overlaps between different items.
-    """
-    if len(matches) == 0:
-        return np.empty((0, 3), dtype=np.float64)  # Return empty array with correct shape
+    JIT-accelerated greedy non-maximum suppression over boxes of any size.
+    Boxes are taken in order of confidence (ties keep their input order) and dropped if
+    their IoU with an already kept box is over overlap_threshold. Kept boxes are filed in
+    a grid of cells at least as large as any box, so each box is only compared with the
+    kept boxes in the cells it covers instead of with every kept box.
     
-    # Convert to numpy array for better handling in Numba
-    matches_array = np.array(matches)
+    Parameters:
+    boxes (np.ndarray): (n, 4) int array of (x, y, w, h)
+    scores (np.ndarray): Confidence per box
+    overlap_threshold (float): IoU above which the lower confidence box is dropped
     
-    # Sort by confidence (descending)
-    sort_indices = np.argsort(-matches_array[:, 2])  # Negative for descending order
-    matches_array = matches_array[sort_indices]
+    Returns:
+    np.ndarray: Indices of the kept boxes, highest confidence first
+    """
+    n = len(boxes)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    order = np.argsort(-scores, kind='mergesort')
     
-    keep = np.ones(len(matches_array), dtype=np.bool_)
+    cell = max(1, boxes[:, 2].max(), boxes[:, 3].max())
+    columns = (boxes[:, 0] + boxes[:, 2]).max() // cell + 1
+    rows = (boxes[:, 1] + boxes[:, 3]).max() // cell + 1
+    # Linked lists of kept boxes per cell; a box no larger than a cell covers at most 4
+    head = np.full(rows * columns, -1, dtype=np.int64)
+    entry_box = np.empty(4 * n, dtype=np.int64)
+    entry_next = np.empty(4 * n, dtype=np.int64)
+    entries = 0
     
-    for i in range(len(matches_array)):
-        if not keep[i]:
+    kept = np.empty(n, dtype=np.int64)
+    kept_count = 0
+    for i in order:
+        x, y, w, h = boxes[i, 0], boxes[i, 1], boxes[i, 2], boxes[i, 3]
+        first_column, last_column = x // cell, (x + w - 1) // cell
+        first_row, last_row = y // cell, (y + h - 1) // cell
+        
+        # Boxes with a positive intersection share at least one covered cell
+        overlapping = False
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                e = head[row * columns + column]
+                while e != -1 and not overlapping:
+                    j = entry_box[e]
+                    x_left = max(x, boxes[j, 0])
+                    y_top = max(y, boxes[j, 1])
+                    x_right = min(x + w, boxes[j, 0] + boxes[j, 2])
+                    y_bottom = min(y + h, boxes[j, 1] + boxes[j, 3])
+                    if x_left < x_right and y_top < y_bottom:
+                        intersection_area = (x_right - x_left) * (y_bottom - y_top)
+                        union_area = w * h + boxes[j, 2] * boxes[j, 3] - intersection_area
+                        if intersection_area / union_area > overlap_threshold:
+                            overlapping = True
+                    e = entry_next[e]
+        if overlapping:
             continue
-            
-        for j in range(i+1, len(matches_array)):
-            if not keep[j]:
-                continue
-                
-            # Get coordinates
-            x1, y1 = matches_array[i, 0], matches_array[i, 1]
-            x2, y2 = x1 + w, y1 + h
-            
-            x1_b, y1_b = matches_array[j, 0], matches_array[j, 1]
-            x2_b, y2_b = x1_b + w, y1_b + h
-            
-            # Calculate intersection area
-            x_left = max(x1, x1_b)
-            y_top = max(y1, y1_b)
-            x_right = min(x2, x2_b)
-            y_bottom = min(y2, y2_b)
-            
-            if x_right < x_left or y_bottom < y_top:
-                intersection_area = 0
-            else:
-                intersection_area = (x_right - x_left) * (y_bottom - y_top)
-            
-            # Calculate union area
-            box_area = w * h
-            box_area_b = w * h
-            union_area = box_area + box_area_b - intersection_area
-            
-            # If overlap ratio (IoU) is greater than threshold, suppress the lower confidence box
-            if intersection_area / union_area > overlap_threshold:
-                keep[j] = False
+        
+        kept[kept_count] = i
+        kept_count += 1
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                entry_box[entries] = i
+                entry_next[entries] = head[row * columns + column]
+                head[row * columns + column] = entries
+                entries += 1
+    return kept[:kept_count]
+
+def match_icons(bank, target_gray, threshold=0.7, engine='fft', indices=None):
+    """
+    Template match icons from the bank against a grayscale screenshot
+    
+    Parameters:
+    bank (TemplateBank): Icons to match
+    target_gray (np.ndarray): Grayscale screenshot
+    threshold (float): Matching threshold (0-1)
+    engine (str): 'fft' or 'opencv', see find_icons_in_image
+    indices (list): Only match these bank indices (default: every icon)
     
-    # Return only the boxes we're keeping
-    return matches_array[keep]
+    Returns:
+    tuple: (xs, ys, scores, bank indices) arrays with one entry per peak over the threshold
+    """
+    if indices is None:
+        indices = range(len(bank))
+    
+    # Apply template matching
+    if engine == 'fft':
+        scored = get_fft_matcher(bank).match(target_gray, indices)
+    elif engine == 'opencv':
+        scored = ((i, cv2.matchTemplate(target_gray, bank.template(i), cv2.TM_CCOEFF_NORMED)) for i in indices)
+    else:
+        raise ValueError(f"Unknown matching engine: {engine}")
+    
+    # Start each column with an empty array so there is something to concatenate
+    xs, ys = [np.empty(0, dtype=np.int32)], [np.empty(0, dtype=np.int32)]
+    scores, icons = [np.empty(0, dtype=np.float32)], [np.empty(0, dtype=np.int32)]
+    for i, result in scored:
+        x, y, score = find_matches(result, threshold)
+        xs.append(x)
+        ys.append(y)
+        scores.append(score)
+        icons.append(np.full(len(x), i, dtype=np.int32))
+    return np.concatenate(xs), np.concatenate(ys), np.concatenate(scores), np.concatenate(icons)
 
-def find_icons_in_image(icons_folder, target_image_path, threshold=0.7, overlap_threshold=0.5):
+def find_icons_in_image(icons_folder, target_image_path, threshold=0.7, overlap_threshold=0.5, engine='fft', workers=1, mode='sliding', scale=1.0, prefilter=False, cache=None):
     """
     Checks if any icon from icons_folder exists in the target image
     
     Parameters:
-    icons_folder (str): Path to folder containing icon images
-    target_image_path (str): Path to the image where we want to find icons
+    icons_folder (str or TemplateBank): Path to folder containing icon images, or an already loaded bank
+    target_image_path (str or np.ndarray): Path to the image where we want to find icons, or the
+        image itself (BGR or grayscale)
     threshold (float): Matching threshold (0-1), higher = more strict matching
     overlap_threshold (float): Threshold for removing overlapping detections
+    engine (str): 'fft' matches all same-size icons in one batch (see fft_matcher.py),
+        'opencv' runs cv2.matchTemplate once per icon; both give the same matches
+    workers (int): Split the icons across this many worker processes
+    mode (str): 'sliding' matches every icon everywhere; 'grid' finds the inventory slot grid
+        and classifies each slot (see inventory_grid.py), falling back to 'sliding' if the
+        screenshot has no slot grid
+    scale (float or str): Size of the screenshot's icons relative to the downloaded ones, or
+        'auto' to estimate it (see scale_estimation.py). Positions and dimensions are always
+        in screenshot pixels
+    prefilter (bool): In sliding mode, hash icon-sized windows of the screenshot and only
+        template match the few icons nearest to each likely window (see icon_hash.py)
+        instead of every icon everywhere. Much faster with many icons, but an icon whose
+        window doesn't hash close to it is missed. The candidates are confirmed with
+        cv2.matchTemplate in this process, so engine doesn't apply and workers must be 1
+    cache (DetectionCache): Answer screenshots detected before from this cache, and reuse the
+        sliding matches of unchanged tiles of similar screenshots (see detect_cache.py)
     
     Returns:
     dict: Dictionary of found icons with their positions and confidence scores
     """
-    # Read the target image
-    target_img = cv2.imread(target_image_path)
-    if target_img is None:
-        print(f"Error: Unable to read target image at {target_image_path}")
-        return {}
-        
-    target_gray = cv2.cvtColor(target_img, cv2.COLOR_BGR2GRAY)
+    if engine not in ('fft', 'opencv'):
+        raise ValueError(f"Unknown matching engine: {engine}")
+    if prefilter and workers > 1:
+        raise ValueError("prefilter matches in a single process, it can't be combined with workers > 1")
     
-    # Collect all matches across all icons first
-    all_matches = []
-    icon_info = {}
+    # Read the target image, unless it was already decoded (e.g. from an upload)
+    if isinstance(target_image_path, np.ndarray):
+        target_img = target_image_path
+    else:
+        with DETECTION_STAGE_SECONDS.time(stage='decode'):
+            target_img = cv2.imread(target_image_path)
+        if target_img is None:
+            print(f"Error: Unable to read target image at {target_image_path}")
+            return {}
     
-    # Iterate through all icons in the folder
-    for icon_file in Path(icons_folder).glob('*'):
-        if icon_file.suffix.lower() in ['.png', '.jpg', '.jpeg', '.bmp']:
-            icon_name = icon_file.stem
-            
-            # Read the icon image
-            icon = cv2.imread(str(icon_file), cv2.IMREAD_GRAYSCALE)
-            if icon is None:
-                print(f"Warning: Unable to read icon image at {icon_file}")
-                continue
-            
-            # Get icon dimensions
-            h, w = icon.shape
-            icon_info[icon_name] = {'dimensions': (w, h)}
-            
-            # Apply template matching
-            result = cv2.matchTemplate(target_gray, icon, cv2.TM_CCOEFF_NORMED)
-            
-            # Find matches using np.where
-            loc = np.where(result >= threshold)
-            matches = [(pt[0], pt[1], result[pt[1], pt[0]], icon_name) for pt in zip(*loc[::-1])]
-            
-            # Add matches to the combined list
-            all_matches.extend(matches)
+    target_gray = target_img if target_img.ndim == 2 else cv2.cvtColor(target_img, cv2.COLOR_BGR2GRAY)
     
-    # Sort all matches by confidence (highest first)
-    all_matches.sort(key=lambda x: x[2], reverse=True)
+    # Icons come from the template bank, decoded once per process
+    if isinstance(icons_folder, TemplateBank):
+        bank = icons_folder
+    else:
+        with DETECTION_STAGE_SECONDS.time(stage='load'):
+            bank = get_template_bank(icons_folder)
     
-    # Filter overlapping matches across all icons
-    filtered_matches = []
-    if all_matches:
-        used_areas = []
-        
-        for match in all_matches:
-            x, y, conf, icon_name = match
-            w, h = icon_info[icon_name]['dimensions']
-            
-            # Check if this match overlaps with any higher confidence match
-            is_overlapping = False
-            for used_x, used_y, used_w, used_h in used_areas:
-                # Calculate intersection
-                x_left = max(x, used_x)
-                y_top = max(y, used_y)
-                x_right = min(x + w, used_x + used_w)
-                y_bottom = min(y + h, used_y + used_h)
-                
-                # Check if there's an overlap
-                if x_left < x_right and y_top < y_bottom:
-                    intersection_area = (x_right - x_left) * (y_bottom - y_top)
-                    union_area = (w * h) + (used_w * used_h) - intersection_area
-                    
-                    # If overlap ratio is greater than threshold, skip this match
-                    if intersection_area / union_area > overlap_threshold:
-                        is_overlapping = True
-                        break
-            
-            if not is_overlapping:
-                filtered_matches.append(match)
-                used_areas.append((x, y, w, h))
+    # A screenshot detected before with the same parameters is answered from the cache
+    if cache is None:
+        return _find_icons(bank, target_gray, threshold, overlap_threshold, engine, workers, mode, scale, prefilter)
+    key = cache.key(target_gray, bank, threshold=threshold, overlap_threshold=overlap_threshold,
+                    engine=engine, mode=mode, scale=scale, prefilter=prefilter)
+    found_icons = cache.get(key)
+    if found_icons is not None:
+        print(f"Found {len(found_icons)} icons in the image (cached)")
+        return found_icons
+    found_icons = _find_icons(bank, target_gray, threshold, overlap_threshold, engine, workers, mode, scale, prefilter, cache)
+    cache.put(key, found_icons)
+    return found_icons
+
+def _find_icons(bank, target_gray, threshold, overlap_threshold, engine, workers, mode, scale, prefilter, cache=None):
+    """
+    Detect icons in a grayscale screenshot, see find_icons_in_image
+    """
+    grid = None
+    if mode == 'grid':
+        with DETECTION_STAGE_SECONDS.time(stage='grid'):
+            grid = locate_grid(target_gray)
+        if grid is None:
+            print("No inventory grid found, matching the whole image")
+    elif mode != 'sliding':
+        raise ValueError(f"Unknown detection mode: {mode}")
     
-    # Organize results by icon
+    if scale == 'auto':
+        with DETECTION_STAGE_SECONDS.time(stage='scale'):
+            scale = estimate_scale(bank, target_gray, grid)
+    
+    if grid is not None:
+        # Only a few candidates per slot are template matched, so scaling the icons is cheap
+        scaled_bank = get_scaled_bank(bank, scale)
+        with DETECTION_STAGE_SECONDS.time(stage='classify'):
+            matches = classify_slots(scaled_bank, target_gray, grid, threshold)
+        return _group_matches(scaled_bank, matches)
+    
+    # Shrinking the screenshot is cheaper than enlarging every icon, so icons are only
+    # resized when they are smaller on screen; positions are scaled back afterwards
+    factor = 1.0
+    if scale > 1:
+        factor = scale
+        size = (int(round(target_gray.shape[1] / scale)), int(round(target_gray.shape[0] / scale)))
+        target_gray = cv2.resize(target_gray, size, interpolation=cv2.INTER_AREA)
+        scale = 1.0
+    scaled_bank = get_scaled_bank(bank, scale)
+    
+    # Collect all matches across all icons first
+    with DETECTION_STAGE_SECONDS.time(stage='match'):
+        if prefilter:
+            xs, ys, scores, icons = get_hash_index(scaled_bank).candidates(target_gray, threshold)
+        elif cache is not None:
+            # Only tiles that changed since a similar screenshot are matched again
+            match_whole = None
+            if workers > 1:
+                match_whole = lambda image: _match_in_workers(bank, image, threshold, engine, workers, scale)
+            xs, ys, scores, icons = cache.match_tiles(
+                scaled_bank, target_gray, lambda image: match_icons(scaled_bank, image, threshold, engine), match_whole,
+                threshold=threshold, engine=engine,
+            )
+        elif workers > 1:
+            xs, ys, scores, icons = _match_in_workers(bank, target_gray, threshold, engine, workers, scale)
+        else:
+            xs, ys, scores, icons = match_icons(scaled_bank, target_gray, threshold, engine)
+    
+    # Filter overlapping matches across all icons. The matches are first put in one order
+    # (bank index, then row-major) so score ties break the same way whether they came from
+    # one pass, worker shards or cached tiles
+    with DETECTION_STAGE_SECONDS.time(stage='nms'):
+        order = np.lexsort((xs, ys, icons))
+        xs, ys, scores, icons = xs[order], ys[order], scores[order], icons[order]
+        boxes = np.empty((len(xs), 4), dtype=np.int64)
+        boxes[:, 0] = xs
+        boxes[:, 1] = ys
+        boxes[:, 2] = scaled_bank.shapes[icons, 1]
+        boxes[:, 3] = scaled_bank.shapes[icons, 0]
+        kept = filter_overlapping_matches(boxes, scores, overlap_threshold)
+    
+    return _group_matches(scaled_bank, [(xs[k], ys[k], scores[k], icons[k]) for k in kept.tolist()], factor)
+
+def _group_matches(bank, matches, factor=1.0):
+    """
+    Organize (x, y, confidence, bank index) matches into the per-icon results dict,
+    multiplying positions and dimensions by factor
+    """
     found_icons = {}
-    for x, y, conf, icon_name in filtered_matches:
+    for x, y, conf, i in matches:
+        icon_name = bank.names[i]
         if icon_name not in found_icons:
+            h, w = bank.shapes[i]
             found_icons[icon_name] = {
                 'positions': [],
                 'confidence': [],
-                'dimensions': icon_info[icon_name]['dimensions']
+                'dimensions': (int(round(w * factor)), int(round(h * factor)))
             }
         
-        found_icons[icon_name]['positions'].append((int(x), int(y)))
+        found_icons[icon_name]['positions'].append((int(round(x * factor)), int(round(y * factor))))
         found_icons[icon_name]['confidence'].append(float(conf))
                 
     print(f"Found {len(found_icons)} icons in the image")
     return found_icons
 
+# Worker processes get the bank once, when they start. A bank loaded from its saved file
+# is sent as the file path and mapped again, so the workers share its pages
+_worker_bank = None
+_pool = None
+_pool_key = None
+_pool_lock = threading.Lock()
+
+def _init_worker(bank):
+    global _worker_bank
+    _worker_bank = bank
+    # The processes are the parallelism; threads inside each would only oversubscribe the cores
+    numba.set_num_threads(1)
+    cv2.setNumThreads(1)
+
+def _get_pool(bank, workers):
+    """
+    Return the process pool for a bank, replacing the old one if the bank or worker count changed
+    """
+    global _pool, _pool_key
+    with _pool_lock:
+        if _pool is None or _pool_key != (bank.version, workers):
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # Spawned, not forked: numba's parallel threads don't survive a fork
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(bank,),
+            )
+            _pool_key = (bank.version, workers)
+        return _pool
+
+def _match_shard(shm_name, shape, threshold, engine, indices, scale):
+    # Read the screenshot straight out of the parent's shared memory block
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        target_gray = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        # Each worker keeps its own rescaled banks; indices are the same at every scale
+        matches = match_icons(get_scaled_bank(_worker_bank, scale), target_gray, threshold, engine, indices)
+        del target_gray
+        return matches
+    finally:
+        shm.close()
+
+def _match_in_workers(bank, target_gray, threshold, engine, workers, scale=1.0):
+    """
+    Match one screenshot with the icons (resized by scale) split across worker processes
+    """
+    pool = _get_pool(bank, workers)
+    shm = shared_memory.SharedMemory(create=True, size=max(target_gray.nbytes, 1))
+    try:
+        np.ndarray(target_gray.shape, dtype=np.uint8, buffer=shm.buf)[:] = target_gray
+        futures = [
+            pool.submit(_match_shard, shm.name, target_gray.shape, threshold, engine, shard, scale)
+            for shard in bank.shards(workers)
+        ]
+        shards = [future.result() for future in futures]
+        return tuple(np.concatenate(column) for column in zip(*shards))
+    finally:
+        shm.close()
+        shm.unlink()
+
+def _detect_file(path, threshold, overlap_threshold, engine, mode, scale, prefilter):
+    return path, find_icons_in_image(_worker_bank, path, threshold, overlap_threshold, engine, mode=mode, scale=scale, prefilter=prefilter)
+
+def find_icons_in_images(icons_folder, images, threshold=0.7, overlap_threshold=0.5, engine='fft', workers=None, mode='sliding', scale=1.0, prefilter=False):
+    """
+    Find icons in many screenshots, one screenshot per worker process at a time
+    
+    Parameters:
+    icons_folder (str or TemplateBank): Path to folder containing icon images, or an already loaded bank
+    images (str or iterable): Folder of screenshots, or any iterable of image paths (read lazily,
+        so it can be a stream)
+    threshold (float): Matching threshold (0-1), higher = more strict matching
+    overlap_threshold (float): Threshold for removing overlapping detections
+    engine (str): Matching engine, see find_icons_in_image
+    workers (int): Worker processes (default: one per CPU)
+    mode (str): Detection mode, see find_icons_in_image
+    scale (float or str): Icon scale, or 'auto' to estimate it per screenshot, see find_icons_in_image
+    prefilter (bool): Hash lookup before template matching, see find_icons_in_image
+    
+    Yields:
+    tuple: (image path, found icons) as each screenshot finishes
+    """
+    bank = icons_folder if isinstance(icons_folder, TemplateBank) else get_template_bank(icons_folder)
+    workers = workers or os.cpu_count() or 1
+    if isinstance(images, (str, Path)) and os.path.isdir(images):
+        images = [str(path) for path in icon_files(images)]
+    
+    pool = _get_pool(bank, workers)
+    pending = set()
+    for path in images:
+        pending.add(pool.submit(_detect_file, path, threshold, overlap_threshold, engine, mode, scale, prefilter))
+        # Only keep a couple of screenshots per worker queued, so a long stream isn't all read up front
+        if len(pending) >= 2 * workers:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in as_completed(pending):
+        yield future.result()
+
 def visualize_results(target_image_path, found_icons, output_path='result.jpg'):
     """
     Draws bounding boxes around detected icons
@@ -0,0 +1,257 @@
+# This module runs screenshot detection for the API without blocking the event loop.
+# The template bank is loaded once, at startup, and screenshots are decoded in memory and
+# matched in a small thread pool (OpenCV and the numba kernels release the GIL). Admission
+# is bounded: at most `max_pending` uploads are being read, queued or matched at any time,
+# and anything beyond that is turned away at once instead of queueing, so a burst of
+# uploads can't exhaust memory. Repeated screenshots are answered from a detection cache
+# (see detect_cache.py).
+import asyncio
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numba
+import numpy as np
+
+from detect_cache import DetectionCache
+from detect_items import find_icons_in_image, find_matches
+from icon_hash import get_hash_index
+from metrics import DETECTION_STAGE_SECONDS
+from template_bank import get_template_bank
+
+# Where download_images saves the item icons
+ICONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+# Where detection results are cached between restarts
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "detect_cache")
+# Largest screenshot upload accepted, in bytes (a 4K PNG is well under this)
+MAX_UPLOAD_BYTES = 32 * 1024 * 1024
+# Largest screenshot accepted, in pixels (an 8K screenshot is 33 million). A small file can
+# declare a huge image, so this is checked against the header before decoding
+MAX_IMAGE_PIXELS = 50_000_000
+# Seconds a client turned away for being over capacity is told to wait
+RETRY_AFTER = 1
+
+
+class DetectError(Exception):
+    """
+    A detection request that can't be served, with the HTTP status to answer it with.
+    """
+
+    def __init__(self, message, status=400, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+def image_size(data):
+    """
+    Read the width and height of a PNG, JPEG, WebP or BMP image from its header, without
+    decoding it.
+
+    Returns:
+    tuple: (width, height), or None if the format isn't one of these or the header is cut short
+    """
+    try:
+        if data.startswith(b"\x89PNG\r\n\x1a\n"):
+            return struct.unpack_from(">II", data, 16)
+        if data.startswith(b"BM"):
+            if struct.unpack_from("<I", data, 14)[0] == 12:
+                return struct.unpack_from("<HH", data, 18)
+            width, height = struct.unpack_from("<ii", data, 18)
+            return abs(width), abs(height)  # Top-down bitmaps have a negative height
+        if data.startswith(b"RIFF") and data[8:12] == b"WEBP":
+            chunk = data[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack_from("<HH", data, 26)
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                bits = struct.unpack_from("<I", data, 21)[0]
+                return (bits & 0x3FFF) + 1, (bits >> 14 & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+            return None
+        if data.startswith(b"\xff\xd8"):
+            # Walk the segments up to the first start-of-frame, which holds the size
+            position = 2
+            while True:
+                while data[position] != 0xFF:
+                    position += 1
+                while data[position] == 0xFF:
+                    position += 1  # Fill bytes
+                marker = data[position]
+                position += 1
+                if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+                    continue  # Markers without a length
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack_from(">HH", data, position + 3)
+                    return width, height
+                position += struct.unpack_from(">H", data, position)[0]
+    except (struct.error, IndexError):
+        pass
+    return None
+
+
+class DetectService:
+    """
+    Screenshot detection for the /detect endpoint.
+
+    Parameters:
+    icons_folder (str): Folder of item icons, as written by download_images
+    max_concurrency (int): Screenshots matched at the same time
+    max_pending (int): Uploads admitted at once (being read, waiting or matching)
+    max_upload_bytes (int): Largest accepted upload
+    max_image_pixels (int): Largest accepted screenshot, in width × height
+    cache_folder (str): Keep detection results on disk here too (None keeps them in memory only)
+    """
+
+    def __init__(self, icons_folder=ICONS_DIR, max_concurrency=2, max_pending=8, max_upload_bytes=MAX_UPLOAD_BYTES,
+                 max_image_pixels=MAX_IMAGE_PIXELS, cache_folder=CACHE_DIR):
+        self.icons_folder = icons_folder
+        self.max_concurrency = max_concurrency
+        self.max_pending = max(max_pending, max_concurrency)
+        self.max_upload_bytes = max_upload_bytes
+        self.max_image_pixels = max_image_pixels
+
+        # Start numba's threads from this (the main) thread: when a parallel kernel first
+        # runs in a pool thread, the TBB layer keeps the process from exiting
+        numba.get_num_threads()
+        if numba.threading_layer() == "workqueue" and max_concurrency > 1:
+            # Without TBB or OpenMP, numba's parallel kernels must not run in two threads at once
+            print("Warning: numba has no thread-safe threading layer, matching one screenshot at a time")
+            self.max_concurrency = 1
+        self.cache = DetectionCache(folder=cache_folder)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="detect")
+        self.lock = threading.Lock()
+        self.bank = None
+        self.error = None
+        self.pending = 0
+        self.detections = 0
+        self.rejected = 0
+
+    def load(self):
+        """
+        Load the template bank (building it if the icons changed) and compile the matching
+        kernels. Returns the bank, or None if there are no icons to load; the reason is
+        kept in self.error.
+        """
+        with self.lock:
+            if self.bank is not None:
+                return self.bank
+            if not os.path.isdir(self.icons_folder):
+                self.error = f"No icons at {self.icons_folder}, run download_images.py first."
+                return None
+            try:
+                with DETECTION_STAGE_SECONDS.time(stage="load"):
+                    bank = get_template_bank(self.icons_folder)
+            except (OSError, ValueError) as e:
+                self.error = f"Unable to load the icon templates: {e}"
+                return None
+            if len(bank) == 0:
+                self.error = f"No icons at {self.icons_folder}, run download_images.py first."
+                return None
+
+            # Compile the numba kernels now rather than on the first upload
+            find_matches(np.zeros((2, 2), dtype=np.float32), 1.0)
+            # Hash the icons for prefiltered matching, compiling the lookup kernel with them
+            hash_index = get_hash_index(bank)
+            for shape in hash_index.groups:
+                hash_index.nearest(shape, np.zeros(1, dtype=np.uint64))
+            self.bank = bank
+            self.error = None
+            print(f"Loaded {len(bank)} icon templates for detection")
+            return bank
+
+    async def preload(self):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.load)
+        if self.bank is None:
+            print(f"Warning: {self.error}")
+
+    def admit(self):
+        """
+        Admit one request, or raise DetectError(503) if max_pending are already admitted.
+        Every admitted request must call release() when it is done.
+        Only called from the event loop, so the counter needs no lock.
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise DetectError(
+                "Too many screenshots are being processed, try again shortly.",
+                status=503,
+                headers={"Retry-After": str(RETRY_AFTER)},
+            )
+        self.pending += 1
+
+    def release(self):
+        self.pending -= 1
+
+    async def read_upload(self, request):
+        """
+        Read the screenshot from a request: either the raw body, or the "file" field of a
+        multipart form (which needs python-multipart). Uploads over max_upload_bytes are
+        rejected with 413 without reading the rest.
+        """
+        too_large = DetectError(f"Screenshot too large, at most {self.max_upload_bytes} bytes.", status=413)
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > self.max_upload_bytes:
+            raise too_large
+
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            try:
+                form = await request.form(max_files=1)
+            except AssertionError:
+                raise DetectError(
+                    "Multipart uploads need python-multipart installed; send the image as the request body instead.",
+                    status=415,
+                )
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise DetectError("The form has no 'file' field with the screenshot.")
+            data = await upload.read(self.max_upload_bytes + 1)
+            await form.close()
+            if len(data) > self.max_upload_bytes:
+                raise too_large
+        else:
+            chunks = []
+            size = 0
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > self.max_upload_bytes:
+                    raise too_large
+                chunks.append(chunk)
+            data = b"".join(chunks)
+
+        if not data:
+            raise DetectError("No screenshot uploaded.")
+        return data
+
+    def _detect(self, data, options):
+        # Check the size from the header first: decoding allocates the whole image
+        size = image_size(data)
+        if size is None:
+            raise DetectError("Unsupported screenshot format, send a PNG, JPEG, WebP or BMP image.", status=415)
+        if size[0] * size[1] > self.max_image_pixels:
+            raise DetectError(
+                f"Screenshot too large, {size[0]}x{size[1]} is over {self.max_image_pixels} pixels.", status=413
+            )
+        with DETECTION_STAGE_SECONDS.time(stage="decode"):
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise DetectError("Unable to decode the screenshot.", status=415)
+        return find_icons_in_image(self.bank, image, cache=self.cache, **options)
+
+    async def detect(self, data, **options):
+        """
+        Decode a screenshot and find the icons in it, in the thread pool.
+        Keyword arguments are passed to find_icons_in_image.
+
+        Returns:
+        dict: The icons found, as returned by find_icons_in_image
+        """
+        loop = asyncio.get_running_loop()
+        if self.bank is None and await loop.run_in_executor(self.executor, self.load) is None:
+            raise DetectError(self.error, status=503)
+        found = await loop.run_in_executor(self.executor, self._detect, data, options)
+        self.detections += 1
+        return found
@@ -1,41 +1,200 @@
-from items import get_items
+# This script downloads the item icons detection matches against.
+# Icons are fetched concurrently through the crawler (one shared session, per-host rate
+# limiting, retries) and recorded in a manifest next to the icons folder with each icon's
+# ETag / Last-Modified, size and hash. The next run sends conditional requests and only
+# rewrites icons whose content changed; icons checked recently and still intact on disk
+# aren't requested at all, so an interrupted run resumes where it stopped.
+import argparse
+import asyncio
+import os
 import time
+from contextlib import aclosing
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+from crawler import Crawler
+from items import get_items
+from manifest import atomic_write_bytes, conditional_headers, content_hash, load_manifest, save_manifest, validators
+from template_bank import build_bank_file, default_bank_file
+
+# Seconds after which a downloaded icon is checked with the server again
+RECHECK_AFTER = 86400
+# The manifest is saved after this many downloads, so an interrupted run keeps its progress
+SAVE_EVERY = 50
 
-def download_images():
+
+def default_manifest_file(folder):
     """
-    Download images for all items in the items dictionary.
-    The images are saved in a folder named 'images' with the item shortname as the filename.
+    Where the manifest for an icons folder is saved: next to it, images -> images_manifest.json.
+    """
+    return os.path.abspath(folder).rstrip("\\/") + "_manifest.json"
+
+
+def icon_url(item, base_url=None):
+    """
+    Return the icon URL of an item, moved to base_url's host if given (the local stand-in server).
+    """
+    url = item["icon"]
+    if base_url:
+        base = urlsplit(base_url)
+        url = urlsplit(url)._replace(scheme=base.scheme, netloc=base.netloc).geturl()
+    return url
+
+
+def _intact(entry, path):
+    # The file on disk is still the one the manifest describes. The size is checked first
+    # so a truncated file isn't read at all
+    try:
+        if os.path.getsize(path) != entry.get("size"):
+            return False
+        with open(path, "rb") as f:
+            return content_hash(f.read()) == entry.get("hash")
+    except OSError:
+        return False
+
+
+def _process_icon(manifest, folder):
+    """
+    Build the thread pool callback that saves a fetched icon.
+    It returns ("unchanged", entry) when the icon on disk is already current, and
+    ("changed", entry) once a new icon has been written.
+    """
+
+    def process(key, url, response):
+        path = os.path.join(folder, f"{key}.png")
+        entry = dict(manifest.get(key) or {})
+        for name, value in validators(response).items():
+            if value:
+                entry[name] = value
+        entry["url"] = url
+        entry["checked"] = time.time()
+
+        if response.status_code == 304:
+            return ("unchanged", entry)
+        content = response.content
+        digest = content_hash(content)
+        if entry.get("hash") == digest and _intact(entry, path):
+            return ("unchanged", entry)
+
+        # Refuse anything that isn't an image rather than poisoning the template bank
+        icon = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if icon is None:
+            raise ValueError(f"{url} is not an image")
+        atomic_write_bytes(content, path)
+        entry["hash"] = digest
+        entry["size"] = len(content)
+        return ("changed", entry)
+
+    return process
+
+
+async def fetch_icons(items, folder, manifest, base_url=None, full=False,
+                      recheck_after=RECHECK_AFTER, manifest_file=None, verbose=True, **crawler_options):
+    """
+    Download the icon of every item into folder as <shortname>.png.
+
+    Parameters:
+    items (dict): Items as returned by get_items()
+    folder (str): Where the icons are saved
+    manifest (dict): Manifest from the previous run, keyed by shortname (updated in place)
+    base_url (str): Fetch icons from a different host (used by the local stand-in server)
+    full (bool): Request every icon, even ones checked recently
+    recheck_after (float): Seconds before an icon is checked with the server again
+    manifest_file (str): Save the manifest here every SAVE_EVERY downloads
+    verbose (bool): Print a line for every downloaded or failed icon
+    crawler_options: Passed through to Crawler (concurrency, rate, retries...)
+
+    Returns:
+    dict: Counts of "changed", "unchanged", "skipped" and "failed" icons
     """
-    import os
-    import requests
+    os.makedirs(folder, exist_ok=True)
 
-    # Create the images directory if it doesn't exist
-    if not os.path.exists("images"):
-        os.makedirs("images")
+    stats = {"changed": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+    now = time.time()
+    targets = []
+    for item in items.values():
+        key = item.get("shortname")
+        if not key or not item.get("icon"):
+            continue
+        path = os.path.join(folder, f"{key}.png")
+        entry = manifest.get(key)
+        intact = entry is not None and _intact(entry, path)
+        if intact and not full and now - entry.get("checked", 0) < recheck_after:
+            stats["skipped"] += 1
+        elif intact and not full:
+            targets.append((key, icon_url(item, base_url), conditional_headers(entry)))
+        else:
+            targets.append((key, icon_url(item, base_url)))
+
+    since_save = 0
+    with Crawler(**crawler_options) as crawler:
+        process = _process_icon(manifest, folder)
+        async with aclosing(crawler.crawl(targets, process)) as results:
+            async for result in results:
+                if result.error is not None:
+                    stats["failed"] += 1
+                    if verbose:
+                        print(f"Error downloading {result.key}: {result.error}")
+                    continue
+
+                status, entry = result.data
+                manifest[result.key] = entry
+                stats[status] += 1
+                if status == "changed" and verbose:
+                    print(f"Downloaded {result.key}")
+                since_save += 1
+                if manifest_file and since_save >= SAVE_EVERY:
+                    save_manifest(manifest, manifest_file)
+                    since_save = 0
+    return stats
 
+
+def download_images(folder="images", full=False, build_bank=True, **options):
+    """
+    Download images for all items in the items dictionary.
+    The images are saved in `folder` ('images' by default) with the item shortname as the filename.
+    Unchanged icons are skipped using the manifest next to the folder (see fetch_icons, which
+    also takes the other keyword arguments), and the template bank is rebuilt afterwards.
+    """
     # Get the items data
     items = get_items()
     if isinstance(items, str):  # If an error message was returned
         print(items)
-        return
+        return None
 
-    for item in items.values():
-        image_url = item["icon"]
-        shortname = item["shortname"]
-        filename = f"images/{shortname}.png"
-
-        # Download the image
-        try:
-            response = requests.get(image_url)
-            response.raise_for_status()  # Raise an exception for bad status codes
-            with open(filename, "wb") as f:
-                f.write(response.content)
-            print(f"Downloaded {filename}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error downloading {filename}: {e}")
-        
-        time.sleep(0.5)  # Sleep for 1 second to avoid overwhelming the server
+    manifest_file = default_manifest_file(folder)
+    manifest = {} if full else load_manifest(manifest_file)
+    start_time = time.time()
+    try:
+        stats = asyncio.run(fetch_icons(
+            items, folder, manifest, full=full, manifest_file=manifest_file, **options
+        ))
+    finally:
+        # Keep whatever was downloaded, even if the run is interrupted
+        save_manifest(manifest, manifest_file)
+    print(
+        f"Icons downloaded in {time.time() - start_time:.2f} seconds ({stats['changed']} changed, "
+        f"{stats['unchanged']} unchanged, {stats['skipped']} recently checked, {stats['failed']} failed)."
+    )
+
+    # Pack the icons into the template bank detect_items loads
+    if build_bank and (stats["changed"] or not os.path.exists(default_bank_file(folder))):
+        bank = build_bank_file(folder)
+        print(f"Saved template bank with {len(bank)} icons")
+    return stats
 
 if __name__ == "__main__":
-    download_images()
-# This script downloads images for all items in the items dictionary.
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folder", default="images", help="Where the icons are saved")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum downloads in flight")
+    parser.add_argument("--rate", type=float, default=8.0, help="Requests per second per host (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per icon")
+    parser.add_argument("--base-url", default=None, help="Download from a different host, e.g. the local stand-in server")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and download every icon")
+    args = parser.parse_args()
+    download_images(
+        args.folder, args.full,
+        concurrency=args.concurrency, rate=args.rate, retries=args.retries, base_url=args.base_url,
+    )
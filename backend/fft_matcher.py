@@ -0,0 +1,192 @@
+# This module matches many same-size templates against a screenshot at once.
+# TM_CCOEFF_NORMED at (x, y) is sum(T' * I) / (|T'| * |I - mean(I)|) over the window,
+# where T' is the zero-mean template. The numerator is a cross-correlation, so it is
+# computed in the frequency domain: each screenshot tile is transformed once and multiplied
+# by the precomputed spectra of every template in the size group (OpenCV's DFT, which is
+# several times faster than numpy.fft here). The window norms come
+# from integral images, shared by every template of that size.
+#
+# Tiles are overlap-save blocks whose FFT size depends only on the template and screenshot
+# sizes, so template spectra are cached and reused for screenshots of the same resolution.
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Windows flatter than this (sum of squared deviations per pixel) score 0, as in OpenCV
+FLAT_WINDOW_VARIANCE = 1e-2
+
+INVERSE_FLAGS = cv2.DFT_INVERSE | cv2.DFT_REAL_OUTPUT | cv2.DFT_SCALE
+# Matchers (and their cached spectra) kept for the most recently used banks
+CACHED_MATCHERS = 8
+
+
+def _tile_length(template, output):
+    # Transform work along one axis is about tiles x length x log(length); longer tiles
+    # waste less on the template overlap but may overshoot the image
+    whole = cv2.getOptimalDFTSize(output + template - 1)
+    lengths = {cv2.getOptimalDFTSize(n) for n in range(2 * template, whole, 16)}
+    lengths.add(whole)
+    best_cost, best_length = None, None
+    for length in sorted(lengths):
+        tiles = -(-output // (length - template + 1))
+        cost = tiles * length * np.log2(length)
+        if best_cost is None or cost < best_cost:
+            best_cost, best_length = cost, length
+    return best_length
+
+
+def fft_size(template_shape, image_shape):
+    """
+    Pick the FFT tile size (height, width) for matching a template against an image.
+    """
+    h, w = template_shape
+    return _tile_length(h, image_shape[0] - h + 1), _tile_length(w, image_shape[1] - w + 1)
+
+
+def window_norms(image, template_shape):
+    """
+    Return (sum of squared deviations from the window mean) for every placement of a
+    template_shape window in image, the way matchTemplate lays out its result.
+    """
+    h, w = template_shape
+    sums, squares = cv2.integral2(image, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+    def window(table):
+        return table[h:, w:] - table[:-h, w:] - table[h:, :-w] + table[:-h, :-w]
+
+    window_sum = window(sums)
+    return np.maximum(window(squares) - window_sum * window_sum / (h * w), 0.0)
+
+
+class FFTMatcher:
+    """
+    Batched TM_CCOEFF_NORMED over a TemplateBank.
+
+    Parameters:
+    bank (TemplateBank): Templates to match
+    batch_size (int): Templates correlated together (bounds memory per tile)
+    cache_bytes (int): Budget for cached template spectra
+    """
+
+    def __init__(self, bank, batch_size=16, cache_bytes=256 * 1024 * 1024):
+        self.bank = bank
+        self.batch_size = batch_size
+        self.cache_bytes = cache_bytes
+        self.spectra = OrderedDict()
+        self.spectra_bytes = 0
+        self.lock = threading.Lock()
+
+    def _spectra(self, indices, shape, fft_shape):
+        # Spectra (OpenCV's packed CCS layout) of the zero-mean templates, zero padded to a tile
+        key = (tuple(indices), fft_shape)
+        with self.lock:
+            spectra = self.spectra.get(key)
+            if spectra is not None:
+                self.spectra.move_to_end(key)
+                return spectra
+
+        h, w = shape
+        spectra = np.zeros((len(indices),) + fft_shape, dtype=np.float32)
+        for k, i in enumerate(indices):
+            spectra[k, :h, :w] = self.bank.template(i)
+            spectra[k, :h, :w] -= np.float32(self.bank.means[i])
+            cv2.dft(spectra[k], dst=spectra[k], nonzeroRows=h)
+
+        with self.lock:
+            self.spectra[key] = spectra
+            self.spectra_bytes += spectra.nbytes
+            while self.spectra_bytes > self.cache_bytes and len(self.spectra) > 1:
+                _, evicted = self.spectra.popitem(last=False)
+                self.spectra_bytes -= evicted.nbytes
+        return spectra
+
+    def match_group(self, image, indices):
+        """
+        Match templates of one size against a grayscale image.
+
+        Parameters:
+        image (np.ndarray): 2D uint8 screenshot
+        indices (list): Bank indices of templates that all have the same shape
+
+        Returns:
+        generator: (batch indices, scores) per batch of templates, where scores is a
+            (len(batch), H - h + 1, W - w + 1) float32 array holding the values
+            cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED) gives per template
+        """
+        h, w = (int(v) for v in self.bank.shapes[indices[0]])
+        height, width = image.shape
+        out_h, out_w = height - h + 1, width - w + 1
+        if out_h <= 0 or out_w <= 0:
+            return
+
+        fft_h, fft_w = fft_size((h, w), image.shape)
+        step_h, step_w = fft_h - h + 1, fft_w - w + 1
+
+        # Pad the image so every tile is a full FFT block
+        tiles_y = -(-out_h // step_h)
+        tiles_x = -(-out_w // step_w)
+        padded = np.zeros((tiles_y * step_h + h - 1, tiles_x * step_w + w - 1), dtype=np.float32)
+        padded[:height, :width] = image
+
+        # One transform per tile, shared by every template in the group
+        tiles = []
+        for y in range(0, tiles_y * step_h, step_h):
+            for x in range(0, tiles_x * step_w, step_w):
+                rows, cols = min(step_h, out_h - y), min(step_w, out_w - x)
+                tiles.append((y, x, rows, cols, cv2.dft(padded[y:y + fft_h, x:x + fft_w])))
+
+        # The window norms are shared too
+        variances = window_norms(image, (h, w))
+        flat = variances <= FLAT_WINDOW_VARIANCE * h * w
+        image_norms = np.sqrt(variances).astype(np.float32)
+        image_norms[flat] = np.inf
+
+        for start in range(0, len(indices), self.batch_size):
+            batch = indices[start:start + self.batch_size]
+            spectra = self._spectra(batch, (h, w), (fft_h, fft_w))
+            scores = np.empty((len(batch), out_h, out_w), dtype=np.float32)
+            for y, x, rows, cols, tile in tiles:
+                for k in range(len(batch)):
+                    # Multiplying by the conjugate spectrum correlates
+                    product = cv2.mulSpectrums(tile, spectra[k], 0, conjB=True)
+                    correlated = cv2.dft(product, flags=INVERSE_FLAGS)
+                    scores[k, y:y + rows, x:x + cols] = correlated[:rows, :cols]
+
+            # Flat windows (infinite norm) score 0, and so do flat templates
+            template_norms = self.bank.norms[batch].astype(np.float32)
+            template_norms[template_norms == 0] = np.inf
+            scores /= template_norms[:, None, None]
+            scores /= image_norms
+            np.clip(scores, -1.0, 1.0, out=scores)
+            yield batch, scores
+
+    def match(self, image, indices=None):
+        """
+        Match every template in the bank (or only `indices`), yielding (bank index, scores)
+        per template.
+        """
+        for indices in self.bank.groups(indices).values():
+            for batch, scores in self.match_group(image, indices):
+                yield from zip(batch, scores)
+
+
+_matchers = OrderedDict()
+_matchers_lock = threading.Lock()
+
+
+def get_fft_matcher(bank):
+    """
+    Return the FFTMatcher for a bank, so cached spectra are reused across screenshots.
+    Only the CACHED_MATCHERS most recently used banks keep theirs, since rescaled banks
+    come and go.
+    """
+    with _matchers_lock:
+        matcher = _matchers.get(bank.version)
+        if matcher is None or matcher.bank is not bank:
+            matcher = _matchers[bank.version] = FFTMatcher(bank)
+        _matchers.move_to_end(bank.version)
+        while len(_matchers) > CACHED_MATCHERS:
+            _matchers.popitem(last=False)
+        return matcher
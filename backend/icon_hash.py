@@ -0,0 +1,235 @@
+# This module narrows sliding-window detection down to a few candidate icons per region
+# with perceptual hashes, instead of template matching every icon everywhere. Each icon is
+# reduced to a 64-bit hash: the lowest 8x8 DCT coefficients of the icon shrunk to 32x32,
+# each bit saying whether a coefficient is above their median. Icon-sized windows of the
+# screenshot are hashed the same way on a fine stride (the DCT is separable, so all
+# windows are hashed with a handful of 1D filters), and each window looks up its nearest
+# icons by Hamming distance in a table of the icon hashes. Only the windows that hash
+# closer to an icon than their neighbourhood does are kept, and only their nearest icons
+# are confirmed with TM_CCOEFF_NORMED in a small crop around the window.
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from numba import jit, prange
+
+# Icons (and windows) are shrunk to this size before the DCT
+DCT_SIZE = 32
+# The hash keeps HASH_SIZE x HASH_SIZE of the lowest frequency coefficients
+HASH_SIZE = 8
+# Window stride, as a fraction of the icon size: the hash of a window a few pixels off an
+# icon drifts quickly, so the windows have to be close together
+STRIDE_FRACTION = 1 / 16
+# Windows whose nearest icon is further than this many bits away are not considered
+MAX_DISTANCE = 24
+# Windows this flat (grey level standard deviation) hash to noise and are skipped
+MIN_WINDOW_STD = 4.0
+# Hash indexes kept for the most recently used banks
+CACHED_INDEXES = 8
+
+
+def _dct_basis(size=DCT_SIZE, count=HASH_SIZE):
+    # Rows are the first `count` DCT-II basis vectors of length `size`
+    x = np.arange(size)
+    return np.array([np.cos(np.pi * (2 * x + 1) * u / (2 * size)) for u in range(count)], dtype=np.float32)
+
+
+DCT_BASIS = _dct_basis()
+
+
+def _pack_hashes(coefficients):
+    """
+    Turn (..., HASH_SIZE^2) DCT coefficients into uint64 hashes. The DC term (the mean
+    brightness) is left out, so the hash only describes the icon's structure.
+    """
+    ac = coefficients[..., 1:]
+    bits = ac > np.median(ac, axis=-1, keepdims=True)
+    return np.packbits(bits, axis=-1, bitorder="little").view("<u8")[..., 0]
+
+
+def perceptual_hash(image):
+    """
+    Return the 64-bit perceptual hash of a grayscale image as a numpy uint64.
+    """
+    small = cv2.resize(image, (DCT_SIZE, DCT_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    return _pack_hashes((DCT_BASIS @ small @ DCT_BASIS.T).ravel())
+
+
+def hash_windows(gray, shape, stride):
+    """
+    Hash every window of a given size on a grid over a grayscale screenshot.
+
+    Parameters:
+    gray (np.ndarray): Grayscale screenshot
+    shape (tuple): (height, width) of the windows, the size of the icons they're compared with
+    stride (int): Pixels between neighbouring windows
+
+    Returns:
+    tuple: (window xs, window ys, (rows x columns) hashes, (rows x columns) mask of the
+        windows with enough detail to hash)
+    """
+    height, width = gray.shape
+    h, w = shape
+    xs = np.arange(0, width - w + 1, stride)
+    ys = np.arange(0, height - h + 1, stride)
+    if len(xs) == 0 or len(ys) == 0:
+        return xs, ys, np.empty((len(ys), len(xs)), dtype=np.uint64), np.zeros((len(ys), len(xs)), dtype=bool)
+
+    # Shrink the screenshot so every window becomes DCT_SIZE x DCT_SIZE, then find each
+    # window's top-left corner in the shrunk image
+    fx, fy = DCT_SIZE / w, DCT_SIZE / h
+    small_size = (max(DCT_SIZE, int(round(width * fx))), max(DCT_SIZE, int(round(height * fy))))
+    small = cv2.resize(gray, small_size, interpolation=cv2.INTER_AREA).astype(np.float32)
+    small_xs = np.minimum(np.round(xs * fx).astype(np.int64), small_size[0] - DCT_SIZE)
+    small_ys = np.minimum(np.round(ys * fy).astype(np.int64), small_size[1] - DCT_SIZE)
+
+    # Coefficient (u, v) of the window at (x, y) is a 2D filter at (x, y), and the filter
+    # is the product of the 1D basis vectors u (down) and v (across)
+    coefficients = np.empty((len(ys), len(xs), HASH_SIZE * HASH_SIZE), dtype=np.float32)
+    for u in range(HASH_SIZE):
+        rows = cv2.filter2D(small, -1, DCT_BASIS[u].reshape(-1, 1), anchor=(0, 0), borderType=cv2.BORDER_CONSTANT)[small_ys]
+        for v in range(HASH_SIZE):
+            filtered = cv2.filter2D(rows, -1, DCT_BASIS[v].reshape(1, -1), anchor=(0, 0), borderType=cv2.BORDER_CONSTANT)
+            coefficients[:, :, u * HASH_SIZE + v] = filtered[:, small_xs]
+
+    # Window standard deviations from box filters of the pixels and their squares
+    mean = cv2.boxFilter(small, -1, (DCT_SIZE, DCT_SIZE), anchor=(0, 0), borderType=cv2.BORDER_CONSTANT)
+    square = cv2.boxFilter(small * small, -1, (DCT_SIZE, DCT_SIZE), anchor=(0, 0), borderType=cv2.BORDER_CONSTANT)
+    variance = (square - mean * mean)[np.ix_(small_ys, small_xs)]
+    detailed = variance >= MIN_WINDOW_STD ** 2
+    return xs, ys, _pack_hashes(coefficients), detailed
+
+
+@jit(nopython=True, cache=True)
+def _popcount(x):
+    # Bits set in a 64-bit integer, by summing neighbouring bit fields
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _nearest(queries, hashes, k):
+    # The k nearest hashes (by Hamming distance) to every query, nearest first
+    count = len(queries)
+    indices = np.full((count, k), -1, dtype=np.int32)
+    distances = np.full((count, k), 65, dtype=np.int32)
+    for q in prange(count):
+        query = queries[q]
+        for i in range(len(hashes)):
+            distance = np.int32(_popcount(query ^ hashes[i]))
+            if distance >= distances[q, k - 1]:
+                continue
+            # Insert into the sorted list of the k nearest so far
+            j = k - 1
+            while j > 0 and distances[q, j - 1] > distance:
+                distances[q, j] = distances[q, j - 1]
+                indices[q, j] = indices[q, j - 1]
+                j -= 1
+            distances[q, j] = distance
+            indices[q, j] = i
+    return indices, distances
+
+
+class HashIndex:
+    """
+    Perceptual hashes of every icon in a bank, grouped by icon size, for looking up the
+    icons nearest to a screenshot window.
+
+    Parameters:
+    bank (TemplateBank): Icons to index
+    """
+
+    def __init__(self, bank):
+        self.bank = bank
+        self.groups = {}
+        for shape, indices in bank.groups().items():
+            hashes = np.array([perceptual_hash(bank.template(i)) for i in indices], dtype=np.uint64)
+            self.groups[shape] = (np.array(indices, dtype=np.int32), hashes)
+
+    def nearest(self, shape, queries, k=3):
+        """
+        Find the k icons of a size group whose hashes are nearest to each query hash.
+
+        Returns:
+        tuple: ((queries x k) bank indices, (queries x k) Hamming distances), nearest first;
+            missing neighbours (fewer than k icons) have index -1
+        """
+        indices, hashes = self.groups[shape]
+        k = min(k, len(hashes))
+        nearest, distances = _nearest(np.ascontiguousarray(queries, dtype=np.uint64), hashes, k)
+        return indices[nearest], distances
+
+    def candidates(self, gray, threshold=0.7, k=3, max_distance=MAX_DISTANCE):
+        """
+        Find icons in a grayscale screenshot, template matching only the k nearest icons
+        of the windows that look most like an icon.
+
+        Parameters:
+        gray (np.ndarray): Grayscale screenshot
+        threshold (float): Minimum TM_CCOEFF_NORMED score of a match
+        k (int): Icons confirmed per window
+        max_distance (int): Windows with no icon within this many bits are skipped
+
+        Returns:
+        tuple: (xs, ys, scores, bank indices) arrays with one entry per confirmed match,
+            like match_icons
+        """
+        height, width = gray.shape
+        found = []
+        for shape in self.groups:
+            h, w = shape
+            stride = max(1, int(round(min(h, w) * STRIDE_FRACTION)))
+            xs, ys, hashes, detailed = hash_windows(gray, shape, stride)
+            if not detailed.any():
+                continue
+            nearest, distances = self.nearest(shape, hashes[detailed], k)
+
+            # Keep the windows closest to an icon within half an icon around them, so each
+            # icon on screen is confirmed once rather than from every window overlapping it
+            best = np.full(hashes.shape, 65, dtype=np.float32)
+            best[detailed] = distances[:, 0]
+            radius = max(1, min(h, w) // (2 * stride))
+            local = cv2.erode(best, np.ones((2 * radius + 1, 2 * radius + 1), dtype=np.uint8))
+            keep = ((best <= local) & (best <= max_distance))[detailed]
+
+            rows, columns = np.nonzero(detailed)
+            margin = stride
+            for row, column, icons in zip(rows[keep], columns[keep], nearest[keep]):
+                x0, y0 = max(int(xs[column]) - margin, 0), max(int(ys[row]) - margin, 0)
+                crop = gray[y0:min(int(ys[row]) + h + margin, height), x0:min(int(xs[column]) + w + margin, width)]
+                for i in icons:
+                    if i < 0:
+                        continue
+                    result = cv2.matchTemplate(crop, self.bank.template(int(i)), cv2.TM_CCOEFF_NORMED)
+                    _, score, _, (dx, dy) = cv2.minMaxLoc(result)
+                    if score >= threshold:
+                        found.append((x0 + dx, y0 + dy, score, int(i)))
+
+        if not found:
+            return (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32),
+                    np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32))
+        xs, ys, scores, icons = zip(*found)
+        return (np.array(xs, dtype=np.int32), np.array(ys, dtype=np.int32),
+                np.array(scores, dtype=np.float32), np.array(icons, dtype=np.int32))
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_hash_index(bank):
+    """
+    Return the HashIndex for a bank, so icons are only hashed once. Only the
+    CACHED_INDEXES most recently used banks keep theirs, like get_fft_matcher.
+    """
+    with _indexes_lock:
+        index = _indexes.get(bank.version)
+        if index is None or index.bank is not bank:
+            index = _indexes[bank.version] = HashIndex(bank)
+        _indexes.move_to_end(bank.version)
+        while len(_indexes) > CACHED_INDEXES:
+            _indexes.popitem(last=False)
+        return index
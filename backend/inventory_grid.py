@@ -0,0 +1,205 @@
+# This module detects items in inventory-style screenshots by classifying slots instead of
+# sliding every icon over every pixel. The slot grid is found from edge projections: slot
+# borders are long straight edges repeating at a fixed pitch, so the summed gradient along
+# each column (and row) peaks at a period that autocorrelation picks out. Each slot is
+# then compared with every icon at once through small feature vectors, and the best few
+# candidates can be confirmed with a real template match inside the slot.
+import cv2
+import numpy as np
+
+from template_bank import normalize_features, thumbnail
+
+# Slots smaller than this (in pixels) aren't considered
+MIN_PITCH = 16
+# Gradient (3x3 Sobel) above which a pixel counts as part of an edge
+EDGE_THRESHOLD = 10.0
+# Slots whose crop varies less than this (grey level standard deviation) are empty
+EMPTY_SLOT_STD = 4.0
+
+
+class SlotGrid:
+    """
+    A regular grid of inventory slots.
+
+    Parameters:
+    x, y (int): Top-left corner of the first slot
+    pitch_x, pitch_y (int): Distance between the starts of neighbouring slots
+    slot_w, slot_h (int): Size of a slot
+    columns, rows (int): Number of slots across and down
+    """
+
+    def __init__(self, x, y, pitch_x, pitch_y, slot_w, slot_h, columns, rows):
+        self.x = x
+        self.y = y
+        self.pitch_x = pitch_x
+        self.pitch_y = pitch_y
+        self.slot_w = slot_w
+        self.slot_h = slot_h
+        self.columns = columns
+        self.rows = rows
+
+    def __repr__(self):
+        return (f"SlotGrid({self.columns}x{self.rows} at ({self.x}, {self.y}), "
+                f"pitch {self.pitch_x}x{self.pitch_y}, slot {self.slot_w}x{self.slot_h})")
+
+    def slots(self):
+        """
+        Yield (x, y) of the top-left corner of every slot, row by row.
+        """
+        for row in range(self.rows):
+            for column in range(self.columns):
+                yield self.x + column * self.pitch_x, self.y + row * self.pitch_y
+
+
+def _edge_axis(profile, min_pitch=MIN_PITCH):
+    """
+    Find the repeating slot edges along one axis of an edge projection.
+    Returns (first slot start, pitch, slot size, count) or None.
+    """
+    length = len(profile)
+    centered = profile - profile.mean()
+    if length < 2 * min_pitch or not centered.any():
+        return None
+
+    # The pitch is the lag where the edge pattern best lines up with itself
+    correlation = np.correlate(centered, centered, mode="full")[length - 1:]
+    lags = correlation[min_pitch:length // 2]
+    if len(lags) == 0:
+        return None
+    pitch = min_pitch + int(np.argmax(lags))
+    if correlation[pitch] < 0.1 * correlation[0]:
+        return None
+
+    # Fold the profile over the pitch: the slot's two edges are the strongest phases
+    usable = length - length % pitch
+    folded = profile[:usable].reshape(-1, pitch).sum(axis=0)
+    first = int(np.argmax(folded))
+    masked = folded.copy()
+    for offset in range(-2, 3):
+        masked[(first + offset) % pitch] = -1
+    second = int(np.argmax(masked))
+    # Slots are wider than the gaps between them
+    distance = (second - first) % pitch
+    if distance >= pitch - distance:
+        start, size = first, distance
+    else:
+        start, size = second, pitch - distance
+
+    # The grid covers the longest run of positions where the slot edges are strong
+    positions = np.arange(start, length - size, pitch)
+    if len(positions) == 0:
+        return None
+    strength = np.array([profile[max(p - 1, 0):p + 2].max() + profile[p + size - 1:p + size + 2].max() for p in positions])
+    strong = strength >= 0.5 * strength.max()
+    best_start, best_count, run_start = 0, 0, None
+    for k, flag in enumerate(np.append(strong, False)):
+        if flag and run_start is None:
+            run_start = k
+        elif not flag and run_start is not None:
+            if k - run_start > best_count:
+                best_start, best_count = run_start, k - run_start
+            run_start = None
+    if best_count < 2:
+        return None
+    return int(positions[best_start]), pitch, size, best_count
+
+
+def locate_grid(gray, min_pitch=MIN_PITCH):
+    """
+    Locate the inventory slot grid in a grayscale screenshot.
+
+    Parameters:
+    gray (np.ndarray): Grayscale screenshot
+    min_pitch (int): Smallest slot pitch to consider, in pixels
+
+    Returns:
+    SlotGrid: The grid, or None if no regular grid of at least 2x2 slots was found
+    """
+    # Count edge pixels on long straight lines rather than summing gradients: slot borders are
+    # long, faint lines, while icons have short, strong edges that would otherwise dominate
+    image = gray.astype(np.float32)
+    edges_x = (np.abs(cv2.Sobel(image, cv2.CV_32F, 1, 0, ksize=3)) > EDGE_THRESHOLD).astype(np.uint8)
+    edges_y = (np.abs(cv2.Sobel(image, cv2.CV_32F, 0, 1, ksize=3)) > EDGE_THRESHOLD).astype(np.uint8)
+    edges_x = cv2.morphologyEx(edges_x, cv2.MORPH_OPEN, np.ones((min_pitch, 1), dtype=np.uint8)).astype(np.float32)
+    edges_y = cv2.morphologyEx(edges_y, cv2.MORPH_OPEN, np.ones((1, min_pitch), dtype=np.uint8)).astype(np.float32)
+
+    # Project over the whole image first, then only over the rows (columns) the grid spans,
+    # so edges elsewhere on screen count less
+    columns = _edge_axis(edges_x.sum(axis=0), min_pitch)
+    if columns is None:
+        return None
+    x, pitch_x, slot_w, count_x = columns
+    rows = _edge_axis(edges_y[:, x:x + pitch_x * count_x].sum(axis=1), min_pitch)
+    if rows is None:
+        return None
+    y, pitch_y, slot_h, count_y = rows
+    columns = _edge_axis(edges_x[y:y + pitch_y * count_y].sum(axis=0), min_pitch)
+    if columns is None:
+        return None
+    x, pitch_x, slot_w, count_x = columns
+    return SlotGrid(x, y, pitch_x, pitch_y, slot_w, slot_h, count_x, count_y)
+
+
+def classify_slots(bank, gray, grid, threshold=0.7, confirm=True, candidates=3):
+    """
+    Classify every slot of a grid against the template bank.
+
+    Parameters:
+    bank (TemplateBank): Icons to classify against
+    gray (np.ndarray): Grayscale screenshot
+    grid (SlotGrid): Slots to classify
+    threshold (float): Minimum score for a slot to count as an icon (TM_CCOEFF_NORMED when
+        confirming, feature correlation otherwise)
+    confirm (bool): Template match the best candidates inside the slot, which also finds
+        the icon's exact position
+    candidates (int): Candidates per slot to confirm
+
+    Returns:
+    list: (x, y, confidence, bank index) per recognised slot
+    """
+    features = bank.features()
+    height, width = gray.shape
+
+    # Crop the middle of every non-empty slot, at the size of the bank's most common icon
+    (icon_h, icon_w), _ = max(bank.groups().items(), key=lambda group: len(group[1]))
+    crop_h, crop_w = min(icon_h, grid.slot_h), min(icon_w, grid.slot_w)
+    slots = []
+    crops = []
+    for x, y in grid.slots():
+        cx = x + (grid.slot_w - crop_w) // 2
+        cy = y + (grid.slot_h - crop_h) // 2
+        crop = gray[cy:cy + crop_h, cx:cx + crop_w]
+        if crop.shape != (crop_h, crop_w) or crop.std() < EMPTY_SLOT_STD:
+            continue
+        slots.append((x, y, cx, cy))
+        crops.append(thumbnail(crop))
+    if not slots:
+        return []
+
+    # One matrix product scores every slot against every icon
+    similarity = normalize_features(np.array(crops)) @ features.T
+    ranked = np.argsort(-similarity, axis=1)[:, :candidates]
+
+    found = []
+    for (x, y, cx, cy), order, scores in zip(slots, ranked, similarity):
+        if not confirm:
+            best = int(order[0])
+            if scores[best] >= threshold:
+                found.append((cx, cy, float(scores[best]), best))
+            continue
+
+        # Search the whole slot plus a small margin, so off-centre icons are still found
+        x0, y0 = max(x - 2, 0), max(y - 2, 0)
+        window = gray[y0:min(y + grid.slot_h + 2, height), x0:min(x + grid.slot_w + 2, width)]
+        best = None
+        for i in order:
+            template = bank.template(int(i))
+            if template.shape[0] > window.shape[0] or template.shape[1] > window.shape[1]:
+                continue
+            result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(result)
+            if score >= threshold and (best is None or score > best[2]):
+                best = (x0 + dx, y0 + dy, float(score), int(i))
+        if best is not None:
+            found.append(best)
+    return found
@@ -1,12 +1,17 @@
 # This module handles the scraping of item data from rusthelp and stores it in a JSON file.
 import json
 import os
+import threading
 import time
-import requests
 
 
-def scrape_item_list():
-    url = "https://rusthelp.com/downloads/admin-item-list-public.json"
+# Where rusthelp publishes the item list
+ITEM_LIST_URL = "https://rusthelp.com/downloads/admin-item-list-public.json"
+
+
+def scrape_item_list(url=ITEM_LIST_URL):
+    # Imported here: serving the cached item list doesn't need requests
+    import requests
 
     # Send HTTP request to the webpage
     try:
@@ -18,12 +23,15 @@ def scrape_item_list():
     except requests.exceptions.RequestException as e:
         return f"Error fetching the URL: {e}"
 
-    # Parse the HTML content
-    body = response.json()
+    return items_from_list(response.json())
 
+
+def items_from_list(body):
+    """
+    Turn rusthelp's item list (a JSON list of items) into the item dictionary keyed by shortname.
+    """
     items = {}
     for item in body:
-        print(item)
         if item["shortName"] not in items:
             items[item["shortName"]] = {
                 "name": item["displayName"],
@@ -37,23 +45,167 @@ def scrape_item_list():
     return items
 
 
-def get_items():
-    # Check if items.json exists and is not empty and is not older than 1 day
-    try:
-        with open("items.json", "r") as f:
-            items = json.load(f)
-            if items and (time.time() - os.path.getmtime("items.json")) < 86400:
-                return items
-    except (FileNotFoundError, json.JSONDecodeError):
-        pass
-
-    # If items.json does not exist or is empty, scrape the data
-    items = scrape_item_list()
-    if isinstance(items, str):  # If an error message was returned
-        return items
-
-    # Save the items to items.json
-    with open("items.json", "w") as f:
-        json.dump(items, f, indent=4)
+# Where the item list is cached, and how long before it is refetched from rusthelp
+ITEMS_FILE = "items.json"
+ITEMS_MAX_AGE = 86400
 
-    return items
+
+class CatalogueSnapshot:
+    """
+    One loaded version of the item list, with the lookup views callers need.
+    Snapshots are never modified after they are built, so they can be shared freely.
+    """
+
+    def __init__(self, items, mtime, version):
+        self.items = items
+        self.mtime = mtime
+        self.version = version
+        self.by_shortname = items
+        self.by_id = {item["id"]: item for item in items.values()}
+        self.by_name = {}
+        for item in items.values():
+            # Keep the first item for duplicate display names, like the URL scheme does
+            self.by_name.setdefault(item["name"], item)
+
+
+class Catalogue:
+    """
+    Process-wide item catalogue.
+
+    items.json is parsed once and only reloaded when its mtime changes. Once the file is
+    older than `max_age`, a single background thread refetches it from rusthelp while
+    callers keep getting the stale copy.
+
+    Parameters:
+    path (str): Path of the cached item list
+    max_age (float): Seconds before the item list is refetched
+    check_interval (float): Minimum seconds between mtime checks
+    retry_interval (float): Seconds to wait before retrying a failed refetch
+    """
+
+    def __init__(self, path=ITEMS_FILE, max_age=ITEMS_MAX_AGE, check_interval=1.0, retry_interval=300.0):
+        self.path = path
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.retry_interval = retry_interval
+        self.snapshot = None
+        self.error = None
+        self.lock = threading.Lock()
+        self.refresh_thread = None
+        self.last_check = 0.0
+        self.last_attempt = 0.0
+
+    def _load_file(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, "r") as f:
+                items = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if not items:
+            return None
+        version = self.snapshot.version + 1 if self.snapshot else 1
+        return CatalogueSnapshot(items, mtime, version)
+
+    def _refetch(self):
+        """
+        Scrape the item list and save it. Returns an error message on failure.
+        """
+        self.last_attempt = time.time()
+        items = scrape_item_list()
+        if isinstance(items, str):  # If an error message was returned
+            return items
+
+        # Save the items to items.json (atomically, so readers never see a partial file)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(items, f, indent=4)
+        os.replace(tmp_path, self.path)
+        return None
+
+    def _background_refresh(self):
+        try:
+            error = self._refetch()
+            if error:
+                print(f"Item list refresh failed, serving the cached copy: {error}")
+                return
+            snapshot = self._load_file()
+            if snapshot is not None:
+                with self.lock:
+                    self.snapshot = snapshot
+        finally:
+            self.refresh_thread = None
+
+    def _start_refresh(self):
+        # Single flight: at most one refetch thread, and not too soon after a failure
+        with self.lock:
+            if self.refresh_thread is not None:
+                return
+            if time.time() - self.last_attempt < self.retry_interval:
+                return
+            self.refresh_thread = threading.Thread(target=self._background_refresh, daemon=True)
+            self.refresh_thread.start()
+
+    def current(self):
+        """
+        Return the current CatalogueSnapshot, or None if there is no item list at all
+        (in which case `error` holds the reason).
+        """
+        now = time.time()
+        snapshot = self.snapshot
+        if snapshot is None:
+            # Nothing to serve yet, so the first load has to block
+            with self.lock:
+                if self.snapshot is None:
+                    self.snapshot = self._load_file()
+                    if self.snapshot is None:
+                        self.error = self._refetch()
+                        self.snapshot = self._load_file()
+                    self.last_check = now
+                snapshot = self.snapshot
+            if snapshot is None:
+                return None
+
+        if now - self.last_check >= self.check_interval:
+            self.last_check = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except FileNotFoundError:
+                mtime = None
+            if mtime is not None and mtime != snapshot.mtime:
+                # Someone else rewrote items.json, pick it up
+                reloaded = self._load_file()
+                if reloaded is not None:
+                    with self.lock:
+                        self.snapshot = snapshot = reloaded
+            if mtime is None or now - mtime >= self.max_age:
+                self._start_refresh()
+
+        return snapshot
+
+
+_catalogue = None
+_catalogue_lock = threading.Lock()
+
+
+def get_catalogue():
+    """
+    Return the process-wide Catalogue.
+    """
+    global _catalogue
+    if _catalogue is None:
+        with _catalogue_lock:
+            if _catalogue is None:
+                _catalogue = Catalogue()
+    return _catalogue
+
+
+def get_items():
+    """
+    Return the item dictionary keyed by shortname, or an error message if it can't be loaded.
+    """
+    catalogue = get_catalogue()
+    snapshot = catalogue.current()
+    if snapshot is None:
+        return catalogue.error or "Error loading the item list"
+    return snapshot.items
@@ -0,0 +1,205 @@
+# This module runs long tasks (like regenerating the recycling data) in background threads
+# so request handlers return at once. Each job records its progress, which can be polled
+# or followed as a stream of snapshots: the worker thread wakes the waiting event loops
+# whenever the job changes, so followers don't poll. Only one job of each kind runs at a
+# time; starting it again returns the running job.
+import asyncio
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+# Finished jobs kept for status queries
+JOB_HISTORY = 20
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job's function to stop it early once cancellation was requested.
+    """
+
+
+class Job:
+    """
+    One background task and its progress.
+
+    Parameters:
+    kind (str): What the job does; one job of each kind runs at a time
+    """
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = "running"
+        self.started = time.time()
+        self.finished = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.version = 0
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.waiters = set()
+
+    @property
+    def done(self):
+        return self.state != "running"
+
+    def update(self, **progress):
+        """
+        Merge progress values (items done, failures, stage...) and wake everyone following the job.
+        Called from the job's thread.
+        """
+        with self.lock:
+            self.progress.update(progress)
+            self.version += 1
+        self._notify()
+
+    def cancel(self):
+        """
+        Ask the job to stop. The job's function checks `cancelled` and stops at its next chance.
+        """
+        if not self.done:
+            self.cancel_event.set()
+            self.update(cancelling=True)
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def _finish(self, state, result=None, error=None):
+        with self.lock:
+            self.state = state
+            self.result = result
+            self.error = error
+            self.finished = time.time()
+            self.version += 1
+        self._notify()
+
+    def _notify(self):
+        with self.lock:
+            waiters = list(self.waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The follower's event loop has closed
+                pass
+
+    def snapshot(self):
+        """
+        Return the job as a JSON-ready dict, including the item rate while it runs.
+        """
+        with self.lock:
+            progress = dict(self.progress)
+            elapsed = (self.finished or time.time()) - self.started
+            snapshot = {
+                "id": self.id,
+                "kind": self.kind,
+                "state": self.state,
+                "started": self.started,
+                "finished": self.finished,
+                "elapsed": round(elapsed, 3),
+                "progress": progress,
+                "version": self.version,
+            }
+            if "done" in progress and elapsed > 0:
+                snapshot["rate"] = round(progress.get("fetched", progress["done"]) / elapsed, 3)
+            if self.result is not None:
+                snapshot["result"] = self.result
+            if self.error is not None:
+                snapshot["error"] = self.error
+            return snapshot
+
+    async def follow(self, min_interval=0.5, heartbeat=15.0):
+        """
+        Yield a snapshot whenever the job changes (at most one per min_interval seconds),
+        ending with the snapshot of the finished job. Yields None after `heartbeat`
+        seconds without a change, so a stream can send a keep-alive.
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        with self.lock:
+            self.waiters.add(waiter)
+        try:
+            seen = None
+            while True:
+                # Clear before reading, so a change made after the read still wakes us
+                event.clear()
+                snapshot = self.snapshot()
+                if snapshot["version"] != seen:
+                    seen = snapshot["version"]
+                    yield snapshot
+                if snapshot["state"] != "running":
+                    return
+                await asyncio.sleep(min_interval)
+                try:
+                    await asyncio.wait_for(event.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self.lock:
+                self.waiters.discard(waiter)
+
+
+class JobManager:
+    """
+    Starts jobs in background threads and keeps the recent ones for status queries.
+
+    Parameters:
+    history (int): Finished jobs to keep
+    """
+
+    def __init__(self, history=JOB_HISTORY):
+        self.history = history
+        self.jobs = OrderedDict()
+        self.running = {}
+        self.lock = threading.Lock()
+
+    def start(self, kind, function):
+        """
+        Run function(job) in a new thread, unless a job of this kind is already running.
+        The function reports progress with job.update() and should raise JobCancelled (or
+        return early) once job.cancelled is set; its return value becomes the job's result.
+
+        Returns:
+        tuple: (job, whether it was started by this call)
+        """
+        with self.lock:
+            job = self.running.get(kind)
+            if job is not None:
+                return job, False
+            job = Job(kind)
+            self.running[kind] = job
+            self.jobs[job.id] = job
+            # Forget the oldest finished jobs
+            finished = [job_id for job_id, old in self.jobs.items() if old.done]
+            for job_id in finished[:max(0, len(finished) - self.history)]:
+                del self.jobs[job_id]
+
+        thread = threading.Thread(target=self._run, args=(job, function), name=f"job-{kind}", daemon=True)
+        thread.start()
+        return job, True
+
+    def _run(self, job, function):
+        try:
+            result = function(job)
+            job._finish("cancelled" if job.cancelled else "succeeded", result)
+        except JobCancelled:
+            job._finish("cancelled")
+        except Exception as e:
+            traceback.print_exc()
+            job._finish("failed", error=f"{type(e).__name__}: {e}")
+        finally:
+            with self.lock:
+                if self.running.get(job.kind) is job:
+                    del self.running[job.kind]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return [job.snapshot() for job in reversed(self.jobs.values())]
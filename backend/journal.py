@@ -0,0 +1,125 @@
+# This module keeps an append-only NDJSON journal of crawl results, so a long crawl survives
+# crashes. Every result is written and flushed as soon as it arrives (and synced to disk
+# every few records), a rerun replays the journal to skip what was already done, and the
+# final file is written by streaming the journal rather than from results held in memory.
+import json
+import os
+
+# Records written between fsyncs
+SYNC_EVERY = 50
+
+
+def _valid_length(path):
+    # Length of the journal up to the end of its last complete record; a crash can leave
+    # a torn line at the end
+    valid = 0
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    json.loads(line)
+                except ValueError:
+                    break
+                valid += len(line)
+    except FileNotFoundError:
+        pass
+    return valid
+
+
+class Journal:
+    """
+    Append-only journal of JSON records, one per line.
+
+    Parameters:
+    path (str): Journal file, created if missing and appended to otherwise
+    sync_every (int): Records written between fsyncs
+    """
+
+    def __init__(self, path, sync_every=SYNC_EVERY):
+        self.path = path
+        self.sync_every = sync_every
+        self.unsynced = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        valid = _valid_length(path)
+        self.file = open(path, "ab")
+        # Cut off a torn record, so the next one starts on a line of its own
+        self.file.truncate(valid)
+
+    def append(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Make sure every record written so far is on disk.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.checkpoint()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_journal(path):
+    """
+    Yield the records of a journal in the order they were written, stopping at a torn
+    record. A missing journal has no records.
+    """
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+    except FileNotFoundError:
+        return
+
+
+def index_journal(path, key):
+    """
+    Map record[key] to the file offset of the last record with that key, so records can
+    be read back one at a time with read_record instead of all being held in memory.
+    """
+    index = {}
+    offset = 0
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if key in record:
+                    index[record[key]] = offset
+                offset += len(line)
+    except FileNotFoundError:
+        pass
+    return index
+
+
+def read_record(f, offset):
+    """
+    Read the record at an offset from index_journal, from a journal opened in binary mode.
+    """
+    f.seek(offset)
+    return json.loads(f.readline())
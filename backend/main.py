@@ -1,21 +1,158 @@
 # This is the main entry point for the backend application.
 # It imports the necessary modules and starts the FastAPI application.
+# Only what every request needs is imported up front: screenshot detection (OpenCV,
+# numba) is loaded in the background once the server is up, and the scraper and crawler
+# (requests, BeautifulSoup) when something has to be fetched.
 
 # Import necessary modules
+import argparse
+import asyncio
+import gc
+import importlib
+import signal
+import socket
 import sys
 import time
-from fastapi import FastAPI
-from search import search_items
-from items import get_items
-from recycler import scrape_recycler_data_all as get_recycler_data
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import Body, FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from search import get_search_index, search_items
+from items import get_catalogue, get_items
+from recycler_service import DATA_DIR, SOURCES_FILE, RecyclerService
+from reverse_index import get_reverse_index, save_for_dataset
+from yield_graph import get_yield_graph
+from jobs import JobManager
+from journal import Journal, read_journal
+from manifest import load_json, load_manifest, save_manifest
+from metrics import HTTP_REQUEST_SECONDS, REGISTRY, cache_collector
+from profiler import SamplingProfiler
 from fastapi import APIRouter
 import json
 import os
-from pathlib import Path
 
-def create_app():
+try:
+    import fcntl
+except ImportError:
+    # Windows: serve() runs a single worker there
+    fcntl = None
+
+# Held in the data directory while a generation runs, by whichever process runs it
+GENERATION_LOCK_FILE = "generate.lock"
+# Answer of the job endpoints when the server runs several workers
+NO_JOBS = "Background jobs need a single worker (--workers 1). Run `python main.py generate-recycling-data` instead."
+
+class GenerationRunning(RuntimeError):
+    pass
+
+def prebuild(recycler_service):
+    """
+    Build what most requests read: the item catalogue and its search index, and the
+    recycling dataset with its yield graph and sources index. Each is cached for the
+    process and only rebuilt when its file changes, so calling this again is cheap.
+    """
+    start_time = time.perf_counter()
+    index = get_search_index()
+    graph = get_yield_graph(recycler_service.dataset)
+    get_reverse_index(recycler_service.dataset, SOURCES_FILE, get_yield_graph)
+    items = len(index.items) if index is not None else 0
+    print(f"Loaded {items} items and recycling data for {len(graph.direct)} items in {time.perf_counter() - start_time:.2f} seconds")
+
+def create_app(recycler_service=None, detect_service=None, profiling=False, warm_detection=True, jobs=True):
+    """
+    Build the FastAPI app. The services default to the ones backed by the generated dataset
+    and the downloaded icons; benchmarks pass their own.
+    profiling=True adds the /debug/profile endpoints, which sample the server's stacks.
+    Detection is loaded in the background once the server is up, or with
+    warm_detection=False on the first /detect.
+    jobs=False makes the /jobs endpoints answer 503, for servers with several workers:
+    job state lives in the worker that started the job, which other workers can't see.
+    """
+    # Answers from the generated dataset, then the cache, then a live fetch off the event loop
+    if recycler_service is None:
+        recycler_service = RecyclerService()
+
+    # Screenshot detection, created by load_detection unless one was passed in
+    detection = None
+
+    async def load_detection():
+        nonlocal detect_service
+        if detect_service is None:
+            # OpenCV and numba take a while to import, so it happens in a thread while
+            # requests are being answered
+            loop = asyncio.get_running_loop()
+            module = await loop.run_in_executor(None, importlib.import_module, "detect_service")
+            # Created on the event loop's thread, which under uvicorn is the main thread
+            # DetectService has to start numba from
+            detect_service = module.DetectService()
+        await detect_service.preload()
+        return detect_service
+
+    def start_detection():
+        # Single flight: every caller waits on the same load
+        nonlocal detection
+        if detection is None:
+            detection = asyncio.ensure_future(load_detection())
+            detection.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return detection
+
+    def detection_lookups(**results):
+        # {result label: key of DetectionCache.stats}; nothing is counted before detection loads
+        def lookups():
+            stats = detect_service.cache.stats if detect_service is not None else {}
+            return {result: stats.get(key, 0) for result, key in results.items()}
+        return lookups
+
+    # Cache hit ratios are read from the caches' own counters when /metrics is scraped
+    recycler_cache = recycler_service.cache
+    collectors = [
+        cache_collector("recycler", lambda: {
+            "hit": recycler_cache.hits, "hit_stale": recycler_cache.stale_hits, "miss": recycler_cache.misses,
+        }),
+        cache_collector("detection", detection_lookups(hit="hits", hit_disk="disk_hits", miss="misses")),
+        cache_collector("detection_tiles", detection_lookups(hit="tile_hits", miss="tile_misses")),
+    ]
+
+    @asynccontextmanager
+    async def lifespan(app):
+        removers = [REGISTRY.add_collector(collect) for collect in collectors]
+        # Built before the server takes traffic; pre-forked workers find it built already
+        prebuild(recycler_service)
+        if warm_detection:
+            start_detection()
+        yield
+        for remove in removers:
+            remove()
+        if profiler is not None:
+            profiler.stop()
+        if detection is not None and not detection.done():
+            detection.cancel()
+        if detect_service is not None:
+            detect_service.executor.shutdown(wait=False, cancel_futures=True)
+
     # Create a FastAPI instance
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
+    # serve() runs this before forking workers
+    app.state.prebuild = lambda: prebuild(recycler_service)
+    profiler = SamplingProfiler() if profiling else None
+
+    @app.middleware("http")
+    async def observe_request(request: Request, call_next):
+        # Latency up to the response headers (a stream's body isn't included), labelled
+        # with the route template so /jobs/{job_id} is one series rather than one per job
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=request.method, route=route.path if route is not None else "unmatched", status=status,
+            )
+            if profiler is not None and request.url.path != "/debug/profile":
+                profiler.request_done()
 
     # Create a router for the API
     router = APIRouter()
@@ -30,13 +167,17 @@ def create_app():
         return get_items()
 
     @router.get("/search")
-    async def search_endpoint(name: str):
+    async def search_endpoint(name: str, limit: int = None, offset: int = 0, descriptions: bool = False):
         """
         Search for items based on the name string.
-        This endpoint returns a list of items that match the query.
-        Example: /search?name=wood
+        This endpoint returns a list of items that match the query, best match first.
+        Typos are tolerated, and descriptions=true also searches item descriptions.
+        Example: /search?name=wood&limit=10&offset=0
         """
-        return search_items(name)
+        return search_items(name, limit=limit, offset=max(0, offset), descriptions=descriptions)
+
+    # Largest batch accepted by /recycler/batch
+    max_batch_size = 1000
 
     @router.get("/recycler")
     async def recycler_endpoint(url: str = None, name: str = None):
@@ -52,7 +193,203 @@ def create_app():
             url = f"https://rusthelp.com/items/{name.lower().replace(' ', '-')}#recycling"
         if not url.startswith("https://rusthelp.com/items/"):
             return {"error": "Invalid URL. Must start with 'https://rusthelp.com/items/'."}
-        return get_recycler_data(url)
+        return await recycler_service.get(url)
+
+    @router.post("/recycler/batch")
+    async def recycler_batch_endpoint(items: list[str] = Body(..., embed=True), stream: bool = False):
+        """
+        Get recycling data for many items in one call.
+        The body lists item names, shortnames or URLs: {"items": ["Tactical Gloves", "rifle.ak"]}.
+        Returns one result per item, in request order, with either "data" or "error".
+        With ?stream=true the results are streamed as NDJSON lines in completion order,
+        each carrying its "index" in the request.
+        """
+        if len(items) > max_batch_size:
+            return {"error": f"Too many items. At most {max_batch_size} per batch."}
+        catalogue = get_catalogue().current()
+        results = recycler_service.get_many(items, catalogue)
+
+        if stream:
+            async def ndjson():
+                async for index, result in results:
+                    yield json.dumps({"index": index, **result}) + "\n"
+            return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+        ordered = [None] * len(items)
+        async for index, result in results:
+            ordered[index] = result
+        return {"results": ordered}
+
+    def catalogue_item(name):
+        catalogue = get_catalogue().current()
+        if catalogue is None:
+            return None
+        return catalogue.by_shortname.get(name) or catalogue.by_name.get(name)
+
+    def resolve_item_name(graph, name):
+        # Accept display names in any case, or shortnames from the catalogue
+        resolved = graph.resolve(name)
+        if resolved is None:
+            item = catalogue_item(name)
+            if item is not None:
+                resolved = graph.resolve(item["name"])
+        return resolved
+
+    @router.get("/yield")
+    async def yield_endpoint(name: str, quantity: float = 1, recursive: bool = True):
+        """
+        Get the expected output of recycling an item.
+        With recursive=true (the default) every recyclable output is recycled again,
+        so the result only contains raw resources.
+        Example: /yield?name=Assault Rifle&quantity=3
+        """
+        graph = get_yield_graph(recycler_service.dataset)
+        resolved = resolve_item_name(graph, name)
+        outputs = graph.recycle(resolved, quantity, recursive) if resolved else None
+        if outputs is None:
+            return {"error": f"No recycling data for '{name}'."}
+        return {"item": resolved, "quantity": quantity, "recursive": recursive, "outputs": outputs}
+
+    def evaluate_inventories(graph, inventories, recursive):
+        # Items that can't be recycled are passed through unchanged; unknown items are listed
+        resolved_inventories = []
+        passthroughs = []
+        unknown_names = []
+        for inventory in inventories:
+            resolved = {}
+            passthrough = {}
+            unknown = []
+            for name, count in inventory.items():
+                item_name = resolve_item_name(graph, name)
+                if item_name is not None:
+                    resolved[item_name] = resolved.get(item_name, 0) + count
+                elif catalogue_item(name) is not None:
+                    # A real item the recycle graph has never seen, so it can't be recycled
+                    item_name = catalogue_item(name)["name"]
+                    passthrough[item_name] = passthrough.get(item_name, 0) + count
+                else:
+                    unknown.append(name)
+            resolved_inventories.append(resolved)
+            passthroughs.append(passthrough)
+            unknown_names.append(unknown)
+
+        results = []
+        evaluated = graph.evaluate_inventories(resolved_inventories, recursive)
+        for (outputs, _), passthrough, unknown in zip(evaluated, passthroughs, unknown_names):
+            for item_name, count in passthrough.items():
+                outputs[item_name] = outputs.get(item_name, 0) + count
+            results.append({"outputs": outputs, "unknown": unknown})
+        return results
+
+    @router.post("/yield/batch")
+    async def yield_batch_endpoint(inventories: list[dict[str, float]] = Body(..., embed=True), recursive: bool = True):
+        """
+        Get the expected output of recycling whole inventories.
+        The body holds one {item: count} mapping per inventory:
+        {"inventories": [{"Assault Rifle": 2, "rope": 10}]}
+        Items that can't be recycled are passed through unchanged; unknown items are listed.
+        """
+        graph = get_yield_graph(recycler_service.dataset)
+        return {"recursive": recursive, "results": evaluate_inventories(graph, inventories, recursive)}
+
+    @router.post("/detect")
+    async def detect_endpoint(request: Request, threshold: float = 0.7, mode: str = "grid", scale: str = "auto", recursive: bool = True, prefilter: bool = False):
+        """
+        Find the items in an inventory screenshot and what recycling them yields.
+        Send the image (PNG, JPEG...) as the request body, or as the "file" field of a form.
+        mode is "grid" (classify inventory slots, the default) or "sliding" (match everywhere);
+        scale is "auto" or the size of on-screen icons relative to the downloaded ones.
+        prefilter=true narrows sliding matching (and grid mode without a grid) to the icons
+        whose perceptual hashes are nearest to each region. It is faster but can miss icons,
+        and is off until it has been measured on real screenshots.
+        Each detected icon counts as one item, stack sizes aren't read.
+        Example: curl --data-binary @screenshot.png localhost:8000/detect
+        """
+        if mode not in ("grid", "sliding"):
+            return JSONResponse({"error": "mode must be 'grid' or 'sliding'."}, status_code=400)
+        if scale != "auto":
+            try:
+                scale = float(scale)
+            except ValueError:
+                scale = 0
+            if scale <= 0:
+                return JSONResponse({"error": "scale must be 'auto' or a positive number."}, status_code=400)
+
+        try:
+            service = await asyncio.shield(start_detection())
+        except ImportError as e:
+            return JSONResponse({"error": f"Detection is unavailable: {e}"}, status_code=503)
+        from detect_service import DetectError
+
+        try:
+            service.admit()
+        except DetectError as e:
+            return JSONResponse({"error": str(e)}, status_code=e.status, headers=e.headers)
+        try:
+            data = await service.read_upload(request)
+            found = await service.detect(data, threshold=threshold, mode=mode, scale=scale, prefilter=prefilter)
+        except DetectError as e:
+            return JSONResponse({"error": str(e)}, status_code=e.status, headers=e.headers)
+        finally:
+            service.release()
+
+        # Icons are saved under their shortnames; report display names where the catalogue has them
+        items = []
+        counts = {}
+        for shortname, matches in found.items():
+            item = catalogue_item(shortname)
+            name = item["name"] if item is not None else shortname
+            count = len(matches["positions"])
+            items.append({
+                "shortname": shortname,
+                "name": name,
+                "count": count,
+                "positions": matches["positions"],
+                "confidence": matches["confidence"],
+                "dimensions": matches["dimensions"],
+            })
+            counts[name] = counts.get(name, 0) + count
+        items.sort(key=lambda item: (-item["count"], item["name"]))
+
+        graph = get_yield_graph(recycler_service.dataset)
+        recycled = evaluate_inventories(graph, [counts], recursive)[0]
+        return {"items": items, "counts": counts, "recursive": recursive, "yield": recycled}
+
+    @router.get("/sources")
+    async def sources_endpoint(output: str, limit: int = 10, offset: int = 0, recursive: bool = False):
+        """
+        Get the items that recycle into an output, best expected yield per item first.
+        With recursive=true, yields count what is left after recycling outputs again.
+        Example: /sources?output=High Quality Metal&limit=5
+        """
+        index = get_reverse_index(recycler_service.dataset, SOURCES_FILE, get_yield_graph)
+        found = index.sources(output, limit=max(0, limit), offset=max(0, offset), recursive=recursive)
+        if found is None:
+            return {"error": f"Nothing recycles into '{output}'."}
+        name, sources = found
+        return {"output": name, "recursive": recursive, "sources": sources}
+
+    # Long tasks run in background threads; only one generation runs at a time, since runs
+    # share the journal and output files (generation_lock also keeps other processes out)
+    job_manager = JobManager() if jobs else None
+    app.state.jobs = jobs
+
+    def start_generation(full):
+        if job_manager is None:
+            return JSONResponse({"error": NO_JOBS}, status_code=503)
+
+        def run(job):
+            return generate_recycling_data(full=full, progress=job.update, cancel=job.cancel_event)
+        job, created = job_manager.start("generate-recycling-data", run)
+        return JSONResponse({"created": created, "job": job.snapshot()}, status_code=202 if created else 200)
+
+    @router.post("/jobs/generate-recycling-data")
+    async def start_generation_endpoint(full: bool = False):
+        """
+        Start regenerating the recycling data in the background, or return the job that is
+        already doing so. Follow it with /jobs/{id} or /jobs/{id}/events.
+        """
+        return start_generation(full)
 
     @router.get("/generate-recycling-data")
     async def generate_recycling_data_endpoint():
@@ -60,114 +397,321 @@ def create_app():
         Generate recycling data for all items and save to a JSON file.
         This endpoint fetches all items, gets recycling data for each one,
         and saves the compiled data to a single JSON file.
+        The crawl runs as a background job, which this returns without waiting for it
+        (the same as POST /jobs/generate-recycling-data).
         """
-        items = get_items()
-        recycling_data = {}
-        start_time = time.time()
-        failed = 0
-        print(f"Start time: {start_time}")
-        
-        # Create data directory if it doesn't exist
-        data_dir = Path("c:/Users/john/Documents/Coding/rust-recycling/data")
-        data_dir.mkdir(exist_ok=True)
-        
-        # Output file path
-        output_file = data_dir / "all_recycling_data.json"
-        
-        # Process each item to get recycling data
-        for item in items.values():
-            if failed > 200:
-                print("Too many failures, stopping the process.")
-                break
-            item_name = item.get("name", "")
-            if item_name:
-                try:
-                    # Construct URL and get recycling data
-                    url = f"https://rusthelp.com/items/{item_name.lower().replace(' ', '-')}#recycling"
-                    item_data = get_recycler_data(url)
-                    if item_data is None:
-                        failed += 1
-                        continue
-                    recycling_data[item_name] = item_data
-                    print(f"Processed: {item_name}")
-                except Exception as e:
-                    failed += 1
-                    print(f"Error processing {item_name}: {str(e)}")
-        
-        # Save data to JSON file
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(recycling_data, indent=2, fp=f)
+        return start_generation(False)
 
-        end_time = time.time()
-        print(f"End time: {end_time}")
-        
-        return {
-            "status": "success", 
-            "message": f"Recycling data generated for {len(recycling_data)} items in {end_time - start_time:.2f} seconds.",
-            "file_path": str(output_file)
-        }
+    @router.get("/jobs")
+    async def jobs_endpoint():
+        """
+        List the running and recent jobs, newest first.
+        """
+        if job_manager is None:
+            return JSONResponse({"error": NO_JOBS}, status_code=503)
+        return {"jobs": job_manager.list()}
+
+    @router.get("/jobs/{job_id}")
+    async def job_endpoint(job_id: str):
+        """
+        Get a job's state and progress: items done out of the total, failures and items per second.
+        """
+        if job_manager is None:
+            return JSONResponse({"error": NO_JOBS}, status_code=503)
+        job = job_manager.get(job_id)
+        if job is None:
+            return JSONResponse({"error": f"No job '{job_id}'."}, status_code=404)
+        return job.snapshot()
+
+    @router.get("/jobs/{job_id}/events")
+    async def job_events_endpoint(job_id: str):
+        """
+        Follow a job as Server-Sent Events: a "progress" event whenever it changes and a
+        final "done" event when it ends.
+        Example: curl -N localhost:8000/jobs/<id>/events
+        """
+        if job_manager is None:
+            return JSONResponse({"error": NO_JOBS}, status_code=503)
+        job = job_manager.get(job_id)
+        if job is None:
+            return JSONResponse({"error": f"No job '{job_id}'."}, status_code=404)
+
+        async def events():
+            async for snapshot in job.follow():
+                if snapshot is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                event = "progress" if snapshot["state"] == "running" else "done"
+                yield f"event: {event}\ndata: {json.dumps(snapshot)}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    @router.post("/jobs/{job_id}/cancel")
+    async def cancel_job_endpoint(job_id: str):
+        """
+        Ask a job to stop. A cancelled generation keeps the items it already fetched.
+        """
+        if job_manager is None:
+            return JSONResponse({"error": NO_JOBS}, status_code=503)
+        job = job_manager.get(job_id)
+        if job is None:
+            return JSONResponse({"error": f"No job '{job_id}'."}, status_code=404)
+        job.cancel()
+        return job.snapshot()
+
+    @router.get("/health")
+    async def health_endpoint():
+        """
+        Check that the server is up, and whether detection is ready: "detection" is
+        "loading" while it loads in the background, "ready", "unavailable" (the reason is
+        in "error"), or "not loaded" before the first /detect when it isn't warmed at startup.
+        """
+        if detection is None:
+            return {"status": "ok", "detection": "not loaded"}
+        if not detection.done():
+            return {"status": "ok", "detection": "loading"}
+        if detection.cancelled() or detection.exception() is not None:
+            error = "cancelled" if detection.cancelled() else str(detection.exception())
+            return {"status": "ok", "detection": "unavailable", "error": error}
+        if detection.result().bank is None:
+            return {"status": "ok", "detection": "unavailable", "error": detection.result().error}
+        return {"status": "ok", "detection": "ready"}
+
+    @router.get("/metrics")
+    async def metrics_endpoint():
+        """
+        Get the server's metrics in the Prometheus text format: request latency per route,
+        upstream fetches, page parsing, detection stages and cache hit ratios.
+        Every worker process keeps its own metrics, so with --workers N a scrape only
+        covers the worker that answered it.
+        """
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    if profiler is not None:
+        @router.post("/debug/profile")
+        async def start_profile_endpoint(requests: int = 100, seconds: float = 60):
+            """
+            Start sampling the server's stacks until `requests` more requests have finished
+            or `seconds` have passed, whichever comes first. Fetch the result with GET.
+            Only the worker that answers is sampled, and with --workers N the GET may reach
+            another worker, so profile a single-worker server.
+            """
+            if not profiler.start(requests=max(1, requests), seconds=max(0.1, seconds)):
+                return JSONResponse({"error": "A profile is already running.", **profiler.status()}, status_code=409)
+            return profiler.status()
+
+        @router.get("/debug/profile")
+        async def profile_endpoint(format: str = "folded"):
+            """
+            Get the last profile as folded stacks for flamegraph.pl or speedscope, or its
+            progress with format=status.
+            Example: curl localhost:8000/debug/profile > profile.folded
+            """
+            if format == "status":
+                return profiler.status()
+            return PlainTextResponse(profiler.folded())
 
     # Include the router in the FastAPI app
     app.include_router(router)
 
     return app
 
-def generate_recycling_data():
+def generate_recycling_data(full=False, data_dir=None, max_failures=400, progress=None, cancel=None, **crawler_options):
     """
     Generate recycling data for all items and save to a JSON file.
     This endpoint fetches all items, gets recycling data for each one,
     and saves the compiled data to a single JSON file.
+    Refreshes are incremental: pages that are unchanged since the last run (according to
+    the manifest next to the data file) are skipped, and files are only rewritten when
+    something changed. Pass full=True to ignore the manifest and re-parse every page.
+    Results are journaled as they arrive and compacted into the JSON file at the end, so a
+    crashed or interrupted run resumes where it stopped the next time this is called.
+    progress(**values) is called with the crawl's progress and the current stage, and setting
+    the cancel event stops the crawl early (see refresh_recycling_data). A run that is
+    cancelled or stops after max_failures leaves the dataset, manifest and indexes as they
+    were and keeps its journal, so the next run resumes it; it returns the crawl's counts
+    with "finished" False.
+    Other keyword arguments (concurrency, rate, retries, base_url...) are passed to the crawler.
+    Only one run per data directory at a time, across processes: raises GenerationRunning
+    if another one holds the lock (see generation_lock).
     """
+    # The crawler needs requests and BeautifulSoup, which serving the API mostly doesn't
+    from compiled_dataset import compile_for_dataset
+    from crawler import compact_recycling_data, refresh_recycling_data
+
     items = get_items()
-    recycling_data = {}
     start_time = time.time()
-    failed = 0
     print(f"Start time: {start_time}")
     
     # Create data directory if it doesn't exist
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(script_dir, "..", "data")
+    if data_dir is None:
+        data_dir = DATA_DIR
     os.makedirs(data_dir, exist_ok=True)
     
-    # Output file path
-    output_file = os.path.join(data_dir, "all_recycling_data.json")
+    # Another worker or a command line run may be generating into the same files
+    with generation_lock(data_dir):
+        # Output file paths
+        output_file = os.path.join(data_dir, "all_recycling_data.json")
+        journal_file = os.path.join(data_dir, "all_recycling_data.journal")
+        manifest_file = os.path.join(data_dir, "recycling_manifest.json")
+        sources_file = os.path.join(data_dir, os.path.basename(SOURCES_FILE))
+        compiled_file = os.path.join(data_dir, "all_recycling_data.bin")
+
+        # Only the previous run's item names are needed while crawling
+        existing = set() if full else set(load_json(output_file))
+        manifest = {} if full else load_manifest(manifest_file)
+        manifest_before = json.dumps(manifest, sort_keys=True)
+
+        # Replay the journal of an interrupted run, so its items aren't fetched again
+        done = set()
+        for record in read_journal(journal_file):
+            manifest[record["url"]] = record["entry"]
+            done.add(record["item"])
+        if done:
+            print(f"Resuming an interrupted run, {len(done)} items already fetched")
     
-    # Process each item to get recycling data
-    for item in items.values():
-        if failed > 400:
-            print("Too many failures, stopping the process.")
-            break
-        item_name = item.get("name", "")
-        if item_name:
-            try:
-                # Construct URL and get recycling data
-                url = f"https://rusthelp.com/items/{item_name.lower().replace(' ', '-')}#recycling"
-                item_data = get_recycler_data(url)
-                if item_data is None:
-                    failed += 1
-                    continue
-                recycling_data[item_name] = item_data
-                print(f"Processed: {item_name}")
-            except Exception as e:
-                failed += 1
-                print(f"Error processing {item_name}: {str(e)}")
+        # Fetch every item page concurrently with per-host rate limiting, journaling each result
+        report = progress or (lambda **values: None)
+        report(stage="crawling")
+        with Journal(journal_file) as journal:
+            crawl_stats = asyncio.run(refresh_recycling_data(
+                items, existing, manifest, journal, done, max_failures=max_failures,
+                progress=progress, cancel=cancel, **crawler_options
+            ))
+        if not crawl_stats["finished"]:
+            # Nothing is committed from a stopped run: a full run would drop every item it
+            # didn't get to. The journal keeps what was fetched for the next run to resume
+            reason = "Cancelled" if crawl_stats["cancelled"] else "Stopped after too many failures"
+            print(f"{reason}, the dataset is unchanged; the next run resumes from {journal_file}")
+            return dict(crawl_stats, written=False)
     
-    # Save data to JSON file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(recycling_data, indent=2, fp=f)
+        # Compact the journal into the JSON file, which is only rewritten if something changed
+        report(stage="compacting")
+        stats = compact_recycling_data(items, journal_file, output_file, full=full, base_url=crawler_options.get("base_url"))
+        stats["failed"] = crawl_stats["failed"]
+        stats["cancelled"] = crawl_stats["cancelled"]
+        stats["finished"] = True
+        if stats["written"]:
+            print(f"Wrote {output_file}")
+        if json.dumps(manifest, sort_keys=True) != manifest_before:
+            save_manifest(manifest, manifest_file)
+        # Everything in the journal is in the dataset now
+        os.remove(journal_file)
+
+        # Keep the "which items recycle into X" index and the compiled binary copy in step
+        # with the dataset; the JSON stays the human readable export
+        report(stage="indexing")
+        if os.path.exists(output_file):
+            save_for_dataset(output_file, sources_file)
+            compile_for_dataset(output_file, compiled_file, items)
 
-    end_time = time.time()
-    print(f"End time: {end_time}")
+        end_time = time.time()
+        print(f"End time: {end_time}")
     
-    print(f"Recycling data generated for {len(recycling_data)} items in {end_time - start_time:.2f} seconds.")
+        print(
+            f"Recycling data generated for {stats['items']} items in {end_time - start_time:.2f} seconds "
+            f"({stats['changed']} changed, {stats['unchanged']} unchanged, {stats['removed']} removed, {stats['failed']} failed)."
+        )
+        return stats
+
+@contextmanager
+def generation_lock(data_dir):
+    """
+    Hold an exclusive lock on data_dir's generation files for the duration of a run, across
+    processes (every API worker has its own JobManager, and the command line has none).
+    Raises GenerationRunning if another process holds it.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(data_dir, GENERATION_LOCK_FILE), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise GenerationRunning(f"Another process is already generating the recycling data in {data_dir}") from None
+        # Closing the file releases the lock, also if this process dies
+        yield
+
+def serve(app, host="0.0.0.0", port=8000, workers=1):
+    """
+    Run the app with uvicorn. With several workers, this process builds the shared state
+    (see prebuild) and then forks the workers, which share those pages copy-on-write
+    instead of each building and holding its own copy. uvicorn's own --workers can't do
+    that: it starts every worker as a fresh interpreter.
+    Each worker keeps its own metrics, profiler and job state, so several workers need an
+    app created with jobs=False.
+    """
+    import uvicorn
+
+    if workers > 1 and not hasattr(os, "fork"):
+        print("Warning: this platform can't fork, running a single worker")
+        workers = 1
+    if workers > 1 and app.state.jobs:
+        raise ValueError("Job state isn't shared between workers, create the app with jobs=False to run several")
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port, log_level="info")
+        return
+
+    app.state.prebuild()
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    # Objects the garbage collector never visits again don't get their pages copied into
+    # every worker when it does
+    gc.freeze()
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            uvicorn.Server(uvicorn.Config(app, log_level="info")).run(sockets=[sock])
+            os._exit(0)
+        children.append(pid)
+    print(f"Started {workers} workers on {host}:{port}: {', '.join(map(str, children))}")
+
+    def stop(signum, frame):
+        # Ctrl-C already reaches every worker through the process group
+        if signum == signal.SIGTERM:
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
 
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "generate-recycling-data":
         # If the script is run with the argument "generate-recycling-data", call the function directly
-        generate_recycling_data()
+        parser = argparse.ArgumentParser(prog="main.py generate-recycling-data")
+        parser.add_argument("--concurrency", type=int, default=16, help="Maximum requests in flight")
+        parser.add_argument("--rate", type=float, default=8.0, help="Requests per second per host (0 = unlimited)")
+        parser.add_argument("--retries", type=int, default=3, help="Retries per item page")
+        parser.add_argument("--base-url", default=None, help="Crawl a different host, e.g. the local stand-in server")
+        parser.add_argument("--full", action="store_true", help="Ignore the manifest and re-parse every page")
+        args = parser.parse_args(sys.argv[2:])
+        try:
+            generate_recycling_data(
+                full=args.full, concurrency=args.concurrency, rate=args.rate, retries=args.retries, base_url=args.base_url
+            )
+        except GenerationRunning as e:
+            print(f"Error: {e}")
+            os._exit(1)
         os._exit(0)
     # If the script is run without arguments, start the FastAPI app
     # Run the FastAPI app using uvicorn
-    import uvicorn
-    app = create_app()
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
+    parser = argparse.ArgumentParser(prog="main.py")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, forked after the shared data is loaded")
+    parser.add_argument("--lazy-detection", action="store_true", help="Load detection on the first /detect instead of at startup")
+    parser.add_argument("--profiling", action="store_true", help="Enable the /debug/profile sampling profiler")
+    args = parser.parse_args()
+    if args.workers > 1:
+        print("Running several workers: the /jobs endpoints are disabled, generate the data with `python main.py generate-recycling-data`")
+    app = create_app(profiling=args.profiling, warm_detection=not args.lazy_detection, jobs=args.workers <= 1)
+    serve(app, host=args.host, port=args.port, workers=args.workers)
\ No newline at end of file
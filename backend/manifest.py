@@ -0,0 +1,122 @@
+# This module keeps a per-URL manifest of what was fetched on the last crawl.
+# Each entry stores the HTTP validators (ETag / Last-Modified) and a hash of the
+# content we care about, so the next refresh can skip pages that have not changed.
+import filecmp
+import hashlib
+import json
+import os
+import tempfile
+
+
+def load_json(path):
+    """
+    Load a JSON object from disk. A missing or corrupt file gives an empty dict.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            if isinstance(data, dict):
+                return data
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return {}
+
+
+def load_manifest(path):
+    """
+    Load a manifest from disk. A missing or corrupt file gives an empty manifest.
+    """
+    return load_json(path)
+
+
+def save_manifest(manifest, path):
+    """
+    Write the manifest atomically so an interrupted run never leaves a half written file.
+    """
+    atomic_write_json(manifest, path, indent=1, sort_keys=True)
+
+
+def atomic_write_json(data, path, **dump_options):
+    """
+    Dump JSON to a temporary file next to `path` and rename it over the target.
+    """
+    _atomic_write(path, ".json", lambda f: json.dump(data, f, **dump_options), "w")
+
+
+def atomic_write_json_items(pairs, path, indent=2, only_if_changed=False):
+    """
+    Write (key, value) pairs as one JSON object, formatted like json.dump(dict(pairs),
+    indent=indent), without holding the whole object in memory. With only_if_changed,
+    an identical file is left alone. Returns whether the file was replaced.
+    """
+    def write(f):
+        pad = " " * indent
+        empty = True
+        f.write("{")
+        for key, value in pairs:
+            f.write("\n" if empty else ",\n")
+            f.write(pad + json.dumps(key) + ": " + json.dumps(value, indent=indent).replace("\n", "\n" + pad))
+            empty = False
+        f.write("}" if empty else "\n}")
+
+    return _atomic_write(path, ".json", write, "w", only_if_changed)
+
+
+def atomic_write_bytes(content, path):
+    """
+    Write bytes to a temporary file next to `path` and rename it over the target.
+    """
+    _atomic_write(path, os.path.splitext(path)[1], lambda f: f.write(content), "wb")
+
+
+def _atomic_write(path, suffix, write, mode, only_if_changed=False):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=suffix)
+    try:
+        with os.fdopen(fd, mode, encoding="utf-8" if "b" not in mode else None) as f:
+            write(f)
+        if only_if_changed and os.path.exists(path) and filecmp.cmp(tmp_path, path, shallow=False):
+            os.unlink(tmp_path)
+            return False
+        # mkstemp creates the file private; published data should be world readable
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        return True
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def content_hash(content):
+    """
+    Stable hash of a piece of page content (str or bytes). None hashes to None.
+    """
+    if content is None:
+        return None
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def conditional_headers(entry):
+    """
+    Build the If-None-Match / If-Modified-Since headers for a manifest entry.
+    """
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def validators(response):
+    """
+    Pull the cache validators out of a response.
+    """
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
@@ -0,0 +1,239 @@
+# This module collects the backend's metrics and renders them in the Prometheus text format
+# for the /metrics endpoint. Counters and histograms are updated where the work happens
+# (route latency, upstream fetches, page parsing, detection stages). Numbers that are
+# already kept elsewhere, like the hit counts of the caches, are read by collector
+# functions at scrape time instead of being counted twice.
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Prepended to every metric name
+PREFIX = "rust_recycling_"
+# Histogram buckets in seconds, from sub-millisecond lookups to minute-long fetches
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') + '"'
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Registry:
+    """
+    The metrics and collectors rendered on /metrics.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collect):
+        """
+        Add a function called at scrape time. It returns (name, type, help, samples) tuples,
+        where samples is a list of (labels dict, value); the name gets the PREFIX.
+        Returns a function that removes the collector again.
+        """
+        with self.lock:
+            self.collectors.append(collect)
+
+        def remove():
+            with self.lock:
+                if collect in self.collectors:
+                    self.collectors.remove(collect)
+
+        return remove
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        # Collectors may report the same metric (e.g. one cache each): group them by name
+        collected = {}
+        for collect in collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Warning: metrics collector failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                collected.setdefault(PREFIX + name, (kind, help, []))[2].extend(samples)
+        for name, (kind, help, samples) in collected.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _labels(self, key, **extra):
+        return {**dict(zip(self.labels, key)), **extra}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            values = {key: self._snapshot(value) for key, value in self.values.items()}
+        for key, value in sorted(values.items()):
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    """
+    A count that only goes up, per combination of label values.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _snapshot(self, value):
+        return value
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values (usually seconds) in cumulative buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for k, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[k] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe how long the with block takes, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _snapshot(self, value):
+        return list(value)
+
+    def _render_value(self, key, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(self._labels(key, le=_format_value(float(bound))))} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self._labels(key))} {_format_value(counts[-1])}")
+        lines.append(f"{self.name}_count{_format_labels(self._labels(key))} {cumulative}")
+        return lines
+
+
+def cache_collector(name, lookups):
+    """
+    Build a collector reporting a cache's lookups by result, and its hit ratio.
+
+    Parameters:
+    name (str): Value of the "cache" label
+    lookups (callable): Returns {result: count}, e.g. {"hit": 10, "miss": 2}; results
+        starting with "hit" count as hits
+    """
+
+    def collect():
+        counts = lookups()
+        total = sum(counts.values())
+        hits = sum(count for result, count in counts.items() if result.startswith("hit"))
+        return [
+            ("cache_lookups_total", "counter", "Cache lookups by result",
+             [({"cache": name, "result": result}, count) for result, count in counts.items()]),
+            ("cache_hit_ratio", "gauge", "Fraction of cache lookups that were hits",
+             [({"cache": name}, hits / total if total else 0.0)]),
+        ]
+
+    return collect
+
+
+# Metrics shared by the modules that update them
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to answer an API request, by route template", ("method", "route", "status"),
+)
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "upstream_request_duration_seconds", "Time to fetch a page from rusthelp", ("source",),
+)
+UPSTREAM_RESPONSES = Counter(
+    "upstream_responses_total", "Responses from rusthelp by status code (\"error\" when no response arrived)", ("source", "status"),
+)
+PARSE_SECONDS = Histogram(
+    "parse_duration_seconds", "Time to parse the recycling table out of an item page", ("parser",),
+)
+DETECTION_STAGE_SECONDS = Histogram(
+    "detection_stage_duration_seconds", "Time spent in each stage of screenshot detection", ("stage",),
+)
@@ -0,0 +1,114 @@
+# This module reads and writes "packed" files: several NumPy arrays plus JSON metadata in
+# a single file that can be memory-mapped, so every process shares one copy in the OS cache.
+#
+# File layout: a 4 byte magic, format version (u32), header length (u64), JSON header, then
+# each array at a 64 byte aligned offset listed in the header under "arrays".
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+ALIGNMENT = 64
+PREAMBLE = struct.Struct("<IQ")
+
+
+def write_packed(path, magic, version, header, arrays):
+    """
+    Write arrays and a JSON-serializable header to `path` atomically.
+
+    Parameters:
+    path (str): Output file
+    magic (bytes): 4 byte file type marker
+    version (int): Format version of the file type
+    header (dict): Metadata stored alongside the arrays ("arrays" is reserved)
+    arrays (dict): Name -> NumPy array
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    header = dict(header, arrays=layout)
+
+    # Offsets depend on the header size, so lay the arrays out until the header stops growing
+    header_bytes = b""
+    while True:
+        position = len(magic) + PREAMBLE.size + len(header_bytes)
+        for name, array in arrays.items():
+            position += -position % ALIGNMENT
+            layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": position}
+            position += array.nbytes
+        encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        stable = len(encoded) == len(header_bytes)
+        header_bytes = encoded
+        if stable:
+            break
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".bin")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(magic)
+            f.write(PREAMBLE.pack(version, len(header_bytes)))
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.write(b"\0" * (layout[name]["offset"] - f.tell()))
+                f.write(array.tobytes())
+        # mkstemp creates the file private; published data should be world readable
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def parse_header(buffer, magic, version, path=""):
+    """
+    Parse the header at the start of a packed file (any bytes-like object).
+    Raises ValueError if the file is of another type or version.
+    """
+    if bytes(buffer[:len(magic)]) != magic:
+        raise ValueError(f"{path} is not a {magic.decode()} file")
+    if len(buffer) < len(magic) + PREAMBLE.size:
+        raise ValueError(f"{path} is truncated")
+    file_version, header_length = PREAMBLE.unpack_from(buffer, len(magic))
+    if file_version != version:
+        raise ValueError(f"{path} has unsupported version {file_version}")
+    start = len(magic) + PREAMBLE.size
+    return json.loads(bytes(buffer[start:start + header_length]))
+
+
+def read_header(path, magic, version):
+    """
+    Read only the header of a packed file, without mapping the arrays.
+    """
+    with open(path, "rb") as f:
+        head = f.read(len(magic) + PREAMBLE.size)
+        if len(head) == len(magic) + PREAMBLE.size:
+            head += f.read(PREAMBLE.unpack_from(head, len(magic))[1])
+    return parse_header(head, magic, version, path)
+
+
+class PackedFile:
+    """
+    Read-only memory map of a packed file. `header` holds the metadata and `arrays` the
+    arrays, which are views straight into the mapping (nothing is copied).
+    """
+
+    def __init__(self, path, magic, version):
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.header = parse_header(self.mmap, magic, version, path)
+        self.arrays = {}
+        for name, spec in self.header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            array = np.frombuffer(self.mmap, dtype=dtype, count=count, offset=spec["offset"])
+            self.arrays[name] = array.reshape(spec["shape"])
+
+    def close(self):
+        # The mapping can only be closed once no array points into it
+        self.arrays = {}
+        self.mmap.close()
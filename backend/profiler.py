@@ -0,0 +1,135 @@
+# This module is an opt-in sampling profiler for the API. While a profile is running, a
+# background thread snapshots every thread's Python stack a few hundred times a second
+# and counts identical stacks. The result is in the "folded" format (one line per stack,
+# frames separated by semicolons, then the sample count) that flamegraph.pl, speedscope
+# and inferno turn into flame graphs. A profile covers a window of requests: it stops
+# after a number of requests have finished or a number of seconds have passed.
+import os
+import sys
+import threading
+import time
+
+# Seconds between samples
+SAMPLE_INTERVAL = 0.005
+# A profile never runs longer than this, even when waiting for more requests
+MAX_SECONDS = 300
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread (except its own) while a profile is running.
+
+    Parameters:
+    interval (float): Seconds between samples
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.stacks = {}
+        self.samples = 0
+        self.requests = 0
+        self.max_requests = None
+        self.started = None
+        self.stopped = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, requests=None, seconds=None):
+        """
+        Start a new profile, dropping the previous one.
+
+        Parameters:
+        requests (int): Stop after this many requests have finished
+        seconds (float): Stop after this many seconds (at most MAX_SECONDS)
+
+        Returns:
+        bool: False if a profile is already running
+        """
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = {}
+            self.samples = 0
+            self.requests = 0
+            self.max_requests = requests
+            self.started = time.time()
+            self.stopped = None
+            self.stop_event = threading.Event()
+            duration = min(seconds, MAX_SECONDS) if seconds else MAX_SECONDS
+            self.thread = threading.Thread(target=self._run, args=(duration,), name="profiler", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        self.stop_event.set()
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def request_done(self):
+        """
+        Count a finished request, stopping the profile when the window is full.
+        """
+        if not self.running:
+            return
+        with self.lock:
+            self.requests += 1
+            full = self.max_requests is not None and self.requests >= self.max_requests
+        if full:
+            self.stop_event.set()
+
+    def _run(self, duration):
+        me = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while not self.stop_event.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_label(frame))
+                    frame = frame.f_back
+                # Root first, under the thread's name so the pools show up separately
+                frames.append(names.get(ident, f"thread-{ident}"))
+                sampled.append(";".join(reversed(frames)))
+            with self.lock:
+                for stack in sampled:
+                    self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                self.samples += 1
+        with self.lock:
+            self.stopped = time.time()
+
+    def status(self):
+        """
+        Return a JSON-serializable summary of the current (or last) profile.
+        """
+        with self.lock:
+            end = self.stopped or time.time()
+            return {
+                "running": self.running,
+                "samples": self.samples,
+                "stacks": len(self.stacks),
+                "requests": self.requests,
+                "max_requests": self.max_requests,
+                "seconds": round(end - self.started, 3) if self.started else 0,
+            }
+
+    def folded(self):
+        """
+        Return the profile in the folded stack format, most sampled stacks first.
+        """
+        with self.lock:
+            stacks = sorted(self.stacks.items(), key=lambda item: -item[1])
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
@@ -1,17 +1,141 @@
 # This module handles the scraping of recycler data from rusthelp and returns it in a structured format.
 
+import html
+import re
+import time
 import requests
 from bs4 import BeautifulSoup
 import json
 
+from metrics import PARSE_SECONDS, UPSTREAM_REQUEST_SECONDS, UPSTREAM_RESPONSES
+
+# The fast parser builds its (small) tree with the same builder as the full parse: lxml
+# repairs invalid nesting (a <p> inside a <p>, unclosed cells) differently than
+# html.parser, so it would not always give the same result
+FAST_TREE_BUILDER = "html.parser"
+
+# Base URL for rusthelp item pages
+BASE_URL = "https://rusthelp.com"
+
+# Headers sent with every request to rusthelp
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+
+def slugify(item_name):
+    """
+    The slug of an item's page, as rusthelp builds it: "Tactical Gloves" -> tactical-gloves.
+    Non-ASCII letters are kept; HTTP clients percent-encode them in the request path.
+    """
+    return item_name.lower().replace(" ", "-")
+
+
+def item_url(item_name, base_url=BASE_URL):
+    """
+    Build the recycling page URL for an item display name.
+    Example: "Tactical Gloves" -> https://rusthelp.com/items/tactical-gloves#recycling
+    """
+    return f"{base_url}/items/{slugify(item_name)}#recycling"
+
+
+# Quoted attribute values are consumed whole, so a "<div" or "recycling-tab" inside one is
+# never taken for a tag
+TAG_BODY = r"""[^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*>"""
+
+# The part of a page before the recycling tab, in one match: text, every tag except a div
+# that mentions recycling-tab, comments, declarations such as the doctype, and whole script
+# and style elements (their content is text, not markup). It stops at that div, or at
+# markup too broken to read the way html.parser does (an unclosed comment, script or style)
+PREFIX_RE = re.compile(
+    r"""(?:[^<]+"""
+    r"""|<(?!div\b|script\b|style\b|!--)/?[a-zA-Z]""" + TAG_BODY +
+    r"""|<div\b(?![^>]*recycling-tab)""" + TAG_BODY +
+    r"""|<!--.*?-->|<!(?!--)[^>]*>|<\?[^>]*>"""
+    r"""|<(script|style)\b""" + TAG_BODY + r""".*?</\1\s*>"""
+    r"""|<(?![a-zA-Z/!?]))*""",
+    re.IGNORECASE | re.DOTALL,
+)
+# One token inside the tab: a comment, a script or style element, any start or end tag, or
+# an unclosed comment
+TAG_RE = re.compile(
+    r"""<!--.*?-->"""
+    r"""|<(script|style)\b""" + TAG_BODY + r""".*?</\1\s*>"""
+    r"""|<(/?)([a-zA-Z][^\s/>]*)(""" + TAG_BODY[:-1] + r""")>"""
+    r"""|(<!--)""",
+    re.IGNORECASE | re.DOTALL,
+)
+ATTR_RE = re.compile(r"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+
+
+def _tag_id(attributes):
+    # The id html.parser would give the tag: names are case-insensitive, the last duplicate
+    # wins and character references are decoded
+    tag_id = None
+    for match in ATTR_RE.finditer(attributes):
+        if match.group(1).lower() == "id":
+            value = next((v for v in match.group(2, 3, 4) if v is not None), "")
+            tag_id = html.unescape(value)
+    return tag_id
+
+
+def extract_recycling_tab(html_content):
+    """
+    Slice the raw HTML of the div#recycling-tab subtree out of a page without parsing it.
+    Returns None if the page has no recycling tab, the div is never closed, or the markup
+    is too broken to slice the way html.parser reads it.
+    """
+    # Find the opening tag, skipping divs that only mention the id in another attribute
+    position = 0
+    while True:
+        position = PREFIX_RE.match(html_content, position).end()
+        tag = TAG_RE.match(html_content, position)
+        if tag is None or (tag.group(3) or "").lower() != "div":
+            return None  # The end of the page, or broken markup
+        if not tag.group(2) and _tag_id(tag.group(4)) == "recycling-tab":
+            break
+        position = tag.end()
+    start = position
+    if tag.group(4).endswith("/"):
+        return tag.group(0)  # <div/> is closed straight away by html.parser
+
+    # Walk the tags after the opening one until it is balanced again
+    depth = 1
+    for tag in TAG_RE.finditer(html_content, tag.end()):
+        name = (tag.group(3) or "").lower()
+        if tag.group(5) or name in ("script", "style"):
+            return None  # Never closed, so the rest of the page is its text
+        if name != "div":
+            continue
+        if tag.group(2):
+            depth -= 1
+            if depth == 0:
+                return html_content[start:tag.end()]
+        elif not tag.group(4).endswith("/"):
+            depth += 1
+    return None
+
+
+def fetch_page(url, source="scrape", **options):
+    """
+    GET a rusthelp page, recording how long it took and the status it was answered with.
+    Keyword arguments are passed to requests.get; request errors are raised.
+    """
+    start = time.perf_counter()
+    try:
+        response = requests.get(url, headers=HEADERS, **options)
+    except requests.exceptions.RequestException:
+        UPSTREAM_RESPONSES.inc(source=source, status="error")
+        raise
+    finally:
+        UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - start, source=source)
+    UPSTREAM_RESPONSES.inc(source=source, status=response.status_code)
+    return response
 
 def scrape_recycler_data(url):
     # Send HTTP request to the webpage
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        response = requests.get(url, headers=headers)
+        response = fetch_page(url)
         response.raise_for_status()  # Raise an exception for bad status codes
     except requests.exceptions.RequestException as e:
         return f"Error fetching the URL: {e}"
@@ -23,10 +147,7 @@ def scrape_recycler_data(url):
 def scrape_recycler_data_all(url, timeout=30):
     # Send HTTP request to the webpage
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        response = requests.get(url, headers=headers, timeout=timeout)
+        response = fetch_page(url, timeout=timeout)
         response.raise_for_status()  # Raise an exception for bad status codes
     except (requests.exceptions.RequestException, requests.exceptions.Timeout) as e:
         return None
@@ -38,8 +159,30 @@ def scrape_recycler_data_all(url, timeout=30):
         return None
     return recycler_data
 
-def parse_recycler_data(html_content, no_safezone=False):
-    soup = BeautifulSoup(html_content, "html.parser")
+def parse_recycler_data(html_content, no_safezone=False, parser="fast"):
+    """
+    Parse the recycling table out of an item page.
+
+    With parser="fast" (the default) only the div#recycling-tab subtree is sliced out of the
+    raw HTML and turned into a tree. parser="full" builds a tree for the whole page. Both
+    use html.parser and produce the same result.
+    """
+    with PARSE_SECONDS.time(parser=parser):
+        return _parse_recycler_data(html_content, no_safezone, parser)
+
+def _parse_recycler_data(html_content, no_safezone, parser):
+    if parser == "fast":
+        tab_html = extract_recycling_tab(html_content)
+        if tab_html is None or "<table" not in tab_html.lower():
+            # No tab at all is the common case. A tab without a table, or one that couldn't
+            # be sliced, gets the full parse, so the two never disagree
+            if "recycling-tab" not in html_content:
+                return None
+            soup = BeautifulSoup(html_content, "html.parser")
+        else:
+            soup = BeautifulSoup(tab_html, FAST_TREE_BUILDER)
+    else:
+        soup = BeautifulSoup(html_content, "html.parser")
 
     # Look specifically for the recycling tab div
     recycling_tab = soup.find("div", id="recycling-tab")
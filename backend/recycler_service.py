@@ -0,0 +1,318 @@
+# This module serves recycling data for the API without blocking the event loop.
+# Lookups are answered from the generated dataset first, then from an in-memory LRU/TTL
+# cache, and only then by a live rusthelp fetch in a thread pool. Concurrent requests
+# for the same item share a single upstream fetch. The scraper (and with it requests and
+# BeautifulSoup) is only imported once something actually has to be fetched.
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+from manifest import content_hash
+
+# Where generate_recycling_data writes its output
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+RECYCLING_DATA_FILE = os.path.join(DATA_DIR, "all_recycling_data.json")
+SOURCES_FILE = os.path.join(DATA_DIR, "recycling_sources.json")
+
+
+def item_slug(url):
+    """
+    Return the item slug of a rusthelp item URL: .../items/tactical-gloves#recycling -> tactical-gloves
+    Percent-encoded slugs are decoded: .../items/rustig%C3%A9-egg -> rustigé-egg
+    """
+    path = urlsplit(url).path.rstrip("/")
+    return unquote(path.rsplit("/", 1)[-1]).lower()
+
+
+class RecyclingDataset:
+    """
+    The generated all_recycling_data.json, loaded once and reloaded when its mtime changes.
+    When the compiled copy next to it (see compiled_dataset.py) was built from the same
+    JSON, entries are read from that memory-mapped file instead of parsing the JSON.
+
+    Parameters:
+    path (str): Path of the generated dataset
+    check_interval (float): Minimum seconds between mtime checks
+    compiled_path (str): Path of the compiled copy (defaults to the dataset path with .bin)
+    """
+
+    def __init__(self, path=RECYCLING_DATA_FILE, check_interval=5.0, compiled_path=None):
+        self.path = path
+        self.compiled_path = compiled_path or os.path.splitext(path)[0] + ".bin"
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        # Parsed JSON, or None while the entries come from the compiled file
+        self.data = {}
+        self.compiled = None
+        self.by_slug = {}
+        # What readers use, swapped in as one so they never mix two reloads
+        self.current = (None, {}, {}, 0)
+        self.mtime = None
+        self.hash = None
+        self.version = 0
+        self.last_check = 0.0
+
+    def _open_compiled(self, dataset_hash):
+        # Imported here so the API doesn't load numpy until the dataset is first read
+        from compiled_dataset import CompiledDataset
+
+        try:
+            compiled = CompiledDataset(self.compiled_path)
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        # A stale copy, or one that can't reproduce the JSON entries exactly
+        if compiled.dataset_hash != dataset_hash or compiled.texts is None:
+            compiled.close()
+            return None
+        return compiled
+
+    def _reload(self, mtime):
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return
+        dataset_hash = content_hash(raw)
+        compiled = self._open_compiled(dataset_hash)
+        # Build the new views before swapping them in, so readers never see a partial state
+        if compiled is not None:
+            data = None
+            by_slug = {name.lower().replace(" ", "-"): i for i, name in enumerate(compiled.names[:compiled.sources])}
+        else:
+            try:
+                data = json.loads(raw)
+            except json.JSONDecodeError:
+                return
+            by_slug = {name.lower().replace(" ", "-"): entry for name, entry in data.items()}
+        version = self.version + 1
+        self.current = (compiled, data, by_slug, version)
+        self.compiled, self.data, self.by_slug, self.mtime = compiled, data, by_slug, mtime
+        self.hash = dataset_hash
+        self.version = version
+
+    def refresh(self):
+        now = time.time()
+        if now - self.last_check < self.check_interval:
+            return
+        with self.lock:
+            self.last_check = now
+            try:
+                # The compiled copy is written after the JSON, so a change to either reloads
+                mtime = (os.path.getmtime(self.path), _mtime(self.compiled_path))
+            except FileNotFoundError:
+                return
+            if mtime != self.mtime:
+                self._reload(mtime)
+
+    def snapshot(self):
+        """
+        Return (compiled, data, version) of the loaded dataset; exactly one of compiled
+        and data is set (data is {} before the first load).
+        """
+        compiled, data, _, version = self.current
+        return compiled, data, version
+
+    def get(self, url):
+        """
+        Return the dataset entry for an item URL, or None if the dataset doesn't have it.
+        """
+        self.refresh()
+        compiled, _, by_slug, _ = self.current
+        found = by_slug.get(item_slug(url))
+        if compiled is None or found is None:
+            return found
+        return compiled.entry(found)
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return None
+
+
+class TTLCache:
+    """
+    LRU cache whose entries are fresh for `ttl` seconds and may then be served stale,
+    while they are revalidated, for another `stale_ttl` seconds.
+
+    Parameters:
+    maxsize (int): Maximum number of entries kept
+    ttl (float): Seconds an entry is fresh
+    stale_ttl (float): Extra seconds a stale entry may still be served
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, stale_ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return (value, state) where state is "fresh", "stale" or "miss".
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, "miss"
+        value, stored, ttl = entry
+        age = time.monotonic() - stored
+        if age > ttl + self.stale_ttl:
+            del self.entries[key]
+            self.misses += 1
+            return None, "miss"
+        self.entries.move_to_end(key)
+        if age > ttl:
+            self.stale_hits += 1
+            return value, "stale"
+        self.hits += 1
+        return value, "fresh"
+
+    def set(self, key, value, ttl=None):
+        self.entries[key] = (value, time.monotonic(), self.ttl if ttl is None else ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+class RecyclerService:
+    """
+    Recycling data lookups for the /recycler endpoint.
+
+    Parameters:
+    dataset (RecyclingDataset): Generated dataset to answer from first
+    cache (TTLCache): Cache for live fetches
+    negative_ttl (float): Seconds a failed or empty fetch is cached
+    max_workers (int): Threads available for live fetches
+    timeout (float): Timeout in seconds for a live fetch
+    """
+
+    def __init__(self, dataset=None, cache=None, negative_ttl=60, max_workers=8, timeout=30):
+        self.dataset = dataset if dataset is not None else RecyclingDataset()
+        self.cache = cache if cache is not None else TTLCache()
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recycler")
+        self.inflight = {}
+        # Monotonic time before which a stale entry whose revalidation failed isn't retried
+        self.retry_at = {}
+        self.upstream_fetches = 0
+
+    @staticmethod
+    def cache_key(url):
+        from recycler import BASE_URL
+
+        # The fragment, letter case and percent-encoding don't change which page is fetched
+        return f"{BASE_URL}/items/{item_slug(url)}"
+
+    async def _fetch(self, key, url, stale=None):
+        from recycler import scrape_recycler_data_all
+
+        loop = asyncio.get_running_loop()
+        self.upstream_fetches += 1
+        try:
+            data = await loop.run_in_executor(self.executor, scrape_recycler_data_all, url, self.timeout)
+        finally:
+            self.inflight.pop(key, None)
+        if data is None and stale is not None:
+            # A failed fetch and a page without recycling data look the same, so a failed
+            # revalidation keeps the stale copy and is retried after negative_ttl
+            now = time.monotonic()
+            if len(self.retry_at) >= self.cache.maxsize:
+                self.retry_at = {k: t for k, t in self.retry_at.items() if t > now}
+            self.retry_at[key] = now + self.negative_ttl
+            return stale
+        self.retry_at.pop(key, None)
+        self.cache.set(key, data, None if data is not None else self.negative_ttl)
+        return data
+
+    def _coalesced_fetch(self, key, url, stale=None):
+        # Everyone asking for the same page while a fetch is running waits on that fetch
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, url, stale))
+            # Background revalidations have nobody awaiting them, so mark errors as seen
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self.inflight[key] = task
+        return task
+
+    async def get(self, url):
+        """
+        Return the recycling data for an item URL (None if the item can't be recycled or
+        the fetch failed), in the same format as scrape_recycler_data_all.
+        """
+        data = self.dataset.get(url)
+        if data is not None:
+            return data
+
+        key = self.cache_key(url)
+        data, state = self.cache.get(key)
+        if state == "stale" and time.monotonic() >= self.retry_at.get(key, 0):
+            # Serve the stale copy now and revalidate in the background
+            self._coalesced_fetch(key, url, data)
+        if state != "miss":
+            return data
+        return await asyncio.shield(self._coalesced_fetch(key, url))
+
+    async def get_by_name(self, name):
+        from recycler import item_url
+
+        return await self.get(item_url(name))
+
+    async def get_many(self, queries, catalogue=None):
+        """
+        Resolve a batch of item names, shortnames or URLs, yielding (index, result) pairs as
+        each one finishes. Dataset and cache hits come back immediately; misses are fetched
+        concurrently (bounded by the fetch thread pool).
+        """
+        async def lookup(index, query):
+            url, error = resolve_item_query(query, catalogue)
+            result = {"query": query}
+            if error:
+                result["error"] = error
+                return index, result
+            result["url"] = url
+            try:
+                data = await self.get(url)
+            except Exception as e:
+                result["error"] = f"Error fetching recycling data: {e}"
+                return index, result
+            if data is None:
+                result["error"] = "No recycling data found."
+            else:
+                result["data"] = data
+            return index, result
+
+        for task in asyncio.as_completed([lookup(index, query) for index, query in enumerate(queries)]):
+            yield await task
+
+
+def resolve_item_query(query, catalogue=None):
+    """
+    Turn an item name, shortname or rusthelp URL into an item URL. The query may be
+    percent-encoded ("Rustig%C3%A9%20Egg").
+    Returns (url, None) or (None, error message).
+    """
+    from recycler import BASE_URL, item_url
+
+    query = unquote(query or "").strip()
+    if not query:
+        return None, "Empty item query."
+    if "://" in query:
+        if not query.startswith(f"{BASE_URL}/items/"):
+            return None, f"Invalid URL. Must start with '{BASE_URL}/items/'."
+        return query, None
+    if catalogue is not None:
+        item = catalogue.by_shortname.get(query) or catalogue.by_name.get(query)
+        if item is not None:
+            return item_url(item["name"]), None
+    return item_url(query), None
@@ -0,0 +1,124 @@
+# This module answers "which items recycle into X?" from a precomputed inverted index.
+# For every output the sources are stored pre-sorted by expected yield per item recycled,
+# so the top k sources are a slice. The index is saved next to the dataset so the server
+# doesn't have to rebuild it at startup.
+import json
+import threading
+
+from manifest import atomic_write_json, content_hash
+from yield_graph import YieldGraph
+
+
+class ReverseIndex:
+    """
+    Inverted index from output item to the items that recycle into it.
+
+    Parameters:
+    direct (dict): {output: [[source, expected yield], ...]} sorted by yield, highest first,
+        using the outputs of a single recycle
+    recursive (dict): The same, using the raw resources left after recycling recursively
+    dataset_hash (str): Hash of the dataset file the index was built from
+    """
+
+    def __init__(self, direct, recursive, dataset_hash=None):
+        self.direct = direct
+        self.recursive = recursive
+        self.dataset_hash = dataset_hash
+        self.lookup = {name.casefold(): name for name in list(direct) + list(recursive)}
+
+    @classmethod
+    def build(cls, graph, dataset_hash=None):
+        """
+        Build the index from a YieldGraph.
+        """
+        def invert(yields):
+            inverted = {}
+            for source, outputs in yields.items():
+                for output, amount in outputs.items():
+                    if amount > 0:
+                        inverted.setdefault(output, []).append([source, amount])
+            for sources in inverted.values():
+                # Highest yield first; ties in name order so the file is stable between runs
+                sources.sort(key=lambda pair: (-pair[1], pair[0]))
+            return inverted
+
+        direct = invert(graph.direct)
+        recursive = invert({name: graph.totals(name) for name in graph.direct})
+        return cls(direct, recursive, dataset_hash)
+
+    def sources(self, output, limit=10, offset=0, recursive=False):
+        """
+        Return (output name, sources) where sources lists the items that recycle into
+        `output`, best yield first, as [{"item": source, "yield": expected amount per item}].
+        Returns None if the output is unknown.
+        """
+        name = self.lookup.get(output.casefold())
+        if name is None:
+            return None
+        index = self.recursive if recursive else self.direct
+        entries = index.get(name, [])
+        end = None if limit is None else offset + limit
+        return name, [{"item": source, "yield": amount} for source, amount in entries[offset:end]]
+
+    def save(self, path):
+        atomic_write_json(
+            {"dataset_hash": self.dataset_hash, "direct": self.direct, "recursive": self.recursive},
+            path,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a saved index. Returns None if the file is missing or unreadable.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            return cls(saved["direct"], saved["recursive"], saved.get("dataset_hash"))
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
+            return None
+
+
+def save_for_dataset(data_file, path):
+    """
+    Make sure the saved index at `path` matches the dataset file, rebuilding it if not.
+    Called by generate_recycling_data after the dataset is written.
+    """
+    with open(data_file, "rb") as f:
+        raw = f.read()
+    dataset_hash = content_hash(raw)
+    index = ReverseIndex.load(path)
+    if index is None or index.dataset_hash != dataset_hash:
+        index = ReverseIndex.build(YieldGraph(json.loads(raw)), dataset_hash)
+        index.save(path)
+    return index
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_reverse_index(dataset, path, graph_factory):
+    """
+    Return the ReverseIndex for the current version of a RecyclingDataset.
+    The saved index is used when it was built from the same dataset file; otherwise the
+    index is rebuilt in memory from the yield graph.
+
+    Parameters:
+    dataset (RecyclingDataset): The loaded dataset
+    path (str): Where the saved index lives
+    graph_factory (callable): Returns the YieldGraph for the dataset, if a rebuild is needed
+    """
+    global _index, _index_version
+    dataset.refresh()
+    if _index is not None and _index_version == dataset.version:
+        return _index
+    with _index_lock:
+        if _index is None or _index_version != dataset.version:
+            index = ReverseIndex.load(path)
+            if index is None or index.dataset_hash != dataset.hash:
+                index = ReverseIndex.build(graph_factory(dataset), dataset.hash)
+            _index, _index_version = index, dataset.version
+        return _index
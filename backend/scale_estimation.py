@@ -0,0 +1,221 @@
+# This module estimates how much larger or smaller the icons in a screenshot are than the
+# downloaded icons, which depends on the screenshot's resolution and the game's UI scale.
+# With an inventory grid, the slot size bounds the icon size, so only a narrow range of
+# scales is tried, on a few occupied slots. Without one, a few anchor icons are matched
+# at a ladder of scales on a shrunken copy of the screenshot (a coarse pyramid level),
+# and the best scale is then refined at full resolution around the strongest matches.
+import cv2
+import numpy as np
+
+from inventory_grid import EMPTY_SLOT_STD, locate_grid
+from template_bank import normalize_features, resize_template, thumbnail
+
+# Estimated scales are rounded to this step, so screenshots at the same resolution share
+# one rescaled bank
+SCALE_STEP = 0.01
+# Scales this close to 1 use the icons as they are
+SNAP_TO_NATIVE = 0.02
+# Scales the pyramid search tries when there is no grid
+PYRAMID_SCALES = tuple(2 ** (k / 8) for k in range(-8, 9))
+# Width the screenshot is shrunk to for the coarse pyramid search
+PYRAMID_WIDTH = 480
+# Icons matched in the pyramid search unless anchors are given
+ANCHOR_COUNT = 24
+# Templates smaller than this at the coarse level aren't worth matching
+MIN_TEMPLATE_SIZE = 6
+
+
+def quantize_scale(scale):
+    """
+    Round a scale to SCALE_STEP, snapping scales within SNAP_TO_NATIVE of 1 to exactly 1.
+    """
+    if abs(scale - 1) <= SNAP_TO_NATIVE:
+        return 1.0
+    return round(round(scale / SCALE_STEP) * SCALE_STEP, 3)
+
+
+def _common_shape(bank):
+    (h, w), _ = max(bank.groups().items(), key=lambda group: len(group[1]))
+    return h, w
+
+
+def _best_scale(bank, windows, scales):
+    """
+    Score every scale by how well the candidate icons of each window match inside it,
+    resized to that scale, and return (best scale, its mean score).
+
+    Parameters:
+    windows (list): (grayscale window, candidate bank indices) pairs
+    scales (iterable): Scales to try
+    """
+    best_scale, best_score = None, -1.0
+    for scale in scales:
+        total = 0.0
+        for window, candidates in windows:
+            best = 0.0
+            for i in candidates:
+                template = resize_template(bank.template(i), scale)
+                if template.shape[0] > window.shape[0] or template.shape[1] > window.shape[1]:
+                    continue
+                best = max(best, float(cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED).max()))
+            total += best
+        score = total / len(windows)
+        if score > best_score:
+            best_scale, best_score = scale, score
+    return best_scale, best_score
+
+
+def _search_scales(bank, windows, low, high, stride=4):
+    """
+    Find the best scale between low and high to within SCALE_STEP: every `stride` steps
+    first, then every step around the best of those.
+    """
+    first = max(int(np.floor(low / SCALE_STEP)), 1)
+    last = max(int(np.ceil(high / SCALE_STEP)), first)
+    coarse, _ = _best_scale(bank, windows, [k * SCALE_STEP for k in range(first, last + 1, stride)])
+    center = int(round(coarse / SCALE_STEP))
+    fine = range(max(center - stride + 1, first), min(center + stride, last + 1))
+    return _best_scale(bank, windows, [k * SCALE_STEP for k in fine])
+
+
+def estimate_scale_from_grid(bank, gray, grid, sample_slots=6, candidates=3, fill=(0.6, 1.0)):
+    """
+    Estimate the icon scale from the inventory grid: the icons fill most of a slot, so
+    only scales that make the bank's common icon size a `fill` fraction of the slot are
+    tried, on up to `sample_slots` occupied slots.
+
+    Parameters:
+    bank (TemplateBank): Icons at their native size
+    gray (np.ndarray): Grayscale screenshot
+    grid (SlotGrid): The screenshot's slot grid
+    sample_slots (int): Occupied slots to sample
+    candidates (int): Best feature matches per slot to template match
+    fill (tuple): Smallest and largest fraction of the slot an icon may cover
+
+    Returns:
+    tuple: (scale, mean match score), or (None, 0.0) if every slot is empty
+    """
+    height, width = gray.shape
+    icon_h, icon_w = _common_shape(bank)
+    base = min(grid.slot_w / icon_w, grid.slot_h / icon_h)
+
+    occupied = []
+    for x, y in grid.slots():
+        slot = gray[y:y + grid.slot_h, x:x + grid.slot_w]
+        if slot.size and slot.std() >= EMPTY_SLOT_STD:
+            occupied.append((x, y))
+    if not occupied:
+        return None, 0.0
+    # Spread the samples over the grid rather than taking the first row
+    picks = np.linspace(0, len(occupied) - 1, min(sample_slots, len(occupied))).round().astype(int)
+
+    # Icon thumbnails don't depend on scale, so the candidates for a slot are picked once,
+    # from a crop at the middle of the fill range
+    features = bank.features()
+    crop_h = min(grid.slot_h, int(round(icon_h * base * sum(fill) / 2)))
+    crop_w = min(grid.slot_w, int(round(icon_w * base * sum(fill) / 2)))
+    windows = []
+    for k in sorted(set(picks.tolist())):
+        x, y = occupied[k]
+        cx = x + (grid.slot_w - crop_w) // 2
+        cy = y + (grid.slot_h - crop_h) // 2
+        crop = thumbnail(gray[cy:cy + crop_h, cx:cx + crop_w])
+        similarity = normalize_features(crop[None, :]) @ features.T
+        order = np.argsort(-similarity[0])[:candidates]
+        x0, y0 = max(x - 2, 0), max(y - 2, 0)
+        window = gray[y0:min(y + grid.slot_h + 2, height), x0:min(x + grid.slot_w + 2, width)]
+        windows.append((window, [int(i) for i in order]))
+
+    return _search_scales(bank, windows, base * fill[0], base * fill[1])
+
+
+def estimate_scale_pyramid(bank, gray, anchors=None, scales=PYRAMID_SCALES, top=3):
+    """
+    Estimate the icon scale without a grid: match anchor icons at every scale in `scales`
+    on a shrunken screenshot, then refine the best scale at full resolution around the
+    strongest matches.
+
+    Parameters:
+    bank (TemplateBank): Icons at their native size
+    gray (np.ndarray): Grayscale screenshot
+    anchors (list): Names of icons likely to be on screen (default: the ANCHOR_COUNT
+        icons with the most texture, which match least by accident)
+    scales (tuple): Coarse scales to try, in increasing geometric steps
+    top (int): Strongest anchor matches that score a scale
+
+    Returns:
+    tuple: (scale, mean match score), or (None, 0.0) if no anchor fits the screenshot
+    """
+    if anchors is None:
+        anchors = np.argsort(-(bank.norms / np.sqrt(bank.shapes.prod(axis=1))))[:ANCHOR_COUNT]
+    else:
+        anchors = [bank.index[name] for name in anchors if name in bank.index]
+    anchors = [int(i) for i in anchors]
+    top = min(top, len(anchors))
+    if top == 0:
+        return None, 0.0
+
+    factor = max(1.0, gray.shape[1] / PYRAMID_WIDTH)
+    small = cv2.resize(gray, (int(round(gray.shape[1] / factor)), int(round(gray.shape[0] / factor))),
+                       interpolation=cv2.INTER_AREA)
+
+    best = None
+    for scale in scales:
+        peaks = []
+        for i in anchors:
+            template = resize_template(bank.template(i), scale / factor)
+            if min(template.shape) < MIN_TEMPLATE_SIZE or template.shape[0] > small.shape[0] or template.shape[1] > small.shape[1]:
+                continue
+            _, score, _, location = cv2.minMaxLoc(cv2.matchTemplate(small, template, cv2.TM_CCOEFF_NORMED))
+            peaks.append((score, i, location))
+        if len(peaks) < top:
+            continue
+        peaks.sort(reverse=True)
+        score = sum(peak[0] for peak in peaks[:top]) / top
+        if best is None or score > best[0]:
+            best = (score, scale, peaks[:top])
+    if best is None:
+        return None, 0.0
+
+    # Refine around the coarse scale, in full resolution windows around the best matches
+    _, coarse, peaks = best
+    step = scales[1] / scales[0] if len(scales) > 1 else 1.1
+    height, width = gray.shape
+    windows = []
+    for _, i, (px, py) in peaks:
+        h, w = (int(v) for v in bank.shapes[i])
+        margin = int(np.ceil(max(h, w) * coarse * (step - 1))) + int(np.ceil(factor)) + 2
+        x0, y0 = max(int(px * factor) - margin, 0), max(int(py * factor) - margin, 0)
+        x1 = min(int(px * factor + w * coarse * step) + margin, width)
+        y1 = min(int(py * factor + h * coarse * step) + margin, height)
+        windows.append((gray[y0:y1, x0:x1], [i]))
+    return _search_scales(bank, windows, coarse / step, coarse * step)
+
+
+def estimate_scale(bank, gray, grid=None, anchors=None):
+    """
+    Estimate how much the screenshot's icons are scaled relative to the bank's icons.
+    Uses the inventory grid if there is one, otherwise the pyramid search.
+
+    Parameters:
+    bank (TemplateBank): Icons at their native size
+    gray (np.ndarray): Grayscale screenshot
+    grid (SlotGrid): The screenshot's slot grid, if already located (otherwise it is looked for)
+    anchors (list): Icon names for the pyramid search, see estimate_scale_pyramid
+
+    Returns:
+    float: The scale, rounded with quantize_scale (1.0 if it can't be estimated)
+    """
+    scale = None
+    if grid is None:
+        grid = locate_grid(gray)
+    if grid is not None:
+        scale, score = estimate_scale_from_grid(bank, gray, grid)
+    if scale is None:
+        scale, score = estimate_scale_pyramid(bank, gray, anchors)
+    if scale is None:
+        print("Unable to estimate the icon scale, using the icons as they are")
+        return 1.0
+    scale = quantize_scale(scale)
+    print(f"Estimated icon scale {scale:g} (match score {score:.2f})")
+    return scale
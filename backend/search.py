@@ -1,13 +1,240 @@
 # This module handles the search functionality for items in the game.
-from items import get_items
+# Searches run against a prebuilt index over the item catalogue: a prefix trie over
+# normalized words, an n-gram index for substring matching, and trigram similarity for typos.
+import heapq
+import re
+import threading
+from collections import Counter, defaultdict
 
-def search_items(query):
-    items = get_items()
-    results = []
+from items import get_catalogue
 
-    # Search for items matching the query
-    for item in items.values():
-        if query.lower() in item["name"].lower() or query.lower() in item["shortname"].lower():
-            results.append(item)
+# Scores for each kind of match; the best one an item gets decides its rank
+EXACT_SCORE = 100
+NAME_PREFIX_SCORE = 80
+WORD_PREFIX_SCORE = 60
+SUBSTRING_SCORE = 40
+FUZZY_SCORE = 20
+DESCRIPTION_SCORE = 10
 
-    return results
\ No newline at end of file
+# Matches that only hit the shortname rank just below the same match on the display name
+SHORTNAME_PENALTY = 5
+
+# Fraction of the query's trigrams an item must share to count as a fuzzy match
+FUZZY_THRESHOLD = 0.7
+
+# Queries shorter than this are too short to have meaningful typos
+FUZZY_MIN_LENGTH = 4
+
+# Queries up to this length match a large part of the catalogue, so their ranking is memoized
+SHORT_QUERY_LENGTH = 2
+
+WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text):
+    """
+    Case-fold and collapse punctuation to single spaces: "Fogger-3000" -> "fogger 3000".
+    """
+    return " ".join(WORD_RE.findall(text.casefold()))
+
+
+def ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def trigrams(text):
+    """
+    Trigrams of each word padded with spaces, as used for fuzzy matching.
+    """
+    grams = set()
+    for word in text.split():
+        grams |= ngrams(f"  {word} ", 3)
+    return grams
+
+
+class Trie:
+    """
+    Prefix trie mapping every prefix of the inserted keys to the ids stored under them.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, key, item_id):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+            node.setdefault(None, set()).add(item_id)
+
+    def prefixed(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node.get(None, set())
+
+
+class SearchIndex:
+    """
+    Search index over one version of the item catalogue.
+
+    Parameters:
+    items (dict): Items as returned by get_items()
+    version (int): Catalogue version the index was built from
+    """
+
+    def __init__(self, items, version=None):
+        self.version = version
+        self.items = list(items.values())
+        self.names = [normalize(item["name"]) for item in self.items]
+        self.shortnames = [normalize(item["shortname"]) for item in self.items]
+        self.descriptions = [normalize(item.get("description") or "") for item in self.items]
+
+        # Every word boundary of the name and shortname starts a trie key, so both
+        # "metal frag" and "frag" find "Metal Fragments"
+        self.trie = Trie()
+        # 1-, 2- and 3-grams for substring lookups of any length
+        self.grams = defaultdict(set)
+        self.description_grams = defaultdict(set)
+        # Padded word trigrams for typo-tolerant matching
+        self.fuzzy_grams = defaultdict(set)
+
+        for item_id, (name, shortname, description) in enumerate(zip(self.names, self.shortnames, self.descriptions)):
+            for text in (name, shortname):
+                for match in WORD_RE.finditer(text):
+                    self.trie.insert(text[match.start():], item_id)
+                for n in (1, 2, 3):
+                    for gram in ngrams(text, n):
+                        self.grams[gram].add(item_id)
+                for gram in trigrams(text):
+                    self.fuzzy_grams[gram].add(item_id)
+            for n in (1, 2, 3):
+                for gram in ngrams(description, n):
+                    self.description_grams[gram].add(item_id)
+
+        # Fallback order for ties: shorter names first, then alphabetical
+        self.order = sorted(range(len(self.items)), key=lambda i: (len(self.names[i]), self.names[i]))
+        self.rank = {item_id: position for position, item_id in enumerate(self.order)}
+
+        # Ranked ids for short queries. Only queries that are 1- or 2-grams of the index are
+        # kept (others match nothing), so it can't grow past the index's own gram table
+        self.short_rankings = {}
+
+    def _substring_candidates(self, query, grams):
+        if len(query) <= 3:
+            return grams.get(query, set())
+        # Every trigram of the query must appear in a match, so intersect the smallest lists first
+        postings = sorted((grams.get(gram, set()) for gram in ngrams(query, 3)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+        return candidates
+
+    def score(self, query, descriptions=False):
+        """
+        Score every matching item for a normalized query. Returns {item_id: score}.
+        """
+        scores = {}
+
+        def add(item_ids, score):
+            for item_id in item_ids:
+                if scores.get(item_id, 0) < score:
+                    scores[item_id] = score
+
+        # Substring matches (the original search semantics)
+        candidates = self._substring_candidates(query, self.grams)
+        add((i for i in candidates if query in self.shortnames[i]), SUBSTRING_SCORE - SHORTNAME_PENALTY)
+        add((i for i in candidates if query in self.names[i]), SUBSTRING_SCORE)
+
+        # Word and whole-name prefixes
+        prefixed = self.trie.prefixed(query)
+        add(prefixed, WORD_PREFIX_SCORE - SHORTNAME_PENALTY)
+        add((i for i in prefixed if query in self.names[i]), WORD_PREFIX_SCORE)
+        add((i for i in prefixed if self.shortnames[i].startswith(query)), NAME_PREFIX_SCORE - SHORTNAME_PENALTY)
+        add((i for i in prefixed if self.names[i].startswith(query)), NAME_PREFIX_SCORE)
+        add((i for i in prefixed if self.shortnames[i] == query), EXACT_SCORE - SHORTNAME_PENALTY)
+        add((i for i in prefixed if self.names[i] == query), EXACT_SCORE)
+
+        # Typo-tolerant matches by shared trigrams
+        query_grams = trigrams(query) if len(query) >= FUZZY_MIN_LENGTH else None
+        if query_grams:
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self.fuzzy_grams.get(gram, ()))
+            for item_id, count in shared.items():
+                similarity = count / len(query_grams)
+                if similarity >= FUZZY_THRESHOLD and item_id not in scores:
+                    scores[item_id] = FUZZY_SCORE * similarity
+
+        if descriptions:
+            candidates = self._substring_candidates(query, self.description_grams)
+            add((i for i in candidates if query in self.descriptions[i]), DESCRIPTION_SCORE)
+
+        return scores
+
+    def search(self, query, limit=None, offset=0, descriptions=False):
+        """
+        Return the items matching the query, best match first.
+
+        Parameters:
+        query (str): Text to search for in item names and shortnames
+        limit (int): Maximum number of results (None = all)
+        offset (int): Number of results to skip, for paging
+        descriptions (bool): Also match item descriptions
+
+        Returns:
+        list: Matching items
+        """
+        query = normalize(query)
+        offset = max(0, offset)
+        end = None if limit is None else offset + max(0, limit)
+        if not query:
+            # Nothing but punctuation or spaces, which no name is searched by
+            return []
+
+        if len(query) <= SHORT_QUERY_LENGTH:
+            if query not in self.grams and not (descriptions and query in self.description_grams):
+                return []
+            ranked = self.short_rankings.get((query, descriptions))
+            if ranked is None:
+                scores = self.score(query, descriptions)
+                ranked = sorted(scores, key=lambda i: (-scores[i], self.rank[i]))
+                self.short_rankings[(query, descriptions)] = ranked
+            return [self.items[i] for i in ranked[offset:end]]
+
+        scores = self.score(query, descriptions)
+        key = lambda i: (-scores[i], self.rank[i])
+        # Only the first page needs ordering when there's a limit
+        ranked = sorted(scores, key=key) if end is None else heapq.nsmallest(end, scores, key=key)
+        return [self.items[i] for i in ranked[offset:end]]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    """
+    Return the search index for the current catalogue, rebuilding it when the catalogue changes.
+    """
+    global _index
+    snapshot = get_catalogue().current()
+    if snapshot is None:
+        return None
+    index = _index
+    if index is None or index.version != snapshot.version:
+        with _index_lock:
+            if _index is None or _index.version != snapshot.version:
+                _index = SearchIndex(snapshot.items, snapshot.version)
+            index = _index
+    return index
+
+
+def search_items(query, limit=None, offset=0, descriptions=False):
+    index = get_search_index()
+    if index is None:
+        return []
+    return index.search(query, limit=limit, offset=offset, descriptions=descriptions)
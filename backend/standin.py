@@ -0,0 +1,403 @@
+# This module runs a local stand-in for rusthelp so crawls can be measured without network access.
+# It renders item pages with the same recycling-tab markup parse_recycler_data expects,
+# from either real recycling data or a deterministic synthetic dataset, or replays a
+# corpus of pages recorded from rusthelp itself.
+import hashlib
+import html
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+# Items that recycle into nothing (they are what everything else breaks down into)
+RAW_RESOURCES = [
+    "Scrap", "Metal Fragments", "High Quality Metal", "Cloth", "Wood", "Stones",
+    "Leather", "Charcoal", "Sulfur", "Animal Fat", "Low Grade Fuel",
+]
+
+# Components that recycle into raw resources and show up in the output of other items
+COMPONENTS = [
+    "Gears", "Rope", "Tech Trash", "Metal Pipe", "Sewing Kit", "Metal Spring",
+    "Road Signs", "Sheet Metal", "Metal Blade", "Semi Automatic Body", "Rifle Body",
+    "SMG Body", "Electric Fuse", "Tarp", "Targeting Computer", "CCTV Camera",
+    "Empty Propane Tank",
+]
+
+# Class strings used by rusthelp for the recycling output cells
+ITEM_CLASS = "relative h-fit group/popover"
+AMOUNT_CLASS = "w-full font-semibold text-nowrap text-center"
+TOOLTIP_CLASS = "absolute w-full invisible"
+
+
+# The committed item catalogue, used as the offline fixture
+ITEMS_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "items.json")
+
+
+def load_item_fixture(path=ITEMS_FIXTURE):
+    """
+    Load the committed items.json directly, without the refresh logic in get_items().
+    """
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+# Where record_corpus saves the recorded item list and pages
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "corpus")
+ITEM_LIST_FILE = "admin-item-list-public.json"
+
+
+def record_corpus(folder=CORPUS_DIR, base_url="https://rusthelp.com", limit=None, **crawler_options):
+    """
+    Record rusthelp's item list and the item pages into a folder, so benchmarks can replay
+    the real markup offline (see load_corpus).
+
+    Parameters:
+    folder (str): Where the corpus is saved (the item list, and pages/<slug>.html)
+    base_url (str): Site to record from
+    limit (int): Only record the pages of this many items
+    crawler_options: Passed through to Crawler (concurrency, rate, retries...)
+
+    Returns:
+    tuple: (pages recorded, pages that failed)
+    """
+    # Imported here so the stand-in server itself doesn't need the crawler's dependencies
+    import asyncio
+
+    import requests
+
+    from crawler import Crawler
+    from items import items_from_list
+    from manifest import atomic_write_bytes
+    from recycler import HEADERS, item_url
+
+    response = requests.get(f"{base_url}/downloads/{ITEM_LIST_FILE}", headers=HEADERS, timeout=30)
+    response.raise_for_status()
+    items = items_from_list(response.json())
+    atomic_write_bytes(response.content, os.path.join(folder, ITEM_LIST_FILE))
+
+    names = sorted({item["name"] for item in items.values() if item.get("name")})[:limit]
+    pages_folder = os.path.join(folder, "pages")
+
+    def save(key, url, response):
+        atomic_write_bytes(response.content, os.path.join(pages_folder, f"{key}.html"))
+
+    async def crawl():
+        recorded, failed = 0, 0
+        with Crawler(**crawler_options) as crawler:
+            async for result in crawler.crawl([(slugify(name), item_url(name, base_url)) for name in names], save):
+                if result.error is None:
+                    recorded += 1
+                else:
+                    failed += 1
+                    print(f"Error recording {result.key}: {result.error}")
+        return recorded, failed
+
+    return asyncio.run(crawl())
+
+
+def load_corpus(folder=CORPUS_DIR):
+    """
+    Load a corpus saved by record_corpus.
+
+    Returns:
+    tuple: (items as get_items() returns them, {item name: page HTML}), or None if the
+        folder has no recorded item list
+    """
+    from items import items_from_list
+
+    try:
+        with open(os.path.join(folder, ITEM_LIST_FILE), "r", encoding="utf-8") as f:
+            items = items_from_list(json.load(f))
+    except FileNotFoundError:
+        return None
+    pages = {}
+    for item in items.values():
+        path = os.path.join(folder, "pages", f"{slugify(item['name'])}.html")
+        if item["name"] not in pages and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                pages[item["name"]] = f.read()
+    return items, pages
+
+
+def slugify(item_name):
+    # The crawler's slugs, so every item it asks for has a page
+    from recycler import slugify
+
+    return slugify(item_name)
+
+
+def synthetic_recycling_data(items, seed=0):
+    """
+    Build deterministic recycling data (in the scraped Radtown format) for every item.
+    Raw resources and roughly one in six other items have no recycling data at all.
+    """
+    data = {}
+    for item in items.values():
+        name = item.get("name", "")
+        if not name or name in RAW_RESOURCES:
+            continue
+        rng = random.Random(f"{seed}:{name}")
+
+        if name in COMPONENTS:
+            # Components break down into raw resources only, so the recycle graph stays acyclic
+            pool = RAW_RESOURCES[:4]
+        else:
+            if rng.random() < 1 / 6:
+                continue
+            pool = RAW_RESOURCES[:4] + COMPONENTS
+
+        guaranteed = [
+            {"item": output, "quantity": str(rng.randint(1, 12))}
+            for output in rng.sample(pool, rng.randint(1, 3))
+        ]
+        extra = [
+            {"item": output, "chance": f"{rng.choice([2, 5, 10, 20, 25, 50])}%"}
+            for output in rng.sample(pool, rng.randint(0, 2))
+        ]
+        data[name] = {"guaranteed_output": guaranteed, "extra_chance_output": extra}
+    return data
+
+
+def _render_output(item_name, amount):
+    name = html.escape(item_name)
+    slug = slugify(item_name)
+    return (
+        f'<div class="{ITEM_CLASS}">'
+        f'<a href="/items/{slug}"><img alt="{name}" src="https://cdn.rusthelp.com/images/public/{slug}.png" width="48" height="48"></a>'
+        f'<p class="{AMOUNT_CLASS}">{html.escape(amount)}</p>'
+        f'<div class="{TOOLTIP_CLASS}"><span>{name}</span></div>'
+        f"</div>"
+    )
+
+
+def _render_row(recycler_name, outputs, safezone=False):
+    guaranteed = []
+    for output in outputs["guaranteed_output"]:
+        quantity = output["quantity"]
+        if safezone:
+            # Safezone recyclers are less efficient than the Radtown ones
+            quantity = str(max(1, int(quantity) * 4 // 5)) if quantity.isdigit() else quantity
+        guaranteed.append(_render_output(output["item"], f"×{quantity}"))
+    extra = [_render_output(output["item"], output["chance"]) for output in outputs["extra_chance_output"]]
+    return (
+        "<tr>"
+        f'<td><a href="/recyclers">{recycler_name}</a></td>'
+        f'<td><div class="flex flex-wrap gap-2">{"".join(guaranteed)}</div></td>'
+        f'<td><div class="flex flex-wrap gap-2">{"".join(extra)}</div></td>'
+        "</tr>"
+    )
+
+
+def render_item_page(item_name, outputs=None, filler=40):
+    """
+    Render an HTML item page in the rusthelp layout.
+
+    Parameters:
+    item_name (str): Display name of the item
+    outputs (dict): Recycling data for the item (guaranteed_output / extra_chance_output), or None
+    filler (int): Number of filler rows in the other tabs, to keep pages at a realistic size
+
+    Returns:
+    str: The page HTML
+    """
+    name = html.escape(item_name)
+    nav = "".join(f'<li><a class="px-2 py-1 hover:underline" href="/items/item-{i}">Item {i}</a></li>' for i in range(filler))
+    crafting_rows = "".join(
+        f'<tr><td><div class="{ITEM_CLASS}"><img alt="Ingredient {i}" src="/i/{i}.png">'
+        f'<p class="{AMOUNT_CLASS}">×{i}</p></div></td><td>{i * 3}s</td></tr>'
+        for i in range(filler)
+    )
+
+    recycling = ""
+    if outputs is not None:
+        recycling = (
+            '<div id="recycling-tab" class="tab-panel">'
+            '<div class="overflow-x-auto"><table class="w-full">'
+            "<thead><tr><th>Recycler</th><th>Guaranteed Output</th><th>Extra Chance Output</th></tr></thead>"
+            "<tbody>"
+            f"{_render_row('Safezone Recycler', outputs, safezone=True)}"
+            f"{_render_row('Radtown Recycler', outputs)}"
+            "</tbody></table></div></div>"
+        )
+
+    return (
+        "<!DOCTYPE html><html><head>"
+        f"<title>{name} - Rust Help</title>"
+        '<meta charset="utf-8"><script>window.__data = {"page": "item"};</script>'
+        "</head><body>"
+        f'<nav><ul class="flex flex-col">{nav}</ul></nav>'
+        f'<main><h1 class="text-2xl">{name}</h1>'
+        f'<div id="crafting-tab" class="tab-panel"><table><thead><tr><th>Ingredients</th><th>Time</th></tr></thead>'
+        f"<tbody>{crafting_rows}</tbody></table></div>"
+        f"{recycling}"
+        "</main><footer><p>Rust Help</p></footer></body></html>"
+    )
+
+
+def _with_validators(body):
+    # (body, ETag, Last-Modified) as the server sends them
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    last_modified = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())
+    return body, etag, last_modified
+
+
+class StandinServer:
+    """
+    Local HTTP server that impersonates rusthelp for crawl benchmarks.
+
+    Parameters:
+    items (dict): Items as returned by get_items()
+    recycling_data (dict): Recycling data keyed by item name (defaults to synthetic data)
+    pages (dict): Page HTML to serve per item name instead of rendering its recycling data,
+        e.g. the pages of a recorded corpus
+    latency (float): Seconds each response is delayed, to simulate the network round trip
+    error_rate (float): Fraction of page requests answered with a 503
+    validators (bool): Send ETag / Last-Modified headers and answer conditional GETs with 304
+    icons (bool): Also serve a synthetic PNG at the path of every item's icon URL
+    host (str): Interface to bind to
+    port (int): Port to bind to (0 picks a free port)
+    """
+
+    def __init__(self, items, recycling_data=None, pages=None, latency=0.05, error_rate=0.0, validators=True, icons=False,
+                 host="127.0.0.1", port=0):
+        if recycling_data is None:
+            recycling_data = synthetic_recycling_data(items)
+        self.items = items
+        self.latency = latency
+        self.error_rate = error_rate
+        self.validators = validators
+        self.requests = 0
+        self.not_modified = 0
+        self.pages = {}
+        for item in items.values():
+            item_name = item.get("name", "")
+            if item_name and pages and item_name in pages:
+                self.set_page(item_name, pages[item_name])
+            elif item_name:
+                self.update_item(item_name, recycling_data.get(item_name))
+        self.icons = {}
+        if icons:
+            # Imported here so crawl benchmarks don't need OpenCV
+            import cv2
+            from standin_images import synthetic_icons
+
+            with_icons = [item for item in items.values() if item.get("icon")]
+            for item, (_, icon) in zip(with_icons, synthetic_icons(len(with_icons))):
+                self.update_icon(item, cv2.imencode(".png", icon)[1].tobytes())
+        self.item_list = json.dumps([
+            {
+                "id": item["id"],
+                "shortName": item["shortname"],
+                "displayName": item["name"],
+                "description": item["description"],
+                "iconUrl": item["icon"],
+            }
+            for item in items.values()
+        ]).encode("utf-8")
+        self._rng = random.Random(0)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    def update_item(self, item_name, outputs):
+        """
+        Replace the page for an item, as if rusthelp had changed its recycling data.
+        """
+        self.set_page(item_name, render_item_page(item_name, outputs))
+
+    def set_page(self, item_name, page):
+        """
+        Serve the given HTML as an item's page.
+        """
+        self.pages[f"/items/{slugify(item_name)}"] = _with_validators(page.encode("utf-8"))
+
+    def update_icon(self, item, png):
+        """
+        Replace the icon served for an item.
+        """
+        self.icons[urlsplit(item["icon"]).path] = _with_validators(png)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=b"", content_type="text/html; charset=utf-8", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    fail = server._rng.random() < server.error_rate
+                if server.latency:
+                    time.sleep(server.latency)
+
+                # Clients percent-encode non-ASCII slugs, pages are keyed by the decoded path
+                path = unquote(self.path.split("#", 1)[0].split("?", 1)[0])
+                if path == "/downloads/admin-item-list-public.json":
+                    return self._send(200, server.item_list, "application/json")
+                if fail:
+                    return self._send(503, b"Service Unavailable")
+                page = server.pages.get(path)
+                content_type = "text/html; charset=utf-8"
+                if page is None:
+                    page = server.icons.get(path)
+                    content_type = "image/png"
+                if page is None:
+                    return self._send(404, b"Not Found")
+
+                body, etag, last_modified = page
+                if not server.validators:
+                    return self._send(200, body, content_type)
+                headers = {"ETag": etag, "Last-Modified": last_modified}
+                if self.headers.get("If-None-Match") == etag:
+                    with server._lock:
+                        server.not_modified += 1
+                    return self._send(304, headers=headers)
+                self._send(200, body, content_type, headers=headers)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# Run the stand-in on its own so the CLI crawl can be pointed at it
+if __name__ == "__main__":
+    server = StandinServer(load_item_fixture(), port=8765)
+    print(f"Serving {len(server.pages)} item pages at {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
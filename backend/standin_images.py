@@ -0,0 +1,81 @@
+# This module draws stand-in item icons and inventory screenshots so detection can be
+# measured without the real icon set. Screenshots put icons in a slot grid like Rust's
+# inventory and come with the ground truth of what was placed where.
+import os
+
+import cv2
+import numpy as np
+
+BACKGROUND = (24, 26, 28)
+SLOT_COLOR = (58, 60, 62)
+
+
+def synthetic_icons(count, size=64, seed=0):
+    """
+    Draw `count` distinct icons of size x size pixels: a few filled shapes over a textured
+    backdrop, so each icon has structure for template matching.
+    Returns a list of (name, BGR image).
+    """
+    rng = np.random.default_rng(seed)
+    icons = []
+    for i in range(count):
+        noise = rng.integers(0, 256, (size // 8 + 1, size // 8 + 1, 3), dtype=np.uint8)
+        icon = cv2.resize(noise, (size, size), interpolation=cv2.INTER_CUBIC)
+        for _ in range(3):
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            center = tuple(int(c) for c in rng.integers(size // 4, 3 * size // 4, 2))
+            if rng.random() < 0.5:
+                cv2.circle(icon, center, int(rng.integers(size // 8, size // 3)), color, -1)
+            else:
+                corner = tuple(int(c) for c in rng.integers(0, size, 2))
+                cv2.rectangle(icon, center, corner, color, -1)
+        icons.append((f"icon.{i:04d}", icon))
+    return icons
+
+
+def write_icons(icons, folder):
+    """
+    Save icons as <name>.png in a folder, the way download_images lays them out.
+    """
+    os.makedirs(folder, exist_ok=True)
+    for name, icon in icons:
+        cv2.imwrite(os.path.join(folder, f"{name}.png"), icon)
+
+
+def render_inventory(icons, columns=6, rows=4, fill=0.75, padding=4, gap=6, origin=(40, 40), size=(1920, 1080), seed=0):
+    """
+    Draw an inventory screenshot: a grid of slots, some holding a randomly chosen icon.
+
+    Parameters:
+    icons (list): (name, BGR image) pairs, all the same size
+    columns (int): Slots per row
+    rows (int): Rows of slots
+    fill (float): Fraction of slots that hold an icon
+    padding (int): Pixels between a slot's edge and its icon
+    gap (int): Pixels between slots
+    origin (tuple): (x, y) of the top-left slot
+    size (tuple): (width, height) of the screenshot
+    seed (int): Seed for which icons go where
+
+    Returns:
+    tuple: (BGR screenshot, ground truth list of {"item", "x", "y"} icon positions)
+    """
+    rng = np.random.default_rng(seed)
+    icon_h, icon_w = icons[0][1].shape[:2]
+    slot_w, slot_h = icon_w + 2 * padding, icon_h + 2 * padding
+
+    image = np.empty((size[1], size[0], 3), dtype=np.uint8)
+    image[:] = BACKGROUND
+    truth = []
+    for row in range(rows):
+        for column in range(columns):
+            x = origin[0] + column * (slot_w + gap)
+            y = origin[1] + row * (slot_h + gap)
+            if x + slot_w > size[0] or y + slot_h > size[1]:
+                continue
+            cv2.rectangle(image, (x, y), (x + slot_w - 1, y + slot_h - 1), SLOT_COLOR, -1)
+            if rng.random() < fill:
+                name, icon = icons[int(rng.integers(len(icons)))]
+                image[y + padding:y + padding + icon_h, x + padding:x + padding + icon_w] = icon
+                truth.append({"item": name, "x": x + padding, "y": y + padding})
+    return image, truth
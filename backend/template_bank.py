@@ -0,0 +1,311 @@
+# This module packs the downloaded item icons into a single template bank file.
+# Every icon is decoded to grayscale once, stored back to back in one pixel array and saved
+# with its per-template statistics (mean and zero-mean norm, the terms TM_CCOEFF_NORMED
+# divides by). Detection loads the bank once per process instead of decoding every PNG
+# for every screenshot.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from packed import PackedFile, write_packed
+
+MAGIC = b"RRTB"
+FORMAT_VERSION = 1
+ICON_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp")
+# Side of the thumbnails used as per-icon feature vectors
+FEATURE_SIZE = 16
+# Rescaled banks kept in memory by get_scaled_bank
+SCALED_BANKS = 4
+
+
+def normalize_features(vectors):
+    """
+    Make each row zero-mean and unit-length, so a dot product is a correlation.
+    """
+    vectors = vectors - vectors.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-6)
+
+
+def thumbnail(image, size=FEATURE_SIZE):
+    """
+    Shrink a grayscale image to a size x size float32 feature vector.
+    """
+    return cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+
+
+def resize_template(template, scale):
+    """
+    Resize a template by `scale` (at least 1 pixel a side). Shrinking averages pixels
+    (INTER_AREA), enlarging interpolates (INTER_LINEAR).
+    """
+    h, w = template.shape
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    return cv2.resize(template, size, interpolation=interpolation)
+
+
+def default_bank_file(icons_folder):
+    """
+    Where the bank for a folder is saved: next to it, images -> images_bank.bin.
+    It lives outside the folder so it isn't mistaken for an icon.
+    """
+    return os.path.abspath(icons_folder).rstrip("\\/") + "_bank.bin"
+
+
+def icon_files(icons_folder):
+    """
+    Return the icon image files in a folder, sorted by name.
+    """
+    return sorted(
+        (path for path in Path(icons_folder).glob("*") if path.suffix.lower() in ICON_SUFFIXES),
+        key=lambda path: path.name,
+    )
+
+
+class TemplateBank:
+    """
+    Grayscale icon templates packed into flat arrays.
+
+    Parameters:
+    names (list): Icon name (file stem) per template
+    shapes (np.ndarray): (templates x 2) int32 array of (height, width)
+    offsets (np.ndarray): Pixels of template i are pixels[offsets[i]:offsets[i + 1]]
+    pixels (np.ndarray): uint8 pixels of every template, row-major, back to back
+    means (np.ndarray): Mean pixel value per template
+    norms (np.ndarray): L2 norm of (template - mean) per template
+    version (str): Hash of the names and pixels, changes whenever any icon does
+    """
+
+    def __init__(self, names, shapes, offsets, pixels, means, norms, version, packed=None):
+        self.names = names
+        self.shapes = shapes
+        self.offsets = offsets
+        self.pixels = pixels
+        self.means = means
+        self.norms = norms
+        self.version = version
+        self.packed = packed
+        self.index = {name: i for i, name in enumerate(names)}
+        self._groups = None
+        self._features = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __reduce__(self):
+        # A mapped bank is sent to worker processes as its path, so they map the same file
+        if self.packed is not None:
+            return TemplateBank.load, (self.packed.path,)
+        return TemplateBank, (self.names, self.shapes, self.offsets, self.pixels, self.means, self.norms, self.version)
+
+    def template(self, i):
+        """
+        Return template i as a (height, width) uint8 view into the bank.
+        """
+        h, w = self.shapes[i]
+        return self.pixels[self.offsets[i]:self.offsets[i + 1]].reshape(int(h), int(w))
+
+    def groups(self, indices=None):
+        """
+        Group templates by size: {(height, width): [template indices]}.
+        Most item icons share one size, so batched matching works per group.
+
+        Parameters:
+        indices (list): Only group these templates (default: all of them)
+        """
+        if indices is not None:
+            groups = {}
+            for i in indices:
+                h, w = self.shapes[i]
+                groups.setdefault((int(h), int(w)), []).append(i)
+            return groups
+        if self._groups is None:
+            self._groups = self.groups(range(len(self)))
+        return self._groups
+
+    def features(self):
+        """
+        Return a (templates x FEATURE_SIZE^2) matrix of normalized icon thumbnails, for
+        comparing a crop with every icon in one matrix product.
+        """
+        if self._features is None:
+            thumbnails = [thumbnail(self.template(i)) for i in range(len(self))]
+            self._features = normalize_features(np.array(thumbnails, dtype=np.float32).reshape(len(self), -1))
+        return self._features
+
+    def scaled(self, scale):
+        """
+        Return a new bank with every template resized by `scale`, see resize_template.
+        """
+        return TemplateBank.from_images(self.names, [resize_template(self.template(i), scale) for i in range(len(self))])
+
+    def shards(self, count):
+        """
+        Split the templates into `count` lists of indices of about equal size. Each size
+        group is split evenly, so every shard can still match its templates in batches.
+        """
+        shards = [[] for _ in range(count)]
+        for indices in self.groups().values():
+            for k in range(count):
+                shards[k].extend(indices[k * len(indices) // count:(k + 1) * len(indices) // count])
+        return [shard for shard in shards if shard]
+
+    @classmethod
+    def from_images(cls, names, images):
+        """
+        Build a bank from grayscale images (2D uint8 arrays), one per name.
+        """
+        shapes = np.array([image.shape for image in images], dtype=np.int32).reshape(-1, 2)
+        offsets = np.zeros(len(images) + 1, dtype=np.int64)
+        np.cumsum([image.size for image in images], out=offsets[1:])
+        pixels = np.concatenate([image.ravel() for image in images]) if images else np.empty(0, dtype=np.uint8)
+        pixels = pixels.astype(np.uint8, copy=False)
+
+        means = np.zeros(len(images), dtype=np.float64)
+        norms = np.zeros(len(images), dtype=np.float64)
+        for i, image in enumerate(images):
+            values = image.astype(np.float64)
+            means[i] = values.mean()
+            norms[i] = np.sqrt(np.square(values - means[i]).sum())
+
+        digest = hashlib.sha256()
+        for name, (h, w) in zip(names, shapes):
+            digest.update(f"{name}:{h}x{w};".encode("utf-8"))
+        digest.update(pixels.tobytes())
+        return cls(list(names), shapes, offsets, pixels, means, norms, digest.hexdigest())
+
+    @classmethod
+    def build(cls, icons_folder):
+        """
+        Decode every icon in a folder to grayscale and pack them into a bank.
+        Unreadable files are skipped with a warning.
+        """
+        names = []
+        images = []
+        for icon_file in icon_files(icons_folder):
+            icon = cv2.imread(str(icon_file), cv2.IMREAD_GRAYSCALE)
+            if icon is None:
+                print(f"Warning: Unable to read icon image at {icon_file}")
+                continue
+            names.append(icon_file.stem)
+            images.append(icon)
+        return cls.from_images(names, images)
+
+    def save(self, path):
+        header = {"names": self.names, "version": self.version}
+        arrays = {
+            "shapes": self.shapes,
+            "offsets": self.offsets,
+            "pixels": self.pixels,
+            "means": self.means,
+            "norms": self.norms,
+        }
+        write_packed(path, MAGIC, FORMAT_VERSION, header, arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-map a saved bank. Raises FileNotFoundError or ValueError if it can't be read.
+        """
+        packed = PackedFile(path, MAGIC, FORMAT_VERSION)
+        arrays = packed.arrays
+        return cls(
+            packed.header["names"],
+            arrays["shapes"],
+            arrays["offsets"],
+            arrays["pixels"],
+            arrays["means"],
+            arrays["norms"],
+            packed.header["version"],
+            packed,
+        )
+
+
+def build_bank_file(icons_folder, bank_file=None):
+    """
+    Build the bank for a folder and save it. Called by download_images after downloading.
+    """
+    bank = TemplateBank.build(icons_folder)
+    bank.save(bank_file or default_bank_file(icons_folder))
+    return bank
+
+
+def _newest_icon_mtime(icons_folder):
+    # The folder mtime catches added and removed icons, the file mtimes replaced ones
+    mtimes = [os.path.getmtime(icons_folder)]
+    mtimes.extend(path.stat().st_mtime for path in icon_files(icons_folder))
+    return max(mtimes)
+
+
+_banks = {}
+_banks_lock = threading.Lock()
+
+
+def get_template_bank(icons_folder, bank_file=None):
+    """
+    Return the template bank for an icons folder, loaded once per process.
+    The saved bank is used unless an icon is newer than it, in which case it is rebuilt
+    (and saved again).
+
+    Parameters:
+    icons_folder (str): Folder of icon images, as written by download_images
+    bank_file (str): Saved bank, defaults to default_bank_file(icons_folder)
+    """
+    bank_file = bank_file or default_bank_file(icons_folder)
+    key = (os.path.abspath(icons_folder), os.path.abspath(bank_file))
+    bank = _banks.get(key)
+    if bank is not None:
+        return bank
+    with _banks_lock:
+        if key not in _banks:
+            bank = None
+            try:
+                if os.path.getmtime(bank_file) >= _newest_icon_mtime(icons_folder):
+                    bank = TemplateBank.load(bank_file)
+            except (OSError, ValueError, KeyError):
+                bank = None
+            if bank is None:
+                bank = TemplateBank.build(icons_folder)
+                try:
+                    bank.save(bank_file)
+                    # Map the saved copy, so worker processes can share it
+                    bank = TemplateBank.load(bank_file)
+                except OSError as e:
+                    print(f"Warning: Unable to save template bank to {bank_file}: {e}")
+            _banks[key] = bank
+        return _banks[key]
+
+
+_scaled_banks = OrderedDict()
+_scaled_banks_lock = threading.Lock()
+
+
+def get_scaled_bank(bank, scale):
+    """
+    Return the bank resized by `scale`, keeping the SCALED_BANKS most recently used
+    rescaled banks, so screenshots at the same resolution don't resize the icons again.
+    A scale of 1 returns the bank itself.
+    """
+    scale = round(float(scale), 3)
+    if scale == 1:
+        return bank
+    key = (bank.version, scale)
+    with _scaled_banks_lock:
+        scaled = _scaled_banks.get(key)
+        if scaled is not None:
+            _scaled_banks.move_to_end(key)
+            return scaled
+
+    scaled = bank.scaled(scale)
+    with _scaled_banks_lock:
+        _scaled_banks[key] = scaled
+        _scaled_banks.move_to_end(key)
+        while len(_scaled_banks) > SCALED_BANKS:
+            _scaled_banks.popitem(last=False)
+    return scaled
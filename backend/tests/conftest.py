@@ -0,0 +1,5 @@
+# The backend modules import each other by bare name, so the tests run with backend/ on the path
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
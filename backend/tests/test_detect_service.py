@@ -0,0 +1,60 @@
+import struct
+import zlib
+
+import cv2
+import numpy as np
+import pytest
+
+from detect_service import DetectError, DetectService, image_size
+
+
+@pytest.mark.parametrize("extension, params", [
+    (".png", []),
+    (".jpg", []),
+    (".jpg", [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]),
+    (".webp", [cv2.IMWRITE_WEBP_QUALITY, 80]),
+    (".webp", [cv2.IMWRITE_WEBP_QUALITY, 101]),
+    (".bmp", []),
+])
+def test_image_size_reads_the_header(extension, params):
+    image = np.random.default_rng(0).integers(0, 255, (123, 457, 3), dtype=np.uint8)
+    ok, encoded = cv2.imencode(extension, image, params)
+    assert ok
+    assert image_size(encoded.tobytes()) == (457, 123)
+
+
+def test_image_size_of_unknown_or_cut_short_data():
+    assert image_size(b"GIF89a") is None
+    assert image_size(b"\xff\xd8\xff") is None
+    assert image_size(b"\x89PNG\r\n\x1a\n") is None
+
+
+def _png_bomb(width, height):
+    # A few hundred bytes that declare a width x height image of zeros
+    def chunk(kind, payload):
+        return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload))
+
+    rows = zlib.compressobj(9)
+    pixels = rows.compress(b"\0" * 65536) + rows.flush()
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", pixels) + chunk(b"IEND", b"")
+
+
+def test_huge_images_are_rejected_before_decoding():
+    service = DetectService(cache_folder=None)
+    try:
+        with pytest.raises(DetectError) as error:
+            service._detect(_png_bomb(100_000, 100_000), {})
+        assert error.value.status == 413
+
+        ok, encoded = cv2.imencode(".png", np.zeros((100, 100, 3), dtype=np.uint8))
+        service.max_image_pixels = 100 * 99
+        with pytest.raises(DetectError) as error:
+            service._detect(encoded.tobytes(), {})
+        assert error.value.status == 413
+
+        with pytest.raises(DetectError) as error:
+            service._detect(b"GIF89a" + b"\0" * 64, {})
+        assert error.value.status == 415
+    finally:
+        service.executor.shutdown()
@@ -0,0 +1,100 @@
+# Regenerating the recycling data against the local stand-in server
+import itertools
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import main
+from standin import StandinServer, load_item_fixture, synthetic_recycling_data
+
+DATA_FILES = ["all_recycling_data.json", "recycling_manifest.json", "recycling_sources.json", "all_recycling_data.bin"]
+
+
+def read_files(folder):
+    contents = {}
+    for name in DATA_FILES:
+        with open(os.path.join(folder, name), "rb") as f:
+            contents[name] = f.read()
+    return contents
+
+
+@pytest.fixture
+def items(monkeypatch):
+    items = dict(itertools.islice(load_item_fixture().items(), 80))
+    monkeypatch.setattr(main, "get_items", lambda: items)
+    return items
+
+
+def test_cancelled_full_run_keeps_previous_dataset(tmp_path, items):
+    with StandinServer(items, latency=0) as server:
+        options = {"data_dir": str(tmp_path), "base_url": server.base_url, "rate": 0, "verbose": False}
+        first = main.generate_recycling_data(**options)
+        assert first["finished"] and first["items"] > 0
+        before = read_files(tmp_path)
+
+        cancel = threading.Event()
+
+        def progress(fetched=0, **values):
+            if fetched >= 5:
+                cancel.set()
+
+        stopped = main.generate_recycling_data(full=True, progress=progress, cancel=cancel, **options)
+        assert stopped["cancelled"] and not stopped["finished"]
+        # Nothing was committed, and the journal is kept for the next run
+        assert read_files(tmp_path) == before
+        assert os.path.exists(tmp_path / "all_recycling_data.journal")
+
+        resumed = main.generate_recycling_data(full=True, **options)
+        assert resumed["finished"] and resumed["items"] == first["items"]
+        assert not os.path.exists(tmp_path / "all_recycling_data.journal")
+        with open(tmp_path / "all_recycling_data.json", "rb") as f:
+            assert f.read() == before["all_recycling_data.json"]
+
+
+def test_duplicate_names_are_crawled_and_written_once(tmp_path, monkeypatch):
+    catalogue = load_item_fixture()
+    names = [item.get("name") for item in catalogue.values()]
+    duplicated = {name for name in names if name and names.count(name) > 1}
+    items = {key: item for key, item in catalogue.items() if item.get("name") in duplicated}
+    monkeypatch.setattr(main, "get_items", lambda: items)
+
+    with StandinServer(items, latency=0) as server:
+        stats = main.generate_recycling_data(data_dir=str(tmp_path), base_url=server.base_url, rate=0, verbose=False)
+        # Every name is fetched once
+        assert server.requests == len(duplicated)
+    with open(tmp_path / "all_recycling_data.json", "r", encoding="utf-8") as f:
+        pairs = json.load(f, object_pairs_hook=lambda pairs: pairs)
+    written = [name for name, _ in pairs]
+    assert len(written) == len(set(written)) == stats["items"]
+
+
+def test_cancel_doesnt_wait_for_slow_hosts(tmp_path, items):
+    # Every page takes far longer than the cancel should
+    with StandinServer(items, latency=5) as server:
+        cancel = threading.Event()
+        threading.Timer(0.2, cancel.set).start()
+        start = time.perf_counter()
+        stats = main.generate_recycling_data(
+            data_dir=str(tmp_path), base_url=server.base_url, rate=0, verbose=False, cancel=cancel, retries=0,
+        )
+        assert time.perf_counter() - start < 2
+    assert stats["cancelled"] and not stats["finished"] and not stats["written"]
+    assert not os.path.exists(tmp_path / "all_recycling_data.json")
+
+
+def test_non_ascii_names_are_fetched(tmp_path, monkeypatch):
+    catalogue = load_item_fixture()
+    items = {key: item for key, item in catalogue.items() if not item.get("name", "").isascii()}
+    assert any(item["name"].startswith("Rustigé Egg") for item in items.values())
+    monkeypatch.setattr(main, "get_items", lambda: items)
+
+    with StandinServer(items, latency=0) as server:
+        stats = main.generate_recycling_data(data_dir=str(tmp_path), base_url=server.base_url, rate=0, verbose=False)
+    with open(tmp_path / "all_recycling_data.json", "r", encoding="utf-8") as f:
+        written = json.load(f)
+    # Every page was found, not answered with a 404
+    assert stats["finished"] and stats["failed"] == 0
+    assert set(written) == set(synthetic_recycling_data(items))
@@ -0,0 +1,19 @@
+# The fast recycling-tab parser against the full html.parser parse
+import pytest
+
+from bench_parse import build_corpus, check_identical
+from recycler import extract_recycling_tab, parse_recycler_data
+
+PAGES = build_corpus()
+
+
+@pytest.mark.parametrize("name", sorted(PAGES))
+def test_fast_parse_matches_full_parse(name):
+    assert check_identical({name: PAGES[name]}) == []
+
+
+def test_tab_markup_in_scripts_and_attributes_is_not_a_tab():
+    page = PAGES["script-decoy.html"]
+    tab = extract_recycling_tab(page)
+    assert tab.startswith('<div id="recycling-tab" class="tab-panel">') and "<table" in tab
+    assert parse_recycler_data(page, no_safezone=True)["guaranteed_output"]
@@ -0,0 +1,25 @@
+import json
+
+from items import CatalogueSnapshot
+from recycler import item_url
+from recycler_service import RecyclerService, RecyclingDataset, item_slug, resolve_item_query
+from standin import load_item_fixture
+
+NAME = "Rustigé Egg - Red"
+ENCODED_URL = "https://rusthelp.com/items/rustig%C3%A9-egg---red#recycling"
+
+
+def test_encoded_queries_resolve_like_plain_ones():
+    catalogue = CatalogueSnapshot(load_item_fixture(), 0, 0)
+    assert resolve_item_query("Rustig%C3%A9%20Egg%20-%20Red", catalogue) == (item_url(NAME), None)
+    assert resolve_item_query("Rustig%C3%A9%20Egg%20-%20Red") == (item_url(NAME), None)
+    assert item_slug(ENCODED_URL) == item_slug(item_url(NAME)) == "rustigé-egg---red"
+    assert RecyclerService.cache_key(ENCODED_URL) == RecyclerService.cache_key(item_url(NAME))
+
+
+def test_dataset_finds_encoded_urls(tmp_path):
+    entry = {"guaranteed_output": [{"item": "Scrap", "quantity": "1"}], "extra_chance_output": []}
+    path = tmp_path / "all_recycling_data.json"
+    path.write_text(json.dumps({NAME: entry}), encoding="utf-8")
+    dataset = RecyclingDataset(str(path))
+    assert dataset.get(ENCODED_URL) == dataset.get(item_url(NAME)) == entry
@@ -0,0 +1,320 @@
+# This module compiles the scraped recycling data into a numeric recycle graph.
+# Quantities ("2", "1-3") and chances ("25%") are parsed to numbers so we can answer
+# "what do I get from recycling N of X", optionally recycling the outputs again
+# until only things that can't be recycled are left. Items that recycle into each other
+# (the strongly connected components of the graph) are solved together as one system.
+import re
+import threading
+
+import numpy as np
+
+NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def parse_quantity(text):
+    """
+    Parse a guaranteed output quantity: "2" -> 2, "×2" -> 2, "1-3" -> 2 (the average).
+    Anything without a number counts as 0.
+    """
+    numbers = [float(number) for number in NUMBER_RE.findall(str(text).replace(",", ""))]
+    if not numbers:
+        return 0.0
+    return sum(numbers) / len(numbers)
+
+
+def parse_chance(text):
+    """
+    Parse an extra chance output: "25%" -> 0.25. Unknown chances count as 0.
+    """
+    numbers = NUMBER_RE.findall(str(text))
+    if not numbers:
+        return 0.0
+    return min(1.0, float(numbers[0]) / 100)
+
+
+def direct_yield(entry):
+    """
+    Expected outputs from recycling one item, as {output name: expected amount}.
+    Each extra chance output is one item with the given probability.
+    """
+    outputs = {}
+    for output in entry.get("guaranteed_output", []):
+        outputs[output["item"]] = outputs.get(output["item"], 0.0) + parse_quantity(output["quantity"])
+    for output in entry.get("extra_chance_output", []):
+        outputs[output["item"]] = outputs.get(output["item"], 0.0) + parse_chance(output["chance"])
+    return outputs
+
+
+def find_cycles(direct):
+    """
+    Find the groups of items that recycle into each other, directly or through other items
+    (the strongly connected components of the recycle graph, with Tarjan's algorithm).
+
+    Parameters:
+    direct (dict): {source: {output: expected amount}}
+
+    Returns:
+    dict: {name: tuple of the names in its group} for every item on a cycle
+    """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    cycles = {}
+    for root in direct:
+        if root in index:
+            continue
+        # Iterative depth-first search; each frame is (item, iterator over its outputs)
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        frames = [(root, iter(direct[root]))]
+        while frames:
+            name, outputs = frames[-1]
+            for output in outputs:
+                if output not in direct:
+                    continue
+                if output not in index:
+                    index[output] = low[output] = len(index)
+                    stack.append(output)
+                    on_stack.add(output)
+                    frames.append((output, iter(direct[output])))
+                    break
+                if output in on_stack:
+                    low[name] = min(low[name], index[output])
+            else:
+                frames.pop()
+                if frames:
+                    parent = frames[-1][0]
+                    low[parent] = min(low[parent], low[name])
+                if low[name] == index[name]:
+                    group = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        group.append(member)
+                        if member == name:
+                            break
+                    if len(group) > 1 or name in direct[name]:
+                        group = tuple(group)
+                        for member in group:
+                            cycles[member] = group
+    return cycles
+
+
+class YieldGraph:
+    """
+    Compiled recycle graph over one version of the recycling dataset.
+
+    Parameters:
+    recycling_data (dict): Recycling data keyed by item name, as in all_recycling_data.json
+    version: Version of the dataset the graph was built from
+    direct (dict): Already parsed {source: {output: expected amount}}, used instead of recycling_data
+    """
+
+    def __init__(self, recycling_data=None, version=None, direct=None):
+        self.version = version
+        if direct is None:
+            direct = {name: direct_yield(entry) for name, entry in recycling_data.items()}
+        self.direct = direct
+
+        # Every item that appears anywhere gets an index
+        names = list(self.direct)
+        seen = set(names)
+        for outputs in self.direct.values():
+            for output in outputs:
+                if output not in seen:
+                    seen.add(output)
+                    names.append(output)
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.lookup = {name.casefold(): name for name in names}
+        self.recyclable = np.array([name in self.direct for name in names], dtype=bool)
+
+        self.cycles = find_cycles(self.direct)
+        self.memo = {}
+        self.lock = threading.Lock()
+        self._totals_matrix = None
+        self._direct_matrix = None
+
+    def resolve(self, name):
+        """
+        Return the graph's spelling of an item name (case-insensitive), or None.
+        """
+        return self.lookup.get(name.casefold()) if name else None
+
+    def totals(self, name):
+        """
+        Expected raw resources from recycling one `name`, recycling every recyclable output
+        again. Memoized per item. Items that recycle into each other are recycled until
+        the expected amounts settle, which is solved exactly; a loop that yields more of
+        its own items than it consumes never settles, so those are counted as-is instead.
+        """
+        result = self.memo.get(name)
+        if result is not None:
+            return result
+        if name not in self.direct:
+            return {name: 1.0}
+        if name in self.cycles:
+            self._solve_cycle(self.cycles[name])
+            return self.memo[name]
+
+        result = {}
+        for output, amount in self.direct[name].items():
+            for resource, per_unit in self.totals(output).items():
+                result[resource] = result.get(resource, 0.0) + amount * per_unit
+        self.memo[name] = result
+        return result
+
+    def _solve_cycle(self, group):
+        # Each member's totals x = e + R x, where R holds how much the members yield of
+        # each other and e the totals of everything else they yield, so x = (I - R)^-1 e
+        position = {name: k for k, name in enumerate(group)}
+        inner = np.zeros((len(group), len(group)))
+        outer = []
+        for k, name in enumerate(group):
+            parts = {}
+            for output, amount in self.direct[name].items():
+                if output in position:
+                    inner[k, position[output]] += amount
+                    continue
+                for resource, per_unit in self.totals(output).items():
+                    parts[resource] = parts.get(resource, 0.0) + amount * per_unit
+            outer.append(parts)
+
+        if np.abs(np.linalg.eigvals(inner)).max() >= 1:
+            # Recycling the loop again and again would yield ever more
+            for k, name in enumerate(group):
+                result = dict(outer[k])
+                for j in np.flatnonzero(inner[k]):
+                    result[group[j]] = result.get(group[j], 0.0) + float(inner[k, j])
+                self.memo[name] = result
+            return
+
+        resources = sorted({resource for parts in outer for resource in parts})
+        columns = {resource: c for c, resource in enumerate(resources)}
+        rhs = np.zeros((len(group), len(resources)))
+        for k, parts in enumerate(outer):
+            for resource, amount in parts.items():
+                rhs[k, columns[resource]] = amount
+        solved = np.linalg.solve(np.eye(len(group)) - inner, rhs)
+        for k, name in enumerate(group):
+            self.memo[name] = {resources[c]: float(solved[k, c]) for c in np.flatnonzero(solved[k])}
+
+    def recycle(self, name, quantity=1, recursive=True):
+        """
+        Expected outputs from recycling `quantity` of `name`.
+        Returns None if the item can't be recycled.
+        """
+        if name not in self.direct:
+            return None
+        per_unit = self.totals(name) if recursive else self.direct[name]
+        return {output: amount * quantity for output, amount in per_unit.items()}
+
+    @property
+    def totals_matrix(self):
+        """
+        Matrix T where row i holds the recursive expected yield of one of item i
+        (non-recyclable items map to themselves).
+        """
+        if self._totals_matrix is None:
+            with self.lock:
+                if self._totals_matrix is None:
+                    matrix = np.zeros((len(self.names), len(self.names)))
+                    for name, i in self.index.items():
+                        for resource, amount in self.totals(name).items():
+                            matrix[i, self.index[resource]] = amount
+                    self._totals_matrix = matrix
+        return self._totals_matrix
+
+    @property
+    def direct_matrix(self):
+        """
+        Matrix D where row i holds the direct expected yield of one of item i
+        (non-recyclable items map to themselves).
+        """
+        if self._direct_matrix is None:
+            matrix = np.zeros((len(self.names), len(self.names)))
+            for name, i in self.index.items():
+                for output, amount in (self.direct.get(name) or {name: 1.0}).items():
+                    matrix[i, self.index[output]] = amount
+            self._direct_matrix = matrix
+        return self._direct_matrix
+
+    def inventory_vector(self, inventory):
+        """
+        Turn {item name: count} into a count vector. Returns (vector, unknown names).
+        """
+        vector = np.zeros(len(self.names))
+        unknown = []
+        for name, count in inventory.items():
+            resolved = self.resolve(name)
+            if resolved is None:
+                unknown.append(name)
+            else:
+                vector[self.index[resolved]] += count
+        return vector, unknown
+
+    def evaluate_inventories(self, inventories, recursive=True):
+        """
+        Expected yield of recycling several whole inventories at once.
+
+        Parameters:
+        inventories (list): One {item name: count} dict per inventory
+        recursive (bool): Keep recycling outputs until only raw resources are left
+
+        Returns:
+        list: (totals dict, unknown item names) for each inventory
+        """
+        vectors = []
+        unknowns = []
+        for inventory in inventories:
+            vector, unknown = self.inventory_vector(inventory)
+            vectors.append(vector)
+            unknowns.append(unknown)
+        if not vectors:
+            return []
+
+        # One matrix product evaluates every inventory: (inventories x items) @ (items x items)
+        matrix = self.totals_matrix if recursive else self.direct_matrix
+        results = np.stack(vectors) @ matrix
+
+        evaluated = []
+        for row, unknown in zip(results, unknowns):
+            nonzero = np.flatnonzero(row)
+            evaluated.append(({self.names[i]: float(row[i]) for i in nonzero}, unknown))
+        return evaluated
+
+    def evaluate_inventory(self, inventory, recursive=True):
+        return self.evaluate_inventories([inventory], recursive)[0]
+
+    @classmethod
+    def from_compiled(cls, compiled, version=None):
+        """
+        Build the graph from a memory-mapped CompiledDataset, skipping the JSON entirely.
+        """
+        return cls(version=version, direct=compiled.direct_yields())
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_yield_graph(dataset):
+    """
+    Return the YieldGraph for the current version of a RecyclingDataset, rebuilding it
+    when the dataset is reloaded. Built from the compiled file when the dataset has one.
+    """
+    global _graph
+    dataset.refresh()
+    graph = _graph
+    if graph is None or graph.version != dataset.version:
+        with _graph_lock:
+            if _graph is None or _graph.version != dataset.version:
+                compiled, data, version = dataset.snapshot()
+                if compiled is not None:
+                    _graph = YieldGraph.from_compiled(compiled, version)
+                else:
+                    _graph = YieldGraph(data, version)
+            graph = _graph
+    return graph